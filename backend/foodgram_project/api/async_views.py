@@ -0,0 +1,135 @@
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+from asgiref.sync import sync_to_async
+from django.db import close_old_connections
+from django.urls import URLPattern
+from django.utils.cache import patch_vary_headers
+from rest_framework.exceptions import NotAcceptable
+from rest_framework.negotiation import DefaultContentNegotiation
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+
+from recipes import consts
+from . import metrics
+from .authentication import token_cache
+
+# Django 3.2 без async ORM: работа с базой идет в потоках этого пула.
+# Размер пула ограничивает и число соединений процесса с базой.
+executor = ThreadPoolExecutor(
+    consts.ASYNC_VIEW_WORKERS, thread_name_prefix='async-view'
+)
+
+
+def threaded(function):
+    """Корутина, выполняющая function в потоке пула.
+
+    Соединения закрываются так же, как сигналы начала и конца запроса
+    закрывают их для синхронных представлений.
+    """
+    def run(*args, **kwargs):
+        close_old_connections()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            close_old_connections()
+    return sync_to_async(run, thread_sensitive=False, executor=executor)
+
+
+def respond(view, request, *args, **kwargs):
+    """Выполняет DRF-представление и рендерит ответ."""
+    response = view(request, *args, **kwargs)
+    if hasattr(response, 'render'):
+        metrics.render(response)
+    return response
+
+
+def authenticated_by_cache(request):
+    """Запрос без токена или с токеном из кэша аутентификации."""
+    header = request.META.get('HTTP_AUTHORIZATION', '').split()
+    if not header:
+        return True
+    return (
+        len(header) == 2
+        and header[0] == 'Token'
+        and token_cache.get(header[1]) is not None
+    )
+
+
+def cached_response(view, request):
+    """Ответ VersionedCacheMixin из кэша без DRF и без запросов к данным.
+
+    Общий кэш - это сеть или база, поэтому поиск тоже идет в потоке.
+
+    None, если ответа в кэше нет или его нужно строить через DRF:
+    другой метод, неизвестный токен, формат не JSON.
+    """
+    if request.method not in ('GET', 'HEAD'):
+        return None
+    if not authenticated_by_cache(request):
+        return None
+    drf_request = Request(request)
+    try:
+        renderer, media_type = DefaultContentNegotiation().select_renderer(
+            drf_request, [renderer() for renderer in view.cls.renderer_classes]
+        )
+    except NotAcceptable:
+        return None
+    if not isinstance(renderer, JSONRenderer):
+        return None
+    _, _, response = view.cls.cache_lookup(request)
+    if response is None:
+        return None
+    response['Allow'] = view.allow
+    patch_vary_headers(response, ('Accept',))
+    if hasattr(response, 'render'):
+        response.accepted_renderer = renderer
+        response.accepted_media_type = media_type
+        response.renderer_context = {'request': drf_request}
+        metrics.render(response)
+    return response
+
+
+def async_view(view):
+    """Async-обертка над представлением из DRF-роутера.
+
+    В Django 3.2 нет async ORM, поэтому и кэш, и представление
+    выполняются синхронно в пуле потоков; выигрыш - не в async-коде,
+    а в том, что запросы не ждут единственного потока, где
+    ASGI-обработчик выполняет синхронные представления, а ответ из
+    кэша не проходит через DRF.
+    """
+    sync_view = threaded(partial(respond, view))
+    lookup = threaded(cached_response)
+    cacheable = hasattr(view.cls, 'cache_lookup')
+
+    async def wrapper(request, *args, **kwargs):
+        if cacheable:
+            response = await lookup(wrapper, request)
+            if response is not None:
+                return response
+        return await sync_view(request, *args, **kwargs)
+
+    # Имя маршрута для метрик строится по cls и actions, как у DRF.
+    wrapper.cls = view.cls
+    wrapper.actions = view.actions
+    wrapper.allow = ', '.join(
+        method.upper() for method in view.cls.http_method_names
+        if method in view.actions or method == 'options'
+        or (method == 'head' and 'get' in view.actions)
+    )
+    # csrf_exempt из Django 3.2 оборачивает view в синхронную функцию.
+    wrapper.csrf_exempt = True
+    return wrapper
+
+
+def async_urls(urls, names):
+    """Маршруты роутера, где представления с именами names - async."""
+    return [
+        URLPattern(
+            url.pattern, async_view(url.callback),
+            url.default_args, url.name
+        )
+        if isinstance(url, URLPattern) and url.name in names else url
+        for url in urls
+    ]
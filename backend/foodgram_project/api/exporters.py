@@ -0,0 +1,257 @@
+import csv
+import zipfile
+from xml.sax.saxutils import escape
+
+from rest_framework.negotiation import DefaultContentNegotiation
+
+FILENAME = 'shopping_list'
+PDF_LINES_ON_PAGE = 50
+PDF_ENCODING = 'cp1251'
+
+
+class ExportContentNegotiation(DefaultContentNegotiation):
+    """?format= выбирает формат файла, а не рендерер DRF."""
+
+    def select_renderer(self, request, renderers, format_suffix=None):
+        return renderers[0], renderers[0].media_type
+
+
+class _Buffer:
+    """Файлоподобный приемник, который отдает записанное порциями."""
+
+    def __init__(self):
+        self.chunks = []
+        self.position = 0
+
+    def write(self, data):
+        self.chunks.append(data)
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b''.join(
+            chunk if isinstance(chunk, bytes) else chunk.encode()
+            for chunk in self.chunks
+        )
+        self.chunks = []
+        return data
+
+
+class BaseExporter:
+    format = None
+    content_type = None
+
+    def __init__(self, rows):
+        self.rows = rows
+
+    @property
+    def filename(self):
+        return f'{FILENAME}.{self.format}'
+
+    @staticmethod
+    def line(row):
+        return (
+            f'{row["name"]} - {row["amount"]} {row["measurement_unit"]}'
+        )
+
+    def stream(self):
+        raise NotImplementedError
+
+
+class TxtExporter(BaseExporter):
+    format = 'txt'
+    content_type = 'text/plain; charset=utf-8'
+
+    def stream(self):
+        for row in self.rows:
+            yield self.line(row) + '\n'
+
+
+class CsvExporter(BaseExporter):
+    format = 'csv'
+    content_type = 'text/csv; charset=utf-8'
+
+    def stream(self):
+        buffer = _Buffer()
+        writer = csv.writer(buffer)
+        writer.writerow(('name', 'measurement_unit', 'amount'))
+        for row in self.rows:
+            writer.writerow(
+                (row['name'], row['measurement_unit'], row['amount'])
+            )
+            yield buffer.drain()
+
+
+class DocxExporter(BaseExporter):
+    format = 'docx'
+    content_type = (
+        'application/vnd.openxmlformats-officedocument.'
+        'wordprocessingml.document'
+    )
+    content_types = (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Types xmlns="http://schemas.openxmlformats.org/package/2006/'
+        'content-types">'
+        '<Default Extension="rels" ContentType="application/'
+        'vnd.openxmlformats-package.relationships+xml"/>'
+        '<Default Extension="xml" ContentType="application/xml"/>'
+        '<Override PartName="/word/document.xml" ContentType="application/'
+        'vnd.openxmlformats-officedocument.wordprocessingml.document.'
+        'main+xml"/>'
+        '</Types>'
+    )
+    relationships = (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/'
+        '2006/relationships">'
+        '<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/'
+        'officeDocument/2006/relationships/officeDocument" '
+        'Target="word/document.xml"/>'
+        '</Relationships>'
+    )
+    document_start = (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<w:document xmlns:w="http://schemas.openxmlformats.org/'
+        'wordprocessingml/2006/main"><w:body>'
+    )
+    document_end = '</w:body></w:document>'
+
+    @staticmethod
+    def paragraph(text):
+        return f'<w:p><w:r><w:t>{escape(text)}</w:t></w:r></w:p>'
+
+    def stream(self):
+        buffer = _Buffer()
+        with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_DEFLATED) as archive:
+            archive.writestr('[Content_Types].xml', self.content_types)
+            archive.writestr('_rels/.rels', self.relationships)
+            with archive.open('word/document.xml', 'w') as document:
+                document.write(self.document_start.encode())
+                document.write(self.paragraph('Список покупок').encode())
+                for row in self.rows:
+                    document.write(self.paragraph(self.line(row)).encode())
+                    yield buffer.drain()
+                document.write(self.document_end.encode())
+        yield buffer.drain()
+
+
+class PdfExporter(BaseExporter):
+    """PDF пишется объект за объектом, в памяти только таблица смещений.
+
+    Текст кодируется в cp1251 и выводится стандартным шрифтом Helvetica:
+    для 14 стандартных шрифтов /Widths и /FontDescriptor не нужны, а
+    кириллические коды переназначены на имена глифов через /Differences.
+    """
+
+    format = 'pdf'
+    content_type = 'application/pdf'
+
+    def __init__(self, rows):
+        super().__init__(rows)
+        self.offsets = {}
+        self.position = 0
+
+    def write_object(self, number, body):
+        self.offsets[number] = self.position
+        data = f'{number} 0 obj\n'.encode() + body + b'\nendobj\n'
+        self.position += len(data)
+        return data
+
+    @staticmethod
+    def glyph(code):
+        """Имя глифа кириллической буквы по Adobe Glyph List."""
+        char = ord(bytes((code,)).decode(PDF_ENCODING))
+        if char in (0x401, 0x451):
+            return f'/afii{10023 if char == 0x401 else 10071}'
+        if char >= 0x430:
+            return f'/afii{10065 + char - 0x430 + (char >= 0x436)}'
+        return f'/afii{10017 + char - 0x410 + (char >= 0x416)}'
+
+    def font(self):
+        letters = ' '.join(self.glyph(code) for code in range(0xC0, 0x100))
+        differences = (
+            f'168 {self.glyph(0xA8)} 184 {self.glyph(0xB8)} 192 {letters}'
+        )
+        return (
+            '<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica '
+            '/Encoding << /Type /Encoding /BaseEncoding /WinAnsiEncoding '
+            f'/Differences [{differences}] >> >>'
+        ).encode()
+
+    @staticmethod
+    def text(line):
+        line = line.encode(PDF_ENCODING, errors='replace')
+        for char in (b'\\', b'(', b')'):
+            line = line.replace(char, b'\\' + char)
+        return b'(' + line + b') Tj T*\n'
+
+    def page(self, lines):
+        content = b'BT /F1 12 Tf 14 TL 50 800 Td\n' + b''.join(
+            self.text(line) for line in lines
+        ) + b'ET'
+        return content
+
+    def write_page(self, number, lines):
+        content = self.page(lines)
+        data = self.write_object(
+            number,
+            f'<< /Length {len(content)} >>\nstream\n'.encode()
+            + content + b'\nendstream'
+        )
+        data += self.write_object(
+            number + 1,
+            (
+                '<< /Type /Page /Parent 2 0 R /MediaBox [0 0 595 842] '
+                '/Resources << /Font << /F1 3 0 R >> >> '
+                f'/Contents {number} 0 R >>'
+            ).encode()
+        )
+        return data
+
+    def stream(self):
+        header = b'%PDF-1.4\n'
+        self.position = len(header)
+        yield header
+        yield self.write_object(1, b'<< /Type /Catalog /Pages 2 0 R >>')
+        yield self.write_object(3, self.font())
+        pages = []
+        lines = ['Список покупок']
+        number = 4
+        for row in self.rows:
+            lines.append(self.line(row))
+            if len(lines) == PDF_LINES_ON_PAGE:
+                yield self.write_page(number, lines)
+                pages.append(number + 1)
+                number += 2
+                lines = []
+        if lines or not pages:
+            yield self.write_page(number, lines)
+            pages.append(number + 1)
+            number += 2
+        kids = ' '.join(f'{page} 0 R' for page in pages)
+        yield self.write_object(
+            2,
+            f'<< /Type /Pages /Kids [{kids}] /Count {len(pages)} >>'.encode()
+        )
+        xref = self.position
+        yield (
+            f'xref\n0 {number}\n0000000000 65535 f \n'
+            + ''.join(
+                f'{self.offsets[obj]:010d} 00000 n \n'
+                for obj in range(1, number)
+            )
+            + f'trailer\n<< /Size {number} /Root 1 0 R >>\n'
+            f'startxref\n{xref}\n%%EOF\n'
+        ).encode()
+
+
+EXPORTERS = {
+    exporter.format: exporter
+    for exporter in (TxtExporter, CsvExporter, DocxExporter, PdfExporter)
+}
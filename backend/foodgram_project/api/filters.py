@@ -0,0 +1,63 @@
+from django_filters import rest_framework as filters
+from django_filters.widgets import BooleanWidget
+
+from recipes.models import Recipe, Tag
+
+
+class RecipeOrderingFilter(filters.OrderingFilter):
+
+    def filter(self, qs, value):
+        if not value:
+            return qs
+        return qs.order_by(
+            *(self.get_ordering_value(param) for param in value), '-id'
+        )
+
+
+class RecipeFilter(filters.FilterSet):
+    tags = filters.ModelMultipleChoiceFilter(
+        field_name='tags__slug',
+        to_field_name='slug',
+        queryset=Tag.objects.all(),
+        method='filter_tags'
+    )
+    is_favorited = filters.BooleanFilter(
+        method='filter_is_favorited',
+        widget=BooleanWidget()
+    )
+    is_in_shopping_cart = filters.BooleanFilter(
+        method='filter_is_in_shopping_cart',
+        widget=BooleanWidget()
+    )
+    ordering = RecipeOrderingFilter(
+        fields=(
+            ('favorites_count', 'popularity'),
+            ('cooking_time', 'cooking_time'),
+            ('id', 'newest'),
+        )
+    )
+
+    class Meta:
+        model = Recipe
+        fields = ('tags', 'author', 'is_favorited', 'is_in_shopping_cart')
+
+    def filter_tags(self, queryset, name, value):
+        if not value:
+            return queryset
+        return queryset.with_tags(value)
+
+    def filter_is_favorited(self, queryset, name, value):
+        user = self.request.user
+        if not value:
+            return queryset
+        if user.is_anonymous:
+            return queryset.none()
+        return queryset.favorited_by(user)
+
+    def filter_is_in_shopping_cart(self, queryset, name, value):
+        user = self.request.user
+        if not value:
+            return queryset
+        if user.is_anonymous:
+            return queryset.none()
+        return queryset.in_shopping_cart_of(user)
@@ -0,0 +1,71 @@
+from django.core.cache import cache
+from django.db.models import Prefetch, prefetch_related_objects
+
+from recipes import consts
+from recipes.caching import get_version
+from recipes.images import VARIANTS
+from recipes.models import Amount, Ingredient, Tag
+from .routers import replica_reads
+
+USER_FLAGS = ('is_favorite', 'is_in_shopping_cart')
+
+
+def fragment_keys(recipe_ids, image_variant=None):
+    version = get_version((Tag, Ingredient))
+    return {
+        recipe_id: f'recipe:{version}:{image_variant}:{recipe_id}'
+        for recipe_id in recipe_ids
+    }
+
+
+def invalidate_fragments(recipe_ids):
+    recipe_ids = list(recipe_ids)
+    cache.delete_many([
+        key
+        for image_variant in (None, *VARIANTS)
+        for key in fragment_keys(recipe_ids, image_variant).values()
+    ])
+
+
+def get_fragments(recipes, serialize, image_variant=None):
+    """Общие для всех пользователей представления рецептов.
+
+    Отсутствующие в кэше рецепты догружаются одним запросом на связь
+    и сериализуются функцией serialize.
+    """
+    keys = fragment_keys((recipe.pk for recipe in recipes), image_variant)
+    fragments = cache.get_many(keys.values())
+    missed = [
+        recipe for recipe in recipes if keys[recipe.pk] not in fragments
+    ]
+    if missed:
+        prefetch_related_objects(
+            missed,
+            'author',
+            'tags',
+            Prefetch(
+                'recipe_ingredients',
+                queryset=Amount.objects.select_related('ingredient')
+            )
+        )
+        fresh = {keys[recipe.pk]: serialize(recipe) for recipe in missed}
+        # Реплика может отставать от сброса фрагмента после записи,
+        # поэтому прочитанное с нее живет в кэше не дольше отставания.
+        cache.set_many(fresh, (
+            consts.REPLICA_STICKY_TIMEOUT if replica_reads.get()
+            else consts.RECIPE_CACHE_TIMEOUT
+        ))
+        fragments.update(fresh)
+    return [fragments[keys[recipe.pk]] for recipe in recipes]
+
+
+def overlay(fragment, recipe, request):
+    """Дополняет представление рецепта флагами текущего пользователя."""
+    data = fragment.copy()
+    data['author'] = fragment['author'].copy()
+    data['author']['is_subscribed'] = recipe.author_is_subscribed
+    for flag in USER_FLAGS:
+        data[flag] = getattr(recipe, flag)
+    if data['image'] and request is not None:
+        data['image'] = request.build_absolute_uri(data['image'])
+    return data
@@ -0,0 +1,166 @@
+import threading
+import time
+from bisect import bisect_left
+from contextvars import ContextVar
+
+from recipes import consts
+
+# Замеры текущего запроса; None вне запроса.
+current = ContextVar('request_timings', default=None)
+
+
+class Timings:
+    """Время запроса по частям: SQL, сериализаторы, рендеринг."""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.queries = 0
+        self.db = 0.0
+        self.serialize = 0.0
+        self.render = 0.0
+        self.serializer_depth = 0
+        self.render_started = None
+
+    def execute(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries += 1
+            self.db += time.perf_counter() - started
+
+    def serialize_call(self, method, *args, **kwargs):
+        """Время внешнего вызова сериализатора без времени SQL внутри."""
+        if self.serializer_depth:
+            return method(*args, **kwargs)
+        self.serializer_depth += 1
+        started, db = time.perf_counter(), self.db
+        try:
+            return method(*args, **kwargs)
+        finally:
+            self.serializer_depth -= 1
+            self.serialize += (
+                time.perf_counter() - started - (self.db - db)
+            )
+
+    def header(self, total):
+        return ', '.join((
+            f'db;dur={self.db * 1000:.1f};desc="{self.queries} queries"',
+            f'serialize;dur={self.serialize * 1000:.1f}',
+            f'render;dur={self.render * 1000:.1f}',
+            f'total;dur={total * 1000:.1f}',
+        ))
+
+
+class Histogram:
+
+    def __init__(self, name, help_text, buckets):
+        self.name = name
+        self.help_text = help_text
+        self.buckets = buckets
+        self.series = {}
+
+    def observe(self, route, value):
+        counts, total = self.series.get(
+            route, ([0] * (len(self.buckets) + 1), 0)
+        )
+        counts[bisect_left(self.buckets, value)] += 1
+        self.series[route] = counts, total + value
+
+    def lines(self):
+        yield f'# HELP {self.name} {self.help_text}'
+        yield f'# TYPE {self.name} histogram'
+        for route, (counts, total) in sorted(self.series.items()):
+            label = route.replace('\\', '\\\\').replace('"', '\\"')
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                le = '+Inf' if bound == float('inf') else repr(bound)
+                yield (
+                    f'{self.name}_bucket{{route="{label}",le="{le}"}} '
+                    f'{cumulative}'
+                )
+            yield f'{self.name}_sum{{route="{label}"}} {total}'
+            yield f'{self.name}_count{{route="{label}"}} {cumulative}'
+
+
+class Registry:
+    """Гистограммы по маршрутам в памяти процесса.
+
+    Каждый процесс сервера считает свои запросы, Prometheus
+    складывает их при опросе всех процессов.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        seconds = consts.METRICS_TIME_BUCKETS
+        self.histograms = {
+            'total': Histogram(
+                'foodgram_request_seconds', 'Время ответа.', seconds
+            ),
+            'db': Histogram(
+                'foodgram_db_seconds', 'Время SQL-запросов.', seconds
+            ),
+            'queries': Histogram(
+                'foodgram_db_queries', 'Число SQL-запросов.',
+                consts.METRICS_QUERY_BUCKETS
+            ),
+            'serialize': Histogram(
+                'foodgram_serializer_seconds', 'Время сериализаторов.',
+                seconds
+            ),
+            'render': Histogram(
+                'foodgram_render_seconds', 'Время рендеринга ответа.',
+                seconds
+            ),
+        }
+
+    def observe(self, route, timings, total):
+        values = {
+            'total': total,
+            'db': timings.db,
+            'queries': timings.queries,
+            'serialize': timings.serialize,
+            'render': timings.render,
+        }
+        with self.lock:
+            for key, value in values.items():
+                self.histograms[key].observe(route, value)
+
+    def render(self):
+        with self.lock:
+            return '\n'.join(
+                line
+                for histogram in self.histograms.values()
+                for line in histogram.lines()
+            ) + '\n'
+
+
+registry = Registry()
+
+
+def serialize(method, *args, **kwargs):
+    timings = current.get()
+    if timings is None:
+        return method(*args, **kwargs)
+    return timings.serialize_call(method, *args, **kwargs)
+
+
+def execute(execute, sql, params, many, context):
+    """Обертка запросов всех соединений; считает их в текущем запросе.
+
+    Текущий запрос берется из ContextVar, поэтому запросы из потоков
+    sync_to_async попадают в замеры своего запроса.
+    """
+    timings = current.get()
+    if timings is None:
+        return execute(sql, params, many, context)
+    return timings.execute(execute, sql, params, many, context)
+
+
+def render(response):
+    timings = current.get()
+    started = time.perf_counter()
+    response.render()
+    if timings is not None:
+        timings.render += time.perf_counter() - started
@@ -0,0 +1,143 @@
+import asyncio
+import time
+
+from asgiref.sync import sync_to_async
+from rest_framework.permissions import SAFE_METHODS
+
+from .metrics import Timings, current, registry
+from .routers import mark_write
+
+
+def route_name(request):
+    """Класс представления и действие DRF, например RecipeViewSet.list."""
+    match = request.resolver_match
+    if match is None:
+        return 'unresolved'
+    view_class = getattr(match.func, 'cls', None)
+    if view_class is None:
+        return match.view_name
+    action = (getattr(match.func, 'actions', None) or {}).get(
+        request.method.lower(), request.method.lower()
+    )
+    return f'{view_class.__name__}.{action}'
+
+
+class AsyncCapableMiddleware:
+    """Основа middleware, работающих и под WSGI, и под ASGI.
+
+    Под ASGI синхронная middleware заставила бы Django выполнять
+    весь запрос в потоке, поэтому в async-режиме вызывается acall.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if asyncio.iscoroutinefunction(get_response):
+            self._is_coroutine = asyncio.coroutines._is_coroutine
+            # Синхронный хук в async-цепочке Django вызывает через
+            # sync_to_async, то есть в потоке на каждый запрос; хуки
+            # hooks не блокируют, их async-версии a<хук> выполняются
+            # прямо в цикле событий.
+            for name in self.hooks:
+                setattr(self, name, getattr(self, 'a' + name))
+
+    hooks = ()
+
+    def __call__(self, request):
+        if asyncio.iscoroutinefunction(self.get_response):
+            return self.acall(request)
+        return self.call(request)
+
+
+class ServerTimingMiddleware(AsyncCapableMiddleware):
+    """Пишет заголовок Server-Timing и копит гистограммы по маршрутам.
+
+    SQL-запросы считает обертка metrics.execute, которую получает
+    каждое соединение с базой.
+    """
+
+    hooks = ('process_template_response',)
+
+    def call(self, request):
+        timings, token = self.start(request)
+        try:
+            response = self.get_response(request)
+        finally:
+            current.reset(token)
+        return self.finish(request, timings, response)
+
+    async def acall(self, request):
+        timings, token = self.start(request)
+        try:
+            response = await self.get_response(request)
+        finally:
+            current.reset(token)
+        return self.finish(request, timings, response)
+
+    @staticmethod
+    def start(request):
+        timings = Timings()
+        return timings, current.set(timings)
+
+    @staticmethod
+    def finish(request, timings, response):
+        total = time.perf_counter() - timings.started
+        response['Server-Timing'] = timings.header(total)
+        registry.observe(route_name(request), timings, total)
+        return response
+
+    def process_template_response(self, request, response):
+        return self.time_render(response)
+
+    async def aprocess_template_response(self, request, response):
+        return self.time_render(response)
+
+    def time_render(self, response):
+        timings = current.get()
+        if timings is not None:
+            timings.render_started = time.perf_counter()
+            response.add_post_render_callback(
+                lambda response: self.rendered(timings)
+            )
+        return response
+
+    @staticmethod
+    def rendered(timings):
+        timings.render += time.perf_counter() - timings.render_started
+
+
+class ReadYourWritesMiddleware(AsyncCapableMiddleware):
+    """После успешной записи временно читает данные пользователя
+    с основной базы.
+
+    DRF кладет аутентифицированного пользователя в request.user,
+    поэтому после ответа он известен и для входа по токену.
+    """
+
+    def call(self, request):
+        response = self.get_response(request)
+        if self.is_write(request, response):
+            self.mark(request)
+        return response
+
+    async def acall(self, request):
+        response = await self.get_response(request)
+        if self.is_write(request, response):
+            # Пользователь из сессии загружается из базы.
+            await sync_to_async(self.mark)(request)
+        return response
+
+    @staticmethod
+    def is_write(request, response):
+        return (
+            request.method not in SAFE_METHODS
+            and response.status_code < 400
+        )
+
+    @staticmethod
+    def mark(request):
+        user = getattr(request, 'user', None)
+        if user is not None and user.is_authenticated:
+            mark_write(user.pk)
@@ -1,3 +1,17 @@
+import hashlib
+import math
+import time
+
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
+from rest_framework import status
+from rest_framework.permissions import SAFE_METHODS
+from rest_framework.response import Response
+
+from recipes import consts
+from recipes.caching import get_version, local_cache
+from . import metrics
+from .routers import is_sticky, replica_reads
 from .validators import validate_username
 
 
@@ -6,3 +20,112 @@ class ValidateUsernameMixin:
     @staticmethod
     def validate_username(username):
         return validate_username(username)
+
+
+class TimedSerializerMixin:
+    """Учитывает время сериализации в замерах текущего запроса."""
+
+    def to_representation(self, instance):
+        return metrics.serialize(super().to_representation, instance)
+
+
+class ReplicaReadMixin:
+    """Отдает чтение действий replica_actions репликам.
+
+    Пользователь, который недавно что-то изменил, читает с основной
+    базы. Решение принимается после аутентификации и сбрасывается
+    в finalize_response, который DRF вызывает и при исключениях.
+    """
+
+    replica_actions = ('list', 'retrieve')
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        if (
+            request.method in SAFE_METHODS
+            and self.action in self.replica_actions
+            and not is_sticky(request.user)
+        ):
+            self.replica_token = replica_reads.set(True)
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        token = getattr(self, 'replica_token', None)
+        if token is not None:
+            replica_reads.reset(token)
+            self.replica_token = None
+        return super().finalize_response(request, response, *args, **kwargs)
+
+
+class VersionedCacheMixin:
+    """Кэш ответов list и retrieve с ETag и Last-Modified.
+
+    Ключ кэша включает версию моделей cache_models, поэтому изменение
+    любой из них делает старые ответы недоступными.
+    """
+
+    cache_models = ()
+
+    def list(self, request, *args, **kwargs):
+        return self.cached_response(super().list, request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.cached_response(
+            super().retrieve, request, *args, **kwargs
+        )
+
+    @classmethod
+    def cache_lookup(cls, request):
+        """Версия, ETag и готовый ответ из кэша, если он есть.
+
+        Не читает данные моделей, поэтому async-представления вызывают
+        его до DRF, в потоке пула.
+        """
+        version = get_version(cls.cache_models)
+        etag = '"{}"'.format(hashlib.md5(
+            f'{version}:{request.get_full_path()}'.encode()
+        ).hexdigest())
+        # Last-Modified точен до секунды и не отличит правку в ту же
+        # секунду, поэтому 304 отдается только по If-None-Match.
+        not_modified = get_conditional_response(request, etag=etag)
+        if not_modified is not None:
+            not_modified['ETag'] = etag
+            return version, etag, not_modified
+        data = local_cache.get(f'response:{etag}')
+        if data is None:
+            return version, etag, None
+        return version, etag, cls.etag_response(data, etag, version)
+
+    @staticmethod
+    def etag_response(data, etag, version):
+        response = Response(data)
+        response['ETag'] = etag
+        # Округление вверх: время изменения не оказывается раньше
+        # настоящего.
+        response['Last-Modified'] = http_date(math.ceil(version))
+        return response
+
+    def cached_response(self, handler, request, *args, **kwargs):
+        version, etag, response = self.cache_lookup(request)
+        if response is not None:
+            return response
+        response = self.fresh_response(
+            version, handler, request, *args, **kwargs
+        )
+        if response.status_code != status.HTTP_200_OK:
+            return response
+        local_cache.set(
+            f'response:{etag}', response.data, consts.RESPONSE_CACHE_TIMEOUT
+        )
+        return self.etag_response(response.data, etag, version)
+
+    @staticmethod
+    def fresh_response(version, handler, request, *args, **kwargs):
+        """Ответ, сохраняемый под новой версией, читается с основной базы,
+        пока реплики могли еще не получить изменение."""
+        if time.time() - version >= consts.REPLICA_STICKY_TIMEOUT:
+            return handler(request, *args, **kwargs)
+        token = replica_reads.set(False)
+        try:
+            return handler(request, *args, **kwargs)
+        finally:
+            replica_reads.reset(token)
@@ -1,8 +1,240 @@
+import base64
+import hashlib
+import json
+from collections import OrderedDict
+from functools import partial
+
+from django.core.exceptions import FieldDoesNotExist
+from django.core.exceptions import ValidationError as DjangoValidationError
+from django.core.paginator import Paginator as DjangoPaginator
+from django.db import connections
+from django.db.models import Q
+from django.utils.functional import cached_property
+from rest_framework.exceptions import NotFound, ValidationError
 from rest_framework.pagination import PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+from recipes import consts, feed
+from recipes.caching import local_cache
+
+
+def estimate_count(queryset):
+    """Оценка числа строк по статистике PostgreSQL для запроса без WHERE."""
+    connection = connections[queryset.db]
+    if connection.vendor != 'postgresql' or queryset.query.where:
+        return None
+    with connection.cursor() as cursor:
+        cursor.execute(
+            'SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass',
+            [queryset.model._meta.db_table]
+        )
+        row = cursor.fetchone()
+    if row is None or row[0] < 0:
+        return None
+    return row[0]
+
+
+def cached_count(queryset):
+    sql, params = queryset.query.sql_with_params()
+    key = 'count:' + hashlib.md5(repr((sql, params)).encode()).hexdigest()
+    count = local_cache.get(key)
+    if count is None:
+        count = queryset.count()
+        local_cache.set(key, count, consts.COUNT_CACHE_TIMEOUT)
+    return count
+
 
-from recipes import consts
+def get_count(queryset, mode):
+    """Число объектов: exact, cached или approximate."""
+    if mode == 'approximate':
+        count = estimate_count(queryset)
+        if count is not None:
+            return count
+        mode = 'cached'
+    if mode == 'cached':
+        return cached_count(queryset)
+    return queryset.count()
+
+
+class CountPaginator(DjangoPaginator):
+
+    def __init__(self, *args, count_mode=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.count_mode = count_mode
+
+    @cached_property
+    def count(self):
+        return get_count(self.object_list, self.count_mode)
 
 
 class Pagination(PageNumberPagination):
+    """Постраничная пагинация с курсорным режимом по запросу.
+
+    ?cursor= переключает на выборку по ключу сортировки запроса или
+    модели без COUNT(*) и OFFSET; ?count=cached|approximate|exact
+    выбирает, как считать общее число объектов.
+    """
+
     page_size_query_param = "limit"
     page_size = consts.OBJECT_ON_PAGE
+    cursor_query_param = 'cursor'
+    count_query_param = 'count'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.count_mode = request.query_params.get(self.count_query_param)
+        self.django_paginator_class = partial(
+            CountPaginator, count_mode=self.count_mode
+        )
+        self.cursor = None
+        if self.cursor_query_param not in request.query_params:
+            return super().paginate_queryset(queryset, request, view)
+        return self.paginate_by_cursor(queryset, request)
+
+    @staticmethod
+    def get_keys(queryset):
+        """Сортировка запроса, например из ?ordering=, или модели."""
+        keys = list(
+            queryset.query.order_by or queryset.model._meta.ordering
+        )
+        if not {'id', '-id', 'pk', '-pk'} & set(keys):
+            keys.append('id')
+        return keys
+
+    def get_fields(self, model):
+        """Поля модели для ключей; курсор возможен только по ним."""
+        fields = []
+        for key in self.keys:
+            field = None
+            if isinstance(key, str):
+                name = key.lstrip('-')
+                try:
+                    field = (
+                        model._meta.pk if name == 'pk'
+                        else model._meta.get_field(name)
+                    )
+                except FieldDoesNotExist:
+                    pass
+            if field is None or field.is_relation or not field.concrete:
+                raise ValidationError({
+                    self.cursor_query_param:
+                        'Курсор недоступен для этой сортировки.'
+                })
+            fields.append(field)
+        return fields
+
+    def decode_cursor(self, cursor):
+        if not cursor:
+            return None
+        try:
+            values = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        except (TypeError, ValueError):
+            raise NotFound('Неверный курсор.')
+        if (
+            not isinstance(values, list) or len(values) != len(self.keys)
+            or not all(
+                isinstance(value, (str, int, float))
+                and not isinstance(value, bool)
+                for value in values
+            )
+        ):
+            raise NotFound('Неверный курсор.')
+        return values
+
+    @staticmethod
+    def coerce_cursor(values, fields):
+        """Значения курсора, приведенные к типам полей ключа."""
+        try:
+            return [
+                field.to_python(value) for field, value in zip(fields, values)
+            ]
+        except (DjangoValidationError, TypeError, ValueError):
+            raise NotFound('Неверный курсор.')
+
+    @staticmethod
+    def encode_cursor(values):
+        return base64.urlsafe_b64encode(
+            json.dumps(values, default=str).encode()
+        ).decode()
+
+    def seek(self, queryset, values):
+        condition = Q()
+        for index, key in enumerate(self.keys):
+            lookup = 'lt' if key.startswith('-') else 'gt'
+            step = Q(**{f'{key.lstrip("-")}__{lookup}': values[index]})
+            for previous, value in zip(self.keys[:index], values):
+                step &= Q(**{previous.lstrip('-'): value})
+            condition |= step
+        return queryset.filter(condition)
+
+    def paginate_by_cursor(self, queryset, request):
+        self.request = request
+        self.keys = self.get_keys(queryset)
+        fields = self.get_fields(queryset.model)
+        self.total = None
+        if self.count_mode:
+            self.total = get_count(queryset, self.count_mode)
+        values = self.decode_cursor(
+            request.query_params[self.cursor_query_param]
+        )
+        queryset = queryset.order_by(*self.keys)
+        if values is not None:
+            queryset = self.seek(
+                queryset, self.coerce_cursor(values, fields)
+            )
+        page_size = self.get_page_size(request)
+        page = list(queryset[:page_size + 1])
+        if len(page) > page_size:
+            page = page[:page_size]
+            self.cursor = self.encode_cursor([
+                getattr(page[-1], key.lstrip('-')) for key in self.keys
+            ])
+        else:
+            self.cursor = ''
+        return page
+
+    def get_next_cursor_link(self):
+        if not self.cursor:
+            return None
+        return replace_query_param(
+            self.request.build_absolute_uri(),
+            self.cursor_query_param,
+            self.cursor
+        )
+
+    def get_paginated_response(self, data):
+        if self.cursor is None:
+            return super().get_paginated_response(data)
+        response = OrderedDict([
+            ('next', self.get_next_cursor_link()),
+            ('previous', None),
+            ('results', data),
+        ])
+        if self.total is not None:
+            response['count'] = self.total
+            response.move_to_end('count', last=False)
+        return Response(response)
+
+
+class FeedPagination(Pagination):
+    """Лента всегда листается курсором: id последнего рецепта."""
+
+    def paginate_feed(self, request, user):
+        self.request = request
+        self.keys = ['-id']
+        self.total = None
+        values = self.decode_cursor(
+            request.query_params.get(self.cursor_query_param)
+        )
+        before = values[0] if values else None
+        if before is not None and (
+            not isinstance(before, int) or isinstance(before, bool)
+        ):
+            raise NotFound('Неверный курсор.')
+        page_size = self.get_page_size(request)
+        ids = feed.page(user, before, page_size + 1)
+        self.cursor = ''
+        if len(ids) > page_size:
+            ids = ids[:page_size]
+            self.cursor = self.encode_cursor([ids[-1]])
+        return ids
@@ -0,0 +1,53 @@
+import random
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS, connections
+
+from recipes import consts
+
+# True, пока представление обслуживает чтение, которое можно отдать реплике.
+replica_reads = ContextVar('replica_reads', default=False)
+
+# Таблица DatabaseCache живет только на основной базе.
+CACHE_APP_LABEL = 'django_cache'
+
+
+def sticky_key(user_id):
+    return f'primary:{user_id}'
+
+
+def mark_write(user_id):
+    """Следующие consts.REPLICA_STICKY_TIMEOUT секунд пользователь читает
+    с основной базы и видит свои изменения, пока реплики догоняют ее."""
+    cache.set(sticky_key(user_id), True, consts.REPLICA_STICKY_TIMEOUT)
+
+
+def is_sticky(user):
+    return user.is_authenticated and cache.get(sticky_key(user.pk), False)
+
+
+class ReplicaRouter:
+    """Чтение из разрешенных представлений идет на реплики, все
+    остальное - на основную базу.
+
+    Реплики - копии основной базы, поэтому связи между объектами
+    с разных баз разрешены.
+    """
+
+    def db_for_read(self, model, **hints):
+        if (
+            not settings.REPLICA_DATABASES
+            or model._meta.app_label == CACHE_APP_LABEL
+            or not replica_reads.get()
+            or connections[DEFAULT_DB_ALIAS].in_atomic_block
+        ):
+            return DEFAULT_DB_ALIAS
+        return random.choice(settings.REPLICA_DATABASES)
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        return True
@@ -1,28 +1,68 @@
 import base64
+import binascii
 
 from django.core.files.base import ContentFile
+from django.db import models, transaction
+from django.urls import reverse
 from rest_framework import serializers
 import webcolors
 
 from recipes import consts
+from recipes.images import clean_image, variant_url
+from recipes.signals import recipe_ingredients_changed
 from recipes.models import (
-    Amount, Favorite, Ingredient, Recipe, ShopCart,
-    Subscription, Tag, User
+    Amount, ExportJob, Favorite, Ingredient, Recipe, ShopCart,
+    ShopCartTotal, Subscription, Tag, User
 )
-from .mixins import ValidateUsernameMixin
+from .fragments import USER_FLAGS, get_fragments, overlay
+from .mixins import TimedSerializerMixin, ValidateUsernameMixin
 
 
 class Base64ImageField(serializers.ImageField):
     def to_internal_value(self, data):
         if isinstance(data, str) and data.startswith('data:image'):
             format, imgstr = data.split(';base64,')
-            ext = format.split('/')[-1]
-
-            data = ContentFile(base64.b64decode(imgstr), name='temp.' + ext)
+            if len(imgstr) * 3 // 4 > consts.MAX_IMAGE_SIZE:
+                raise serializers.ValidationError(
+                    'Слишком большой файл картинки.'
+                )
+            try:
+                content, ext = clean_image(base64.b64decode(imgstr))
+            except (ValueError, binascii.Error) as error:
+                raise serializers.ValidationError(str(error))
+            data = ContentFile(content, name='temp.' + ext)
+        elif getattr(data, 'size', 0) > consts.MAX_IMAGE_SIZE:
+            raise serializers.ValidationError(
+                'Слишком большой файл картинки.'
+            )
 
         return super().to_internal_value(data)
 
 
+class VariantImageField(serializers.ImageField):
+    """Отдает адрес варианта картинки из recipes.images.VARIANTS.
+
+    Вариант задается аргументом variant или ключом image_variant
+    контекста сериализатора.
+    """
+
+    def __init__(self, variant=None, **kwargs):
+        self.variant = variant
+        super().__init__(**kwargs)
+
+    def to_representation(self, value):
+        if not value:
+            return None
+        variant = (
+            self.variant or self.context.get('image_variant') or 'webp'
+        )
+        url = variant_url(value, variant)
+        request = self.context.get('request')
+        if request is not None:
+            return request.build_absolute_uri(url)
+        return url
+
+
 class HexToNameColor(serializers.Field):
 
     def to_representation(self, value):
@@ -36,7 +76,9 @@ class HexToNameColor(serializers.Field):
         return data
 
 
-class UserSerializer(serializers.ModelSerializer, ValidateUsernameMixin):
+class UserSerializer(
+    TimedSerializerMixin, serializers.ModelSerializer, ValidateUsernameMixin
+):
     is_subscribed = serializers.SerializerMethodField()
 
     class Meta:
@@ -60,18 +102,25 @@ class UserSerializer(serializers.ModelSerializer, ValidateUsernameMixin):
         return user
 
     def get_is_subscribed(self, obj):
+        if hasattr(obj, 'is_subscribed'):
+            return obj.is_subscribed
         user = self.context['request'].user
+        if user.is_anonymous:
+            return False
         return user.subscriber.filter(author=obj).exists()
 
 
 class RecipeToSubSerializer(serializers.ModelSerializer):
+    image = VariantImageField(variant='thumbnail', read_only=True)
 
     class Meta:
         model = Recipe
         fields = ('id', 'name', 'image', 'cooking_time')
 
 
-class SubscriptionSerializer(serializers.ModelSerializer):
+class SubscriptionSerializer(
+    TimedSerializerMixin, serializers.ModelSerializer
+):
     email = serializers.ReadOnlyField(source='author.email')
     id = serializers.ReadOnlyField(source='author.id')
     username = serializers.ReadOnlyField(source='author.username')
@@ -89,26 +138,24 @@ class SubscriptionSerializer(serializers.ModelSerializer):
         )
 
     def get_is_subscribed(self, obj):
-        user = obj.user
-        author = obj.author
-        return user.subscriber.filter(author=author).exists()
+        return True
 
     def get_recipes(self, obj):
-        author = obj.author
-        recipes = author.recipes.all()
-        return RecipeToSubSerializer(recipes, many=True).data
+        recipes = getattr(obj.author, 'limited_recipes', None)
+        if recipes is None:
+            recipes = obj.author.recipes.all()[
+                :self.context.get('recipes_limit')
+            ]
+        return RecipeToSubSerializer(
+            recipes, many=True, context=self.context
+        ).data
 
     def get_recipes_count(self, obj):
-        author = obj.author
-        return author.recipes.all().count()
+        return obj.author.recipes_count
 
     def validate(self, data):
         author = self.context.get('author')
         user = self.context['request'].user
-        if user.subscriber.filter(author=author).exists():
-            raise serializers.ValidationError(
-                'Вы уже подписаны на этого пользователя.'
-            )
         if user == author:
             raise serializers.ValidationError(
                 'Нельзя подписаться на себя.'
@@ -147,21 +194,22 @@ class PasswordSerializer(serializers.Serializer):
         return value
 
 
-class IngredientSerializer(serializers.ModelSerializer):
+class IngredientSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     class Meta:
         model = Ingredient
         fields = ('id', 'name', 'measurement_unit')
         read_only_fields = ('__all__',)
 
 
-class FavoriteSerializer(serializers.ModelSerializer):
+class FavoriteSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     id = serializers.PrimaryKeyRelatedField(
         source='recipe',
         read_only=True
     )
     name = serializers.ReadOnlyField(source='recipe.name')
-    image = serializers.ImageField(
+    image = VariantImageField(
         source='recipe.image',
+        variant='thumbnail',
         read_only=True
     )
     cooking_time = serializers.IntegerField(
@@ -174,7 +222,7 @@ class FavoriteSerializer(serializers.ModelSerializer):
         fields = ('id', 'name', 'image', 'cooking_time')
 
 
-class ShopCartSerializer(serializers.ModelSerializer):
+class ShopCartSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     id = serializers.PrimaryKeyRelatedField(
         source='recipe',
         read_only=True
@@ -182,8 +230,9 @@ class ShopCartSerializer(serializers.ModelSerializer):
     name = serializers.ReadOnlyField(
         source='recipe.name'
     )
-    image = serializers.ImageField(
+    image = VariantImageField(
         source='recipe.image',
+        variant='thumbnail',
         read_only=True
     )
     cooking_time = serializers.IntegerField(
@@ -196,7 +245,57 @@ class ShopCartSerializer(serializers.ModelSerializer):
         fields = ('id', 'name', 'image', 'cooking_time')
 
 
-class TagSerializer(serializers.ModelSerializer):
+class ShopCartTotalSerializer(
+    TimedSerializerMixin, serializers.ModelSerializer
+):
+    id = serializers.ReadOnlyField(
+        source='ingredient.id'
+    )
+    name = serializers.ReadOnlyField(
+        source='ingredient.name'
+    )
+    measurement_unit = serializers.ReadOnlyField(
+        source='ingredient.measurement_unit'
+    )
+    amount = serializers.ReadOnlyField(
+        source='total'
+    )
+
+    class Meta:
+        model = ShopCartTotal
+        fields = ('id', 'name', 'measurement_unit', 'amount')
+
+
+class BulkIdsSerializer(serializers.Serializer):
+    ids = serializers.ListField(
+        child=serializers.IntegerField(min_value=1),
+        allow_empty=False,
+        max_length=consts.BULK_IDS_LIMIT
+    )
+
+    def validate_ids(self, ids):
+        return list(dict.fromkeys(ids))
+
+
+class ExportJobSerializer(TimedSerializerMixin, serializers.ModelSerializer):
+    result = serializers.SerializerMethodField()
+
+    class Meta:
+        model = ExportJob
+        fields = ('id', 'status', 'created', 'finished', 'error', 'result')
+        read_only_fields = fields
+
+    def get_result(self, obj):
+        if obj.status != ExportJob.DONE:
+            return None
+        url = reverse('users-export-download', kwargs={'job_id': obj.pk})
+        request = self.context.get('request')
+        if request is not None:
+            return request.build_absolute_uri(url)
+        return url
+
+
+class TagSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     color = HexToNameColor()
 
     class Meta:
@@ -224,7 +323,14 @@ class IngredientAmountSerializer(serializers.ModelSerializer):
         )
 
 
-class RecipeReadSerializer(serializers.ModelSerializer):
+class RecipeListSerializer(TimedSerializerMixin, serializers.ListSerializer):
+
+    def to_representation(self, data):
+        recipes = data.all() if isinstance(data, models.Manager) else data
+        return self.child.represent_many(list(recipes))
+
+
+class RecipeReadSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     author = UserSerializer()
     tags = TagSerializer(
         many=True,
@@ -234,8 +340,9 @@ class RecipeReadSerializer(serializers.ModelSerializer):
         many=True,
         source='recipe_ingredients',
     )
-    is_favorite = serializers.SerializerMethodField()
-    is_in_shopping_cart = serializers.SerializerMethodField()
+    image = VariantImageField(read_only=True)
+    is_favorite = serializers.BooleanField(read_only=True)
+    is_in_shopping_cart = serializers.BooleanField(read_only=True)
 
     class Meta:
         model = Recipe
@@ -243,18 +350,39 @@ class RecipeReadSerializer(serializers.ModelSerializer):
             'id', 'tags', 'author', 'ingredients', 'is_favorite',
             'is_in_shopping_cart', 'name', 'image', 'text', 'cooking_time'
         )
+        list_serializer_class = RecipeListSerializer
 
-    def get_is_favorite(self, obj):
-        return obj.favorite.exists()
+    def to_representation(self, instance):
+        return self.represent_many([instance])[0]
 
-    def get_is_in_shopping_cart(self, obj):
-        return obj.shop_cart.exists()
+    def represent_many(self, recipes):
+        fragments = get_fragments(
+            recipes,
+            self.serialize_fragment,
+            self.context.get('image_variant')
+        )
+        request = self.context.get('request')
+        return [
+            overlay(fragment, recipe, request)
+            for fragment, recipe in zip(fragments, recipes)
+        ]
+
+    def serialize_fragment(self, instance):
+        """Представление рецепта без данных текущего пользователя."""
+        instance.author.is_subscribed = False
+        fragment = RecipeReadSerializer(instance, context={
+            'image_variant': self.context.get('image_variant')
+        }).to_fields(instance)
+        for flag in USER_FLAGS:
+            fragment[flag] = False
+        return fragment
+
+    def to_fields(self, instance):
+        return super().to_representation(instance)
 
 
 class IngredientsToRecipeSerializer(serializers.ModelSerializer):
-    id = serializers.PrimaryKeyRelatedField(
-        queryset=Ingredient.objects.all()
-    )
+    id = serializers.IntegerField()
     amount = serializers.IntegerField(
         min_value=consts.MIN_VALUE_VALID,
         max_value=consts.MAX_VALUE_VALID
@@ -265,7 +393,7 @@ class IngredientsToRecipeSerializer(serializers.ModelSerializer):
         fields = ('id', 'amount')
 
 
-class RecipeWriteSerializer(serializers.ModelSerializer):
+class RecipeWriteSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     ingredients = IngredientsToRecipeSerializer(
         many=True,
         write_only=True
@@ -289,37 +417,96 @@ class RecipeWriteSerializer(serializers.ModelSerializer):
         )
 
     def to_representation(self, instance):
-        serializer = RecipeReadSerializer(instance,)
+        instance = Recipe.objects.with_relations().with_user_flags(
+            self.context['request'].user
+        ).get(pk=instance.pk)
+        serializer = RecipeReadSerializer(instance, context=self.context)
         return serializer.data
 
+    def validate_ingredients(self, value):
+        ids = [ingredient['id'] for ingredient in value]
+        if len(set(ids)) != len(ids):
+            raise serializers.ValidationError(
+                'Ингредиенты не должны повторяться.'
+            )
+        missing = set(ids) - set(Ingredient.objects.in_bulk(ids))
+        if missing:
+            raise serializers.ValidationError(
+                f'Нет ингредиентов с id: {", ".join(map(str, missing))}.'
+            )
+        return value
+
     def create_ingredients(self, ingredients, recipe):
-        model_list = []
-        for ingredient in ingredients:
-            id = ingredient['id']
-            ingredient = Ingredient.objects.get(pk=id)
-            model_list.appent(
-                Amount(
-                    ingredient=ingredient,
-                    recipe=recipe,
-                    amount=ingredient['amount']
-                )
+        Amount.objects.bulk_create(
+            Amount(
+                ingredient_id=ingredient['id'],
+                recipe=recipe,
+                amount=ingredient['amount']
+            )
+            for ingredient in ingredients
+        )
+
+    def update_ingredients(self, ingredients, recipe):
+        """Приводит ингредиенты рецепта к новому списку по разнице.
+
+        Возвращает изменения количеств {ingredient_id: разница}.
+        """
+        existing = {
+            amount.ingredient_id: amount
+            for amount in recipe.recipe_ingredients.all()
+        }
+        amounts = {
+            ingredient['id']: ingredient['amount']
+            for ingredient in ingredients
+        }
+        deltas = {
+            ingredient_id: amounts.get(ingredient_id, 0) - (
+                existing[ingredient_id].amount
+                if ingredient_id in existing else 0
             )
-        Amount.objects.bulk_create(model_list)
+            for ingredient_id in {*existing, *amounts}
+        }
+        removed = [
+            amount.pk for ingredient_id, amount in existing.items()
+            if ingredient_id not in amounts
+        ]
+        if removed:
+            Amount.objects.filter(pk__in=removed).delete()
+        changed = []
+        for ingredient_id, amount in existing.items():
+            if deltas[ingredient_id] and ingredient_id in amounts:
+                amount.amount = amounts[ingredient_id]
+                changed.append(amount)
+        if changed:
+            Amount.objects.bulk_update(changed, ['amount'])
+        added = [
+            ingredient for ingredient in ingredients
+            if ingredient['id'] not in existing
+        ]
+        if added:
+            self.create_ingredients(added, recipe)
+        return deltas
 
     def create_tags(self, tags, recipe):
         recipe.tags.set(tags)
 
+    @transaction.atomic
     def create(self, validated_data):
         ingredients = validated_data.pop('ingredients')
         tags = validated_data.pop('tags')
         recipe = Recipe.objects.create(**validated_data,)
         self.create_ingredients(ingredients, recipe)
         self.create_tags(tags, recipe)
+        recipe_ingredients_changed.send(sender=Recipe, recipe=recipe)
         return recipe
 
+    @transaction.atomic
     def update(self, instance, validated_data):
-        instance.recipe_ingredients.dalete()
-        instance.tags.delete()
-        self.create_ingredients(validated_data.pop('ingredients'), instance)
+        deltas = self.update_ingredients(
+            validated_data.pop('ingredients'), instance
+        )
         self.create_tags(validated_data.pop('tags'), instance)
+        if any(deltas.values()):
+            ShopCartTotal.objects.change_recipe(instance, deltas)
+        # Поиск и кэш рецепта обновит сохранение в super().update().
         return super().update(instance, validated_data)
@@ -0,0 +1,99 @@
+from django.contrib.auth.signals import user_logged_out
+from django.db import transaction
+from django.db.backends.signals import connection_created
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.dispatch import receiver
+from rest_framework.authtoken.models import Token
+
+from recipes.caching import bump_version
+from recipes.models import Ingredient, Recipe, Tag, User
+from recipes.images import image_variants_ready
+from recipes.signals import recipe_ingredients_changed
+from . import metrics
+from .authentication import token_cache
+from .fragments import invalidate_fragments
+
+
+@receiver(post_save, sender=Tag)
+@receiver(post_delete, sender=Tag)
+@receiver(post_save, sender=Ingredient)
+@receiver(post_delete, sender=Ingredient)
+def bump_reference_version(sender, **kwargs):
+    bump_version(sender)
+
+
+def invalidate_on_commit(recipe_ids):
+    """Сбрасывает фрагменты после фиксации транзакции.
+
+    Иначе параллельный запрос может между сбросом и фиксацией снова
+    положить в кэш старое представление рецепта.
+    """
+    recipe_ids = list(recipe_ids)
+    transaction.on_commit(lambda: invalidate_fragments(recipe_ids))
+
+
+@receiver(post_save, sender=Recipe)
+@receiver(post_delete, sender=Recipe)
+def invalidate_recipe(sender, instance, **kwargs):
+    invalidate_on_commit([instance.pk])
+
+
+@receiver(recipe_ingredients_changed, sender=Recipe)
+def invalidate_recipe_ingredients(sender, recipe, **kwargs):
+    invalidate_on_commit([recipe.pk])
+
+
+@receiver(image_variants_ready)
+def invalidate_recipe_image(sender, recipe_id, **kwargs):
+    invalidate_on_commit([recipe_id])
+
+
+@receiver(m2m_changed, sender=Recipe.tags.through)
+def invalidate_recipe_tags(sender, instance, action, reverse, pk_set,
+                           **kwargs):
+    if action not in ('post_add', 'post_remove', 'pre_clear'):
+        return
+    if not reverse:
+        invalidate_on_commit([instance.pk])
+    elif pk_set:
+        invalidate_on_commit(pk_set)
+    else:
+        invalidate_on_commit(
+            instance.recipes.values_list('id', flat=True)
+        )
+
+
+@receiver(post_save, sender=User)
+def invalidate_author_recipes(sender, instance, update_fields, **kwargs):
+    if update_fields and set(update_fields) <= {'last_login', 'password'}:
+        return
+    invalidate_on_commit(instance.recipes.values_list('id', flat=True))
+
+
+@receiver(post_delete, sender=Token)
+def forget_token(sender, instance, **kwargs):
+    key = instance.key
+    transaction.on_commit(lambda: token_cache.delete(key))
+
+
+def forget_user_on_commit(user_id):
+    """Сбрасывает токены пользователя после фиксации транзакции."""
+    transaction.on_commit(lambda: token_cache.delete_user(user_id))
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def forget_user_tokens(sender, instance, **kwargs):
+    forget_user_on_commit(instance.pk)
+
+
+@receiver(user_logged_out)
+def forget_logged_out_user(sender, user, **kwargs):
+    if user is not None:
+        forget_user_on_commit(user.pk)
+
+
+@receiver(connection_created)
+def time_queries(sender, connection, **kwargs):
+    if metrics.execute not in connection.execute_wrappers:
+        connection.execute_wrappers.append(metrics.execute)
@@ -0,0 +1,901 @@
+import asyncio
+import base64
+import csv
+import io
+import json
+import random
+import re
+import shutil
+import tempfile
+import threading
+import zipfile
+from collections import Counter
+from datetime import timedelta
+from unittest import mock
+
+from django.contrib.auth.models import AnonymousUser
+from django.core.cache import cache, caches
+from django.core.cache.backends.db import DatabaseCache
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.signals import request_finished
+from django.db import IntegrityError, close_old_connections, connections
+from django.db.models import Count
+from django.http import HttpResponse
+from django.test import (
+    AsyncClient, SimpleTestCase, TestCase, TransactionTestCase,
+    override_settings
+)
+from django.utils import timezone
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient, APIRequestFactory
+
+from recipes import consts
+from recipes.caching import bump_version, local_cache
+from recipes.counters import reconcile
+from recipes.exports import export_path, run_export
+from recipes.indexes import similar_index
+from recipes.models import (
+    Amount, ExportJob, Favorite, Ingredient, Recipe, ShopCart,
+    ShopCartTotal, Subscription, Tag, User
+)
+from .authentication import token_cache
+from .exporters import EXPORTERS, PDF_LINES_ON_PAGE
+from .fragments import fragment_keys, invalidate_fragments
+from .metrics import registry
+from .middleware import ServerTimingMiddleware
+from .routers import ReplicaRouter, is_sticky, mark_write, replica_reads
+from .serializers import RecipeWriteSerializer
+
+# Кэш в памяти, как memcached, не обращается к базе и не попадает
+# в число запросов.
+MEMORY_CACHES = {
+    alias: {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}
+    for alias in ('default', 'local')
+}
+
+
+class RecipeDataMixin:
+    """Пользователи, теги, ингредиенты и рецепты для тестов API."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(
+            username='reader', email='reader@example.com',
+            first_name='Reader', last_name='User', password='password-1'
+        )
+        cls.author = User.objects.create_user(
+            username='author', email='author@example.com',
+            first_name='Author', last_name='User', password='password-2'
+        )
+        cls.tags = Tag.objects.bulk_create(
+            Tag(name=f'tag {number}', slug=f'tag{number}', color=color)
+            for number, color in enumerate(
+                (Tag.GREEN, Tag.ORANGE, Tag.PURPLE)
+            )
+        )
+        cls.ingredients = Ingredient.objects.bulk_create(
+            Ingredient(name=f'ingredient {number}', measurement_unit='г')
+            for number in range(5)
+        )
+        cls.tags = list(Tag.objects.order_by('id'))
+        cls.ingredients = list(Ingredient.objects.order_by('id'))
+        cls.recipes = cls.create_recipes(cls.author, 60)
+
+    @classmethod
+    def create_recipes(cls, author, count):
+        # bulk_create без сигналов: картинок на диске нет.
+        Recipe.objects.bulk_create(
+            Recipe(
+                author=author, name=f'{author.username} {number}',
+                text='text', cooking_time=number % 30 + 1,
+                image='static/images/test.png'
+            )
+            for number in range(count)
+        )
+        recipes = list(
+            Recipe.objects.filter(author=author).order_by('id')
+        )
+        Recipe.tags.through.objects.bulk_create(
+            Recipe.tags.through(recipe=recipe, tag=tag)
+            for recipe in recipes for tag in cls.tags[:2]
+        )
+        Amount.objects.bulk_create(
+            Amount(recipe=recipe, ingredient=ingredient, amount=10)
+            for recipe in recipes for ingredient in cls.ingredients[:3]
+        )
+        return recipes
+
+    def setUp(self):
+        cache.clear()
+        local_cache.clear()
+        self.anonymous = APIClient()
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+
+@override_settings(CACHES=MEMORY_CACHES)
+class RecipeQueriesTest(RecipeDataMixin, TestCase):
+    """Число запросов списка и рецепта не зависит от размера страницы."""
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        Subscription.objects.create(user=cls.user, author=cls.author)
+        Favorite.objects.bulk_create(
+            Favorite(author=cls.user, recipe=recipe)
+            for recipe in cls.recipes[::2]
+        )
+        ShopCart.objects.bulk_create(
+            ShopCart(user=cls.user, recipe=recipe)
+            for recipe in cls.recipes[::3]
+        )
+
+    # COUNT, страница, авторы, теги, ингредиенты.
+    LIST_QUERIES = 5
+    # Рецепт, авторы, теги, ингредиенты.
+    DETAIL_QUERIES = 4
+
+    def assert_queries(self, client, path, queries):
+        cache.clear()
+        local_cache.clear()
+        with self.assertNumQueries(queries):
+            response = client.get(path)
+        self.assertEqual(response.status_code, 200, response.content)
+        return response.json()
+
+    def test_list(self):
+        for client in (self.anonymous, self.client):
+            for limit in (6, 50):
+                with self.subTest(client=client, limit=limit):
+                    data = self.assert_queries(
+                        client, f'/api/recipes/?limit={limit}',
+                        self.LIST_QUERIES
+                    )
+                    self.assertEqual(len(data['results']), limit)
+
+    def test_detail(self):
+        for client in (self.anonymous, self.client):
+            with self.subTest(client=client):
+                self.assert_queries(
+                    client, f'/api/recipes/{self.recipes[0].pk}/',
+                    self.DETAIL_QUERIES
+                )
+
+    def test_user_flags(self):
+        recipe = self.recipes[0]
+        data = self.client.get(f'/api/recipes/{recipe.pk}/').json()
+        self.assertTrue(data['is_favorite'])
+        self.assertTrue(data['is_in_shopping_cart'])
+        self.assertTrue(data['author']['is_subscribed'])
+        data = self.anonymous.get(f'/api/recipes/{recipe.pk}/').json()
+        self.assertFalse(data['is_favorite'])
+        self.assertFalse(data['author']['is_subscribed'])
+
+
+@override_settings(CACHES=MEMORY_CACHES)
+class RecipeUpdateQueriesTest(RecipeDataMixin, TestCase):
+    """Обновление рецепта пишет только разницу ингредиентов и тегов."""
+
+    # Точка сохранения, ингредиенты, теги, UPDATE рецепта,
+    # 4 запроса поиска, освобождение точки.
+    TITLE_QUERIES = 9
+    # Плюс DELETE, UPDATE и INSERT ингредиентов, DELETE, SELECT и
+    # INSERT тегов, корзины с рецептом.
+    DIFF_QUERIES = 16
+
+    def update(self, ingredients, tags, queries):
+        recipe = Recipe.objects.get(pk=self.recipes[0].pk)
+        request = APIRequestFactory().get('/')
+        request.user = self.author
+        serializer = RecipeWriteSerializer(context={'request': request})
+        with self.assertNumQueries(queries):
+            serializer.update(recipe, {
+                'ingredients': [
+                    {'id': ingredient.pk, 'amount': amount}
+                    for ingredient, amount in ingredients
+                ],
+                'tags': tags,
+                'name': 'renamed',
+            })
+        recipe.refresh_from_db()
+        self.assertEqual(recipe.name, 'renamed')
+        self.assertEqual(
+            dict(recipe.recipe_ingredients.values_list(
+                'ingredient', 'amount'
+            )),
+            {ingredient.pk: amount for ingredient, amount in ingredients}
+        )
+        self.assertEqual(set(recipe.tags.all()), set(tags))
+
+    def test_title_only(self):
+        self.update(
+            [(ingredient, 10) for ingredient in self.ingredients[:3]],
+            self.tags[:2], self.TITLE_QUERIES
+        )
+
+    def test_diff(self):
+        self.update(
+            [
+                (self.ingredients[0], 20),
+                (self.ingredients[1], 10),
+                (self.ingredients[3], 5),
+            ],
+            self.tags[1:], self.DIFF_QUERIES
+        )
+
+
+class BulkTogglesTest(RecipeDataMixin, TestCase):
+    """Статусы массовых переключателей отражают то, что записано."""
+
+    def bulk(self, path, method, ids):
+        response = getattr(self.client, method)(
+            path, {'ids': ids}, format='json'
+        )
+        self.assertEqual(response.status_code, 200, response.content)
+        return {
+            item['id']: item['status'] for item in response.json()['results']
+        }
+
+    def test_statuses(self):
+        first, second = (recipe.pk for recipe in self.recipes[:2])
+        missing = self.recipes[-1].pk + 1
+        path = '/api/recipes/shopping_cart/bulk/'
+        self.assertEqual(self.bulk(path, 'post', [first]), {
+            first: 'created'
+        })
+        self.assertEqual(self.bulk(path, 'post', [first, second, missing]), {
+            first: 'exists', second: 'created', missing: 'not_found'
+        })
+        self.assertEqual(ShopCart.objects.filter(user=self.user).count(), 2)
+        self.assertEqual(ShopCartTotal.objects.verify(), set())
+        self.assertEqual(self.bulk(path, 'delete', [first, missing]), {
+            first: 'deleted', missing: 'not_found'
+        })
+        self.assertEqual(self.bulk(path, 'delete', [first]), {
+            first: 'absent'
+        })
+        self.assertEqual(ShopCartTotal.objects.verify(), set())
+        self.assertEqual(
+            self.bulk('/api/users/subscribe/bulk/', 'post', [
+                self.user.pk, self.author.pk
+            ]),
+            {self.user.pk: 'forbidden', self.author.pk: 'created'}
+        )
+
+
+class TogglesTest(RecipeDataMixin, TestCase):
+    """Одиночные переключатели: повтор не ошибка, сбой не выдается за
+    существующую связь."""
+
+    def test_repeat(self):
+        recipe = self.recipes[0]
+        path = f'/api/recipes/{recipe.pk}/shopping_cart/'
+        for method, status in (
+            ('post', 201), ('post', 200), ('delete', 204), ('delete', 204)
+        ):
+            with self.subTest(method=method, status=status):
+                response = getattr(self.client, method)(path)
+                self.assertEqual(response.status_code, status)
+                self.assertEqual(ShopCartTotal.objects.verify(), set())
+        missing = self.recipes[-1].pk + 1
+        for method in ('post', 'delete'):
+            response = getattr(self.client, method)(
+                f'/api/recipes/{missing}/favorite/'
+            )
+            self.assertEqual(response.status_code, 404)
+        path = f'/api/users/{self.author.pk}/subscribe/'
+        self.assertEqual(self.client.post(path).status_code, 201)
+        self.assertEqual(self.client.post(path).status_code, 200)
+        self.assertEqual(self.client.delete(path).status_code, 204)
+
+    def test_failed_update(self):
+        # Например, гонка за строку итога корзины.
+        recipe = self.recipes[0]
+        client = APIClient(raise_request_exception=False)
+        client.force_authenticate(self.user)
+        with mock.patch.object(
+            ShopCartTotal.objects, 'apply', side_effect=IntegrityError
+        ):
+            response = client.post(f'/api/recipes/{recipe.pk}/shopping_cart/')
+        self.assertEqual(response.status_code, 500)
+        self.assertFalse(ShopCart.objects.exists())
+
+
+class RecipePermissionsTest(RecipeDataMixin, TestCase):
+    """Рецепт читают все, а меняет и удаляет только автор."""
+
+    def test_author_only(self):
+        recipe = self.recipes[0]
+        path = f'/api/recipes/{recipe.pk}/'
+        self.assertEqual(self.anonymous.get(path).status_code, 200)
+        self.assertEqual(self.anonymous.delete(path).status_code, 401)
+        self.assertEqual(
+            self.client.patch(path, {'name': 'чужой'}).status_code, 403
+        )
+        self.assertEqual(self.client.delete(path).status_code, 403)
+        recipe.refresh_from_db()
+        self.assertEqual(recipe.name, f'{self.author.username} 0')
+        self.client.force_authenticate(self.author)
+        self.assertEqual(self.client.delete(path).status_code, 204)
+        self.assertFalse(Recipe.objects.filter(pk=recipe.pk).exists())
+
+
+class SimilarRecipesTest(RecipeDataMixin, TestCase):
+    """Похожие рецепты и 404 на нечисловой id."""
+
+    def setUp(self):
+        super().setUp()
+        similar_index.invalidate()
+
+    def test_similar(self):
+        recipe = self.recipes[0]
+        response = self.client.get(f'/api/recipes/{recipe.pk}/similar/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()), 6)
+        self.assertNotIn(recipe.pk, [item['id'] for item in response.json()])
+
+    def test_not_found(self):
+        missing = self.recipes[-1].pk + 1
+        for path in (
+            f'/api/recipes/{missing}/similar/',
+            '/api/recipes/abc/similar/',
+            '/api/recipes/abc/',
+        ):
+            with self.subTest(path=path):
+                self.assertEqual(self.client.get(path).status_code, 404)
+
+
+class CursorPaginationTest(RecipeDataMixin, TestCase):
+    """Курсор листает в запрошенной сортировке и не падает на мусоре."""
+
+    def walk(self, path):
+        ids, url = [], f'{path}&cursor=&limit=7'
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200, response.content)
+            data = response.json()
+            ids.extend(recipe['id'] for recipe in data['results'])
+            url = data['next']
+        return ids
+
+    def test_ordering(self):
+        for ordering in ('cooking_time', '-cooking_time', 'newest'):
+            with self.subTest(ordering=ordering):
+                field = ordering.replace('newest', 'id')
+                expected = list(Recipe.objects.order_by(
+                    field, '-id'
+                ).values_list('id', flat=True))
+                self.assertEqual(
+                    self.walk(f'/api/recipes/?ordering={ordering}'), expected
+                )
+
+    def test_search(self):
+        response = self.client.get('/api/recipes/?search=author&cursor=')
+        self.assertEqual(response.status_code, 400)
+
+    def test_malformed_cursor(self):
+        cases = {
+            '/api/recipes/': (
+                ['abc'], [None], [{'a': 1}], [[1]], [True], 'x', []
+            ),
+            '/api/users/': (
+                ['user', 'abc'], ['user', None], [{'a': 1}, 1], ['user']
+            ),
+            '/api/recipes/feed/': (['abc'], [1.5], [True], [1, 2]),
+        }
+        for path, cursors in cases.items():
+            for values in cursors:
+                cursor = base64.urlsafe_b64encode(
+                    json.dumps(values).encode()
+                ).decode()
+                with self.subTest(path=path, values=values):
+                    response = self.client.get(f'{path}?cursor={cursor}')
+                    self.assertEqual(response.status_code, 404)
+
+
+class RecipeFilterTest(RecipeDataMixin, TestCase):
+    """Фильтры списка рецептов: теги через ИЛИ, флаги пользователя,
+    автор и сортировка по популярности."""
+
+    def ids(self, query, client=None):
+        response = (client or self.client).get(
+            f'/api/recipes/?limit=100&{query}'
+        )
+        self.assertEqual(response.status_code, 200, response.content)
+        return [recipe['id'] for recipe in response.json()['results']]
+
+    def test_tags(self):
+        first, second = self.recipes[:2]
+        first.tags.set([self.tags[2]])
+        second.tags.add(self.tags[2])
+        self.assertEqual(
+            self.ids(f'tags={self.tags[2].slug}'), [second.pk, first.pk]
+        )
+        self.assertEqual(
+            self.ids(f'tags={self.tags[0].slug}&tags={self.tags[2].slug}'),
+            [recipe.pk for recipe in reversed(self.recipes)]
+        )
+
+    def test_user_flags(self):
+        favorites, cart = self.recipes[3:5], self.recipes[10:13]
+        Favorite.objects.bulk_create(
+            Favorite(author=self.user, recipe=recipe) for recipe in favorites
+        )
+        ShopCart.objects.bulk_create(
+            ShopCart(user=self.user, recipe=recipe) for recipe in cart
+        )
+        Favorite.objects.create(author=self.author, recipe=self.recipes[0])
+        self.assertEqual(
+            self.ids('is_favorited=1'),
+            [recipe.pk for recipe in reversed(favorites)]
+        )
+        self.assertEqual(
+            self.ids('is_in_shopping_cart=1'),
+            [recipe.pk for recipe in reversed(cart)]
+        )
+        self.assertEqual(
+            self.ids('is_favorited=1&is_in_shopping_cart=1'), []
+        )
+        self.assertEqual(self.ids('is_favorited=0'), self.ids(''))
+        self.assertEqual(self.ids('is_favorited=1', self.anonymous), [])
+
+    def test_author(self):
+        own = self.create_recipes(self.user, 2)
+        self.assertEqual(
+            self.ids(f'author={self.user.pk}'),
+            [recipe.pk for recipe in reversed(own)]
+        )
+
+    def test_popularity(self):
+        for count, recipe in enumerate(self.recipes[5:8], 1):
+            Recipe.objects.filter(pk=recipe.pk).update(favorites_count=count)
+        self.assertEqual(
+            self.ids('ordering=-popularity')[:4],
+            [
+                self.recipes[7].pk, self.recipes[6].pk, self.recipes[5].pk,
+                self.recipes[-1].pk
+            ]
+        )
+
+
+class ConditionalGetTest(TestCase):
+    """304 отдается только клиенту с текущей версией."""
+
+    def setUp(self):
+        cache.clear()
+        local_cache.clear()
+        self.tag = Tag.objects.create(name='tag', slug='tag', color=Tag.GREEN)
+
+    def test_edit_in_same_second(self):
+        response = self.client.get('/api/tags/')
+        etag = response['ETag']
+        last_modified = response['Last-Modified']
+        response = self.client.get('/api/tags/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.tag.name = 'renamed'
+        self.tag.save()
+        for headers in (
+            {'HTTP_IF_MODIFIED_SINCE': last_modified},
+            {'HTTP_IF_NONE_MATCH': etag},
+        ):
+            with self.subTest(headers=headers):
+                response = self.client.get('/api/tags/', **headers)
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(response.json()[0]['name'], 'renamed')
+
+    def test_bump_in_other_process(self):
+        etag = self.client.get('/api/tags/')['ETag']
+        # Свой экземпляр кэша, как у другого рабочего процесса; память
+        # процесса другим процессам не видна.
+        other = caches.create_connection('default')
+        self.assertNotIsInstance(other, LocMemCache)
+        with mock.patch('recipes.caching.cache', other):
+            bump_version(Tag)
+        response = self.client.get('/api/tags/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+
+class FragmentInvalidationTest(RecipeDataMixin, TestCase):
+    """Фрагменты сбрасываются после фиксации транзакции, а не до нее."""
+
+    def cached(self, recipe):
+        return fragment_keys([recipe.pk])[recipe.pk] in cache
+
+    # Картинок тестовых рецептов на диске нет.
+    @mock.patch('recipes.signals.schedule_variants')
+    def test_on_commit(self, schedule_variants):
+        recipe = self.recipes[0]
+        self.anonymous.get(f'/api/recipes/{recipe.pk}/')
+        self.assertTrue(self.cached(recipe))
+        with self.captureOnCommitCallbacks(execute=True):
+            recipe.name = 'renamed'
+            recipe.save()
+            recipe.tags.remove(self.tags[0])
+            self.author.first_name = 'Renamed'
+            self.author.save()
+            self.assertTrue(self.cached(recipe))
+        self.assertFalse(self.cached(recipe))
+        data = self.anonymous.get(f'/api/recipes/{recipe.pk}/').json()
+        self.assertEqual(data['name'], 'renamed')
+        self.assertEqual(data['author']['first_name'], 'Renamed')
+        self.assertEqual(len(data['tags']), 1)
+
+    def test_invalidate_in_other_process(self):
+        recipe = self.recipes[0]
+        self.anonymous.get(f'/api/recipes/{recipe.pk}/')
+        Recipe.objects.filter(pk=recipe.pk).update(name='renamed')
+        # Сброс из другого рабочего процесса со своим экземпляром кэша.
+        with mock.patch(
+            'api.fragments.cache', caches.create_connection('default')
+        ):
+            invalidate_fragments([recipe.pk])
+        self.assertFalse(self.cached(recipe))
+        data = self.anonymous.get(f'/api/recipes/{recipe.pk}/').json()
+        self.assertEqual(data['name'], 'renamed')
+
+
+class TokenCacheTest(TestCase):
+    """Токен сбрасывается из кэша после фиксации транзакции."""
+
+    def setUp(self):
+        token_cache.clear()
+        self.user = User.objects.create_user(
+            username='reader', email='reader@example.com',
+            first_name='Reader', last_name='User', password='password-1'
+        )
+        self.token = Token.objects.create(user=self.user)
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {self.token.key}')
+
+    def test_on_commit(self):
+        key = self.token.key
+        self.assertEqual(self.client.get('/api/users/me/').status_code, 200)
+        self.assertIsNotNone(token_cache.get(key))
+        with self.captureOnCommitCallbacks(execute=True):
+            self.token.delete()
+            self.assertIsNotNone(token_cache.get(key))
+        self.assertIsNone(token_cache.get(key))
+        self.assertEqual(self.client.get('/api/users/me/').status_code, 401)
+
+
+@override_settings(REPLICA_DATABASES=['replica_1'])
+class ReplicaRouterTest(TestCase):
+    """Чтение разрешенных представлений уходит на реплику, запись,
+    транзакции и кэш - на основную базу."""
+
+    def setUp(self):
+        self.router = ReplicaRouter()
+        self.user = User.objects.create_user(
+            username='reader', email='reader@example.com',
+            first_name='Reader', last_name='User', password='password-1'
+        )
+
+    def read(self, model, replica=True, atomic=False):
+        token = replica_reads.set(replica)
+        try:
+            # TestCase держит открытую транзакцию.
+            with mock.patch.object(
+                connections['default'], 'in_atomic_block', atomic
+            ):
+                return self.router.db_for_read(model)
+        finally:
+            replica_reads.reset(token)
+
+    def test_routing(self):
+        self.assertEqual(self.read(Recipe), 'replica_1')
+        self.assertEqual(self.read(Recipe, replica=False), 'default')
+        self.assertEqual(self.router.db_for_write(Recipe), 'default')
+        cache_entry = DatabaseCache('django_cache', {}).cache_model_class
+        self.assertEqual(self.read(cache_entry), 'default')
+        with override_settings(REPLICA_DATABASES=[]):
+            self.assertEqual(self.read(Recipe), 'default')
+        self.assertEqual(self.read(Recipe, atomic=True), 'default')
+
+    def test_sticky_in_other_process(self):
+        self.assertFalse(is_sticky(self.user))
+        # Запись обслужил другой рабочий процесс со своим экземпляром кэша.
+        with mock.patch(
+            'api.routers.cache', caches.create_connection('default')
+        ):
+            mark_write(self.user.pk)
+        self.assertTrue(is_sticky(self.user))
+        self.assertFalse(is_sticky(AnonymousUser()))
+
+
+class AsyncMiddlewareTest(TestCase):
+    """Под ASGI хуки middleware выполняются в цикле событий, а маршрут
+    для метрик берется из resolver_match."""
+
+    def test_hooks(self):
+        async def get_response(request):
+            return HttpResponse()
+
+        middleware = ServerTimingMiddleware(get_response)
+        self.assertTrue(asyncio.iscoroutinefunction(
+            middleware.process_template_response
+        ))
+        self.assertFalse(hasattr(middleware, 'process_view'))
+
+    async def test_route_name(self):
+        response = await AsyncClient().get('/api/tags/')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('Server-Timing', response)
+        self.assertIn(
+            'TagViewSet.list', registry.histograms['total'].series
+        )
+
+
+class MetricsTest(RecipeDataMixin, TestCase):
+    """/api/metrics отдает гистограммы только администратору."""
+
+    def test_admin_only(self):
+        self.assertEqual(self.client.get('/api/tags/').status_code, 200)
+        self.assertEqual(self.anonymous.get('/api/metrics').status_code, 401)
+        self.assertEqual(self.client.get('/api/metrics').status_code, 403)
+        admin = User.objects.create_user(
+            username='admin', email='admin@example.com', first_name='Admin',
+            last_name='User', password='password-3', is_staff=True
+        )
+        self.client.force_authenticate(admin)
+        response = self.client.get('/api/metrics')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response['Content-Type'].startswith('text/plain'))
+        name = registry.histograms['total'].name
+        self.assertIn(f'# TYPE {name} histogram', response.content.decode())
+        self.assertIn(
+            f'{name}_count{{route="TagViewSet.list"}}',
+            response.content.decode()
+        )
+
+
+class ExportsTest(RecipeDataMixin, TestCase):
+    """Выгрузка пишет файл, скачивается, ограничена и устаревает."""
+
+    def setUp(self):
+        super().setUp()
+        export_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, export_root)
+        settings = override_settings(EXPORT_ROOT=export_root)
+        settings.enable()
+        self.addCleanup(settings.disable)
+
+    def create(self):
+        with mock.patch('api.views.schedule_export'):
+            return self.client.post('/api/users/me/exports/')
+
+    def test_download(self):
+        job_id = self.create().json()['id']
+        path = f'/api/users/me/exports/{job_id}/download/'
+        self.assertEqual(self.client.get(path).status_code, 409)
+        run_export(job_id)
+        job = ExportJob.objects.get(pk=job_id)
+        self.assertEqual(job.status, ExportJob.DONE)
+        response = self.client.get(path)
+        self.assertEqual(response.status_code, 200)
+        data = json.loads(b''.join(response.streaming_content))
+        self.assertEqual(data['user']['id'], self.user.pk)
+        self.assertEqual(data['recipes'], [])
+        # close() ответа шлет request_finished, который закрыл бы
+        # соединение тестовой транзакции.
+        request_finished.disconnect(close_old_connections)
+        try:
+            response.close()
+        finally:
+            request_finished.connect(close_old_connections)
+        export_path(job).unlink()
+        self.assertEqual(self.client.get(path).status_code, 410)
+
+    def test_limit(self):
+        for _ in range(consts.EXPORT_ACTIVE_LIMIT):
+            self.assertEqual(self.create().status_code, 202)
+        self.assertEqual(self.create().status_code, 429)
+        run_export(ExportJob.objects.last().pk)
+        self.assertEqual(self.create().status_code, 202)
+
+    def test_remove_expired(self):
+        old, fresh = (self.create().json()['id'] for _ in range(2))
+        run_export(old)
+        path = export_path(ExportJob.objects.get(pk=old))
+        ExportJob.objects.filter(pk=old).update(
+            finished=timezone.now() - timedelta(
+                days=consts.EXPORT_KEEP_DAYS + 1
+            )
+        )
+        run_export(fresh)
+        self.assertFalse(ExportJob.objects.filter(pk=old).exists())
+        self.assertFalse(path.exists())
+        self.assertTrue(ExportJob.objects.filter(pk=fresh).exists())
+
+
+class ExportersTest(SimpleTestCase):
+    """Файлы списка покупок читаются обычными парсерами форматов."""
+
+    rows = [
+        {'name': 'Соль', 'measurement_unit': 'г', 'amount': 5},
+        {'name': 'Мука (в/с)', 'measurement_unit': 'кг', 'amount': 1},
+    ]
+
+    def export(self, format, rows=None):
+        exporter = EXPORTERS[format](self.rows if rows is None else rows)
+        return b''.join(
+            chunk if isinstance(chunk, bytes) else chunk.encode()
+            for chunk in exporter.stream()
+        )
+
+    def test_txt(self):
+        self.assertEqual(
+            self.export('txt').decode().splitlines(),
+            ['Соль - 5 г', 'Мука (в/с) - 1 кг']
+        )
+
+    def test_csv(self):
+        lines = self.export('csv').decode().splitlines()
+        self.assertEqual(list(csv.reader(lines)), [
+            ['name', 'measurement_unit', 'amount'],
+            ['Соль', 'г', '5'],
+            ['Мука (в/с)', 'кг', '1'],
+        ])
+
+    def test_docx(self):
+        archive = zipfile.ZipFile(io.BytesIO(self.export('docx')))
+        self.assertIsNone(archive.testzip())
+        self.assertIn('[Content_Types].xml', archive.namelist())
+        self.assertIn('_rels/.rels', archive.namelist())
+        document = archive.read('word/document.xml').decode()
+        self.assertEqual(
+            re.findall(r'<w:t>(.*?)</w:t>', document),
+            ['Список покупок', 'Соль - 5 г', 'Мука (в/с) - 1 кг']
+        )
+
+    def test_pdf(self):
+        rows = self.rows * PDF_LINES_ON_PAGE
+        data = self.export('pdf', rows)
+        self.assertTrue(data.startswith(b'%PDF-1.4'))
+        self.assertTrue(data.endswith(b'%%EOF\n'))
+        xref = int(re.search(rb'startxref\n(\d+)', data).group(1))
+        self.assertTrue(data[xref:].startswith(b'xref\n'))
+        entries = re.findall(rb'(\d{10}) 00000 n', data[xref:])
+        for number, offset in enumerate(entries, 1):
+            self.assertTrue(
+                data[int(offset):].startswith(f'{number} 0 obj'.encode())
+            )
+        self.assertIn(b'/Count 3', data)
+        font = re.search(rb'3 0 obj\n(.*?)\nendobj', data, re.S).group(1)
+        self.assertIn(b'/Subtype /Type1 /BaseFont /Helvetica', font)
+        self.assertIn(b'/BaseEncoding /WinAnsiEncoding', font)
+        lines = [
+            re.sub(rb'\\(.)', rb'\1', line).decode('cp1251')
+            for line in re.findall(rb'\(((?:\\.|[^\\)])*)\) Tj', data)
+        ]
+        self.assertEqual(lines[:3], [
+            'Список покупок', 'Соль - 5 г', 'Мука (в/с) - 1 кг'
+        ])
+        self.assertEqual(len(lines), len(rows) + 1)
+
+
+class TogglesStressTest(TransactionTestCase):
+    """Одновременные POST и DELETE избранного, списка покупок и подписок,
+    одиночные и массовые, не дают 5xx, дублей и расхождений счетчиков
+    и итогов."""
+
+    THREADS = 8
+    ROUNDS = 15
+    BARRIER_TIMEOUT = 60
+    # Адрес переключателя, модель связи, поле пользователя и цели.
+    TOGGLES = (
+        ('/api/recipes/{recipe}/favorite/', Favorite, 'author', 'recipe'),
+        ('/api/recipes/{recipe}/shopping_cart/', ShopCart, 'user', 'recipe'),
+        ('/api/users/{author}/subscribe/', Subscription, 'user', 'author'),
+    )
+    # Массовые переключатели: адрес и цель, id которой идут в тело.
+    BULK_TOGGLES = (
+        ('/api/recipes/favorite/bulk/', 'recipe'),
+        ('/api/recipes/shopping_cart/bulk/', 'recipe'),
+        ('/api/users/subscribe/bulk/', 'author'),
+    )
+
+    def setUp(self):
+        cache.clear()
+        local_cache.clear()
+        # Мало пользователей и рецептов - больше гонок.
+        self.users = [
+            User.objects.create_user(
+                username=f'stress{number}',
+                email=f'stress{number}@example.com',
+                first_name='Stress', last_name='User',
+                password='stress-password'
+            )
+            for number in range(3)
+        ]
+        ingredients = Ingredient.objects.bulk_create(
+            Ingredient(name=f'stress {number}', measurement_unit='г')
+            for number in range(5)
+        )
+        ingredients = list(Ingredient.objects.order_by('id'))
+        # bulk_create без сигналов: картинки не нужны, счетчики
+        # пересчитывает reconcile.
+        Recipe.objects.bulk_create(
+            Recipe(
+                author=self.users[number % 3], name=f'stress {number}',
+                text='stress', cooking_time=10, image='recipes/stress.png'
+            )
+            for number in range(3)
+        )
+        self.recipes = list(Recipe.objects.order_by('id'))
+        Amount.objects.bulk_create(
+            Amount(recipe=recipe, ingredient=ingredient, amount=10)
+            for recipe in self.recipes for ingredient in ingredients
+        )
+        reconcile()
+
+    def plan(self, rng):
+        targets = {'recipe': self.recipes, 'author': self.users}
+        for _ in range(self.ROUNDS):
+            if rng.random() < 0.5:
+                path, target = rng.choice(self.BULK_TOGGLES)
+                data = {'ids': [
+                    item.pk for item in rng.sample(
+                        targets[target], rng.randint(1, len(targets[target]))
+                    )
+                ]}
+            else:
+                path, data = rng.choice(self.TOGGLES)[0].format(
+                    recipe=rng.choice(self.recipes).pk,
+                    author=rng.choice(self.users).pk
+                ), None
+            yield (
+                rng.choice(self.users), path,
+                rng.choice(('post', 'delete')), data
+            )
+
+    def test_concurrent_toggles(self):
+        rng = random.Random(0)
+        plans = [list(self.plan(rng)) for _ in range(self.THREADS)]
+        statuses = Counter()
+        lock = threading.Lock()
+        barrier = threading.Barrier(
+            self.THREADS, timeout=self.BARRIER_TIMEOUT
+        )
+
+        def worker(plan):
+            clients = {}
+            try:
+                for user, path, method, data in plan:
+                    client = clients.get(user.pk)
+                    if client is None:
+                        client = APIClient(raise_request_exception=False)
+                        client.force_authenticate(user)
+                        clients[user.pk] = client
+                    barrier.wait()
+                    response = getattr(client, method)(
+                        path, data, format='json'
+                    )
+                    with lock:
+                        statuses[
+                            f'{method.upper()} {response.status_code}'
+                        ] += 1
+            finally:
+                connections.close_all()
+
+        threads = [
+            threading.Thread(target=worker, args=(plan,)) for plan in plans
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(
+            sum(statuses.values()), self.THREADS * self.ROUNDS, statuses
+        )
+        self.assertFalse(
+            [key for key in statuses if int(key.split()[1]) >= 500],
+            statuses
+        )
+        for _, model, user_field, target_field in self.TOGGLES:
+            with self.subTest(model=model.__name__):
+                self.assertFalse(model.objects.values(
+                    user_field, target_field
+                ).annotate(rows=Count('pk')).filter(rows__gt=1).exists())
+        self.assertEqual(set(reconcile(dry_run=True).values()), {0})
+        self.assertEqual(ShopCartTotal.objects.verify(), set())
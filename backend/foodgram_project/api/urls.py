@@ -1,7 +1,11 @@
+from django.conf import settings
 from django.urls import include, path
 from rest_framework import routers
 
-from .views import IngredientViewSet, RecipeViewSet, TagViewSet, UserViewSet
+from .async_views import async_urls
+from .views import (
+    IngredientViewSet, MetricsView, RecipeViewSet, TagViewSet, UserViewSet
+)
 
 router_v1 = routers.DefaultRouter()
 router_v1.register('users', UserViewSet, basename='users')
@@ -9,7 +13,18 @@ router_v1.register('tags', TagViewSet, basename='tags')
 router_v1.register('recipes', RecipeViewSet, basename='recipes')
 router_v1.register('ingredients', IngredientViewSet, basename='ingredients')
 
+# Горячие маршруты чтения, которые под ASGI обслуживаются async.
+ASYNC_ROUTES = (
+    'recipes-list', 'recipes-detail', 'ingredients-list',
+    'ingredients-detail', 'tags-list', 'tags-detail', 'users-me',
+)
+
+router_urls = router_v1.urls
+if settings.ASYNC_VIEWS:
+    router_urls = async_urls(router_urls, ASYNC_ROUTES)
+
 urlpatterns = [
     path('auth/', include('djoser.urls.authtoken')),
-    path('', include(router_v1.urls)),
+    path('metrics', MetricsView.as_view(), name='metrics'),
+    path('', include(router_urls)),
 ]
@@ -1,30 +1,33 @@
-from django.db.models import Sum
-from django.http import HttpResponse
+from django.db.models import F
+from django.http import StreamingHttpResponse
+from rest_framework import status
+from rest_framework.response import Response
 
-from recipes.models import Amount
+from recipes.models import ShopCartTotal
+from .exporters import EXPORTERS
 
-CT = 'application/vnd.openxmlformats-officedocument.wordprocessingml.document'
 
-
-def shopping_cart(self, request, author):
-    sum_of_ingredients = Amount.objects.filter(
-        recipe__shop_cart__author=author
+def shopping_cart(request, user):
+    export_format = request.query_params.get('format', 'txt')
+    exporter = EXPORTERS.get(export_format)
+    if exporter is None:
+        return Response(
+            f'Доступные форматы: {", ".join(EXPORTERS)}.',
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    sum_of_ingredients = ShopCartTotal.objects.filter(
+        user=user
     ).values(
-        'ingredient__name', 'ingredient__measurment_unit'
-    ).annotate(
-        amounts=Sum('amount', distinct=True)
+        name=F('ingredient__name'),
+        measurement_unit=F('ingredient__measurement_unit'),
+        amount=F('total')
+    ).order_by('name')
+    exporter = exporter(sum_of_ingredients.iterator())
+    response = StreamingHttpResponse(
+        exporter.stream(),
+        content_type=exporter.content_type
     )
-    shopping_list = ''
-    for ingredient in sum_of_ingredients:
-        shopping_list += (
-            f'{ingredient["ingredient__name"]} - '
-            f'{ingredient["amounts"]} '
-            f'{ingredient["ingredient__measurment_unit"]}\n'
-        )
-    filename = 'shopping_list.docx'
-    response = HttpResponse(
-        shopping_list,
-        content_type=(CT)
+    response['Content-Disposition'] = (
+        f'attachment; filename={exporter.filename}'
     )
-    response['Content-Disposition'] = f'attachment; filename={filename}'
     return response
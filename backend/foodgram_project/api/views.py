@@ -1,30 +1,57 @@
+from django.http import FileResponse, Http404, HttpResponse
 from django.shortcuts import get_object_or_404
 from django_filters.rest_framework import DjangoFilterBackend
 from rest_framework import filters, status, viewsets
 from rest_framework.decorators import action
 from rest_framework.permissions import (
     SAFE_METHODS, AllowAny,
-    IsAuthenticated,
+    IsAdminUser, IsAuthenticated, IsAuthenticatedOrReadOnly
 )
 from rest_framework.response import Response
+from rest_framework.views import APIView
 
-from recipes.models import Ingredient, Recipe, Tag, User
-from .paginations import Pagination
+from recipes import bulk, consts
+from recipes.exports import export_path, schedule_export
+from recipes.indexes import ingredient_index, similar_index
+from recipes.models import (
+    ExportJob, Favorite, Ingredient, Recipe, ShopCart, Subscription, Tag, User
+)
+from .exporters import ExportContentNegotiation
+from .filters import RecipeFilter
+from .metrics import registry
+from .mixins import ReplicaReadMixin, VersionedCacheMixin
+from .paginations import FeedPagination, Pagination
+from .permissions import IsAuthorOrReadOnly
 from .serializers import (
-    FavoriteSerializer, IngredientSerializer,
-    PasswordSerializer, RecipeReadSerializer,
+    BulkIdsSerializer, ExportJobSerializer, FavoriteSerializer,
+    IngredientSerializer, PasswordSerializer, RecipeReadSerializer,
     RecipeWriteSerializer, ShopCartSerializer,
-    SubscriptionSerializer, TagSerializer,
+    ShopCartTotalSerializer, SubscriptionSerializer, TagSerializer,
     UserSerializer
 )
 from .utils import shopping_cart
 
 
+def bulk_response(request, apply):
+    """POST добавляет, DELETE удаляет связи со списком ids из тела."""
+    serializer = BulkIdsSerializer(data=request.data)
+    serializer.is_valid(raise_exception=True)
+    statuses = apply(
+        request.user, serializer.validated_data['ids'],
+        add=request.method == 'POST'
+    )
+    return Response({'results': [
+        {'id': pk, 'status': item_status}
+        for pk, item_status in statuses.items()
+    ]})
+
+
 class UserViewSet(viewsets.ModelViewSet):
     queryset = User.objects.all()
     serializer_class = UserSerializer
     permission_classes = (AllowAny,)
     pagination_class = Pagination
+    lookup_value_regex = r'\d+'
 
     @action(
         detail=False,
@@ -59,13 +86,17 @@ class UserViewSet(viewsets.ModelViewSet):
         pagination_class=Pagination
     )
     def subscriptions(self, request):
-        user = request.user
-        subscriptions = user.subscriber.all()
+        recipes_limit = self.get_recipes_limit()
+        subscriptions = request.user.subscriber.with_recipes(
+            recipes_limit
+        ).order_by('-id')
+        page = self.paginate_queryset(subscriptions)
         serializer = SubscriptionSerializer(
-            subscriptions,
+            page,
             many=True,
+            context={'request': request, 'recipes_limit': recipes_limit}
         )
-        return Response(serializer.data)
+        return self.get_paginated_response(serializer.data)
 
     @action(
         detail=True,
@@ -75,18 +106,106 @@ class UserViewSet(viewsets.ModelViewSet):
     )
     def subscribe(self, request, pk=None):
         user = request.user
+        pk = int(pk)
+        if request.method == 'DELETE':
+            if bulk.subscriptions(user, [pk], add=False)[pk] == bulk.NOT_FOUND:
+                raise Http404
+            return Response(status=status.HTTP_204_NO_CONTENT)
         author = get_object_or_404(User, id=pk)
+        context = {
+            'request': request,
+            'author': author,
+            'recipes_limit': self.get_recipes_limit()
+        }
+        serializer = SubscriptionSerializer(data=request.data, context=context)
+        serializer.is_valid(raise_exception=True)
+        created = bulk.subscriptions(user, [pk], add=True)[pk] == bulk.CREATED
+        serializer = SubscriptionSerializer(
+            Subscription(user=user, author=author), context=context
+        )
+        return Response(serializer.data, status=(
+            status.HTTP_201_CREATED if created else status.HTTP_200_OK
+        ))
+
+    @action(
+        detail=False,
+        methods=['post', 'delete'],
+        url_path='subscribe/bulk',
+        permission_classes=(IsAuthenticated,),
+    )
+    def subscribe_bulk(self, request):
+        return bulk_response(request, bulk.subscriptions)
+
+    @action(
+        detail=False,
+        methods=['get', 'post'],
+        url_path='me/exports',
+        permission_classes=(IsAuthenticated,),
+        pagination_class=Pagination
+    )
+    def exports(self, request):
         if request.method == 'POST':
-            serializer = SubscriptionSerializer(
-                data=request.data,
-                context={'request': request, 'author': author}
+            if request.user.export_jobs.filter(
+                status__in=(ExportJob.PENDING, ExportJob.RUNNING)
+            ).count() >= consts.EXPORT_ACTIVE_LIMIT:
+                return Response(
+                    'Слишком много невыполненных выгрузок.',
+                    status=status.HTTP_429_TOO_MANY_REQUESTS
+                )
+            job = ExportJob.objects.create(user=request.user)
+            schedule_export(job)
+            serializer = ExportJobSerializer(
+                job, context={'request': request}
             )
-            serializer.is_valid(raise_exception=True)
-            serializer.save(user=user, author=author)
-            return Response(serializer.data, status=status.HTTP_201_CREATED)
-        author.subscribed.filter(user=user).delete()
-        # Subscription.objects.filter(author=author).delete()
-        return Response(status=status.HTTP_204_NO_CONTENT)
+            return Response(serializer.data, status=status.HTTP_202_ACCEPTED)
+        page = self.paginate_queryset(request.user.export_jobs.all())
+        serializer = ExportJobSerializer(
+            page, many=True, context={'request': request}
+        )
+        return self.get_paginated_response(serializer.data)
+
+    @action(
+        detail=False,
+        methods=['get', ],
+        url_path=r'me/exports/(?P<job_id>\d+)',
+        permission_classes=(IsAuthenticated,)
+    )
+    def export(self, request, job_id=None):
+        job = get_object_or_404(request.user.export_jobs, pk=job_id)
+        serializer = ExportJobSerializer(job, context={'request': request})
+        return Response(serializer.data)
+
+    @action(
+        detail=False,
+        methods=['get', ],
+        url_path=r'me/exports/(?P<job_id>\d+)/download',
+        permission_classes=(IsAuthenticated,)
+    )
+    def export_download(self, request, job_id=None):
+        job = get_object_or_404(request.user.export_jobs, pk=job_id)
+        if job.status != ExportJob.DONE:
+            return Response(
+                'Выгрузка еще не готова.',
+                status=status.HTTP_409_CONFLICT
+            )
+        try:
+            file = open(export_path(job), 'rb')
+        except FileNotFoundError:
+            return Response(
+                'Файл выгрузки удален.', status=status.HTTP_410_GONE
+            )
+        return FileResponse(
+            file,
+            as_attachment=True,
+            filename=f'foodgram_export_{job.pk}.json',
+            content_type='application/json'
+        )
+
+    def get_recipes_limit(self):
+        recipes_limit = self.request.query_params.get('recipes_limit')
+        if recipes_limit and recipes_limit.isdigit():
+            return int(recipes_limit)
+        return None
 
     def get_serializer_class(self):
         if self.action == 'set_password':
@@ -96,29 +215,118 @@ class UserViewSet(viewsets.ModelViewSet):
         return UserSerializer
 
 
-class TagViewSet(viewsets.ReadOnlyModelViewSet):
+class TagViewSet(
+    ReplicaReadMixin, VersionedCacheMixin, viewsets.ReadOnlyModelViewSet
+):
     queryset = Tag.objects.all()
     serializer_class = TagSerializer
     permission_classes = (AllowAny,)
+    cache_models = (Tag,)
 
 
-class IngredientViewSet(viewsets.ReadOnlyModelViewSet):
+class IngredientViewSet(
+    ReplicaReadMixin, VersionedCacheMixin, viewsets.ReadOnlyModelViewSet
+):
     queryset = Ingredient.objects.all()
     serializer_class = IngredientSerializer
     permission_classes = (AllowAny,)
+    cache_models = (Ingredient,)
     filter_backends = (DjangoFilterBackend, filters.SearchFilter)
     search_fields = ('^name',)
 
+    def list(self, request, *args, **kwargs):
+        name = request.query_params.get('name')
+        if name:
+            serializer = self.get_serializer(
+                ingredient_index.search(name), many=True
+            )
+            return Response(serializer.data)
+        return super().list(request, *args, **kwargs)
+
 
-class RecipeViewSet(viewsets.ModelViewSet):
+class RecipeViewSet(ReplicaReadMixin, viewsets.ModelViewSet):
     queryset = Recipe.objects.all()
+    lookup_value_regex = r'\d+'
+    permission_classes = (IsAuthenticatedOrReadOnly, IsAuthorOrReadOnly)
     pagination_class = Pagination
+    filter_backends = (DjangoFilterBackend,)
+    filterset_class = RecipeFilter
+    replica_actions = ('list', 'retrieve', 'feed', 'similar')
+
+    def get_queryset(self):
+        if self.request.method not in SAFE_METHODS:
+            return self.queryset
+        queryset = self.queryset.with_user_flags(self.request.user)
+        search = self.request.query_params.get('search')
+        if search:
+            queryset = queryset.search(search)
+        return queryset
+
+    def get_serializer_context(self):
+        context = super().get_serializer_context()
+        if self.action in ('list', 'feed', 'similar'):
+            context['image_variant'] = 'thumbnail'
+        return context
 
     def get_serializer_class(self):
         if self.request.method in SAFE_METHODS:
             return RecipeReadSerializer
         return RecipeWriteSerializer
 
+    @staticmethod
+    def toggle(request, pk, apply, relation, user_field, serializer_class):
+        """POST добавляет, DELETE удаляет связь пользователя с рецептом.
+
+        Запись идет через bulk с одним id: один INSERT ... ON CONFLICT
+        DO NOTHING или DELETE с RETURNING, так что гонка двух запросов
+        не меняет счетчики дважды. Повтор запроса не ошибка: POST
+        существующей связи отвечает 200, DELETE отсутствующей - 204.
+        """
+        user = request.user
+        pk = int(pk)
+        if request.method == 'DELETE':
+            if apply(user, [pk], add=False)[pk] == bulk.NOT_FOUND:
+                raise Http404
+            return Response(status=status.HTTP_204_NO_CONTENT)
+        recipe = get_object_or_404(Recipe, id=pk)
+        created = apply(user, [pk], add=True)[pk] == bulk.CREATED
+        serializer = serializer_class(
+            relation(**{user_field: user, 'recipe': recipe})
+        )
+        return Response(serializer.data, status=(
+            status.HTTP_201_CREATED if created else status.HTTP_200_OK
+        ))
+
+    @action(
+        detail=False,
+        methods=['get'],
+        url_path='feed',
+        permission_classes=(IsAuthenticated,),
+        pagination_class=FeedPagination
+    )
+    def feed(self, request):
+        ids = self.paginator.paginate_feed(request, request.user)
+        recipes = self.get_queryset().filter(id__in=ids).order_by('-id')
+        serializer = self.get_serializer(recipes, many=True)
+        return self.paginator.get_paginated_response(serializer.data)
+
+    @action(detail=True, methods=['get'], url_path='similar')
+    def similar(self, request, pk=None):
+        limit = request.query_params.get('limit')
+        if limit and limit.isdigit():
+            limit = min(int(limit), consts.SIMILAR_LIMIT_MAX)
+        else:
+            limit = consts.SIMILAR_LIMIT
+        ids = similar_index.similar(int(pk), limit)
+        if ids is None:
+            get_object_or_404(Recipe, pk=pk)
+            ids = []
+        recipes = self.get_queryset().in_bulk(ids)
+        serializer = self.get_serializer(
+            [recipes[pk] for pk in ids if pk in recipes], many=True
+        )
+        return Response(serializer.data)
+
     @action(
         detail=True,
         methods=['post', 'delete'],
@@ -126,15 +334,19 @@ class RecipeViewSet(viewsets.ModelViewSet):
         permission_classes=(IsAuthenticated,)
     )
     def favorite(self, request, pk=None):
-        recipe = get_object_or_404(Recipe, id=pk)
-        user = request.user
-        if request.method == 'POST':
-            serializer = FavoriteSerializer(data=request.data)
-            serializer.is_valid(raise_exception=True)
-            serializer.save(author=user, recipe=recipe)
-            return Response(serializer.data, status=status.HTTP_201_CREATED)
-        recipe.favorite.filter(user=user).delete()
-        return Response(status=status.HTTP_204_NO_CONTENT)
+        return self.toggle(
+            request, pk, bulk.favorites, Favorite, 'author',
+            FavoriteSerializer
+        )
+
+    @action(
+        detail=False,
+        methods=['post', 'delete'],
+        url_path='favorite/bulk',
+        permission_classes=(IsAuthenticated,)
+    )
+    def favorite_bulk(self, request):
+        return bulk_response(request, bulk.favorites)
 
     @action(
         detail=True,
@@ -143,27 +355,57 @@ class RecipeViewSet(viewsets.ModelViewSet):
         permission_classes=(IsAuthenticated,)
     )
     def shopping_cart(self, request, pk=None):
-        recipe = get_object_or_404(Recipe, id=pk)
-        user = request.user
-        if request.method == 'POST':
-            serializer = ShopCartSerializer(data=request.data)
-            serializer.is_valid(raise_exception=True)
-            serializer.save(author=user, recipe=recipe)
-            return Response(serializer.data, status=status.HTTP_201_CREATED)
-        recipe.shop_cart.filter(user=user).delete()
-        return Response(status=status.HTTP_204_NO_CONTENT)
+        return self.toggle(
+            request, pk, bulk.shopping_cart, ShopCart, 'user',
+            ShopCartSerializer
+        )
+
+    @action(
+        detail=False,
+        methods=['post', 'delete'],
+        url_path='shopping_cart/bulk',
+        permission_classes=(IsAuthenticated,)
+    )
+    def shopping_cart_bulk(self, request):
+        return bulk_response(request, bulk.shopping_cart)
 
     @action(
         detail=False,
         methods=['get'],
-        url_path='download_shopping_cart',
+        url_path='shopping_cart_totals',
         permission_classes=(IsAuthenticated,)
     )
+    def shopping_cart_totals(self, request):
+        totals = request.user.shop_cart_totals.select_related(
+            'ingredient'
+        ).order_by('ingredient__name')
+        serializer = ShopCartTotalSerializer(totals, many=True)
+        return Response(serializer.data)
+
+    @action(
+        detail=False,
+        methods=['get'],
+        url_path='download_shopping_cart',
+        permission_classes=(IsAuthenticated,),
+        content_negotiation_class=ExportContentNegotiation
+    )
     def download_shopping_cart(self, request):
         author = self.request.user
         if author.shop_cart.exists():
-            return shopping_cart(self, request, author)
+            return shopping_cart(request, author)
         return Response(
             'Список покупок пуст.',
             status=status.HTTP_404_NOT_FOUND
         )
+
+
+class MetricsView(APIView):
+    """Гистограммы запросов в текстовом формате Prometheus."""
+
+    permission_classes = (IsAdminUser,)
+
+    def get(self, request):
+        return HttpResponse(
+            registry.render(),
+            content_type='text/plain; version=0.0.4; charset=utf-8'
+        )
@@ -1,6 +1,24 @@
+from collections import Counter, defaultdict
+
 from django.contrib import admin
+from django.db.models import Sum
+
+from .models import (
+    Amount, Ingredient, Recipe, ShopCartTotal, Subscription, Tag, User
+)
+from .signals import recipe_ingredients_changed
+
+
+def recipe_amounts(recipe):
+    return Counter(dict(
+        recipe.recipe_ingredients.values_list('ingredient', 'amount')
+    ))
+
 
-from .models import Amount, Ingredient, Recipe, Subscription, Tag, User
+def change_totals(recipe, deltas):
+    """Переносит изменение ингредиентов рецепта в итоги корзин."""
+    if any(deltas.values()):
+        ShopCartTotal.objects.change_recipe(recipe, deltas)
 
 
 @admin.register(User)
@@ -44,6 +62,16 @@ class RecipeAdmin(admin.ModelAdmin):
     search_fields = ('name',)
     inlines = [IngredientsInline]
 
+    def save_related(self, request, form, formsets, change):
+        recipe = form.instance
+        before = recipe_amounts(recipe) if change else Counter()
+        super().save_related(request, form, formsets, change)
+        if change:
+            deltas = recipe_amounts(recipe)
+            deltas.subtract(before)
+            change_totals(recipe, deltas)
+        recipe_ingredients_changed.send(sender=Recipe, recipe=recipe)
+
 
 @admin.register(Ingredient)
 class IngredientAdmin(admin.ModelAdmin):
@@ -73,3 +101,34 @@ class AmountAdmin(admin.ModelAdmin):
     list_editable = (
         'amount',
     )
+
+    def save_model(self, request, obj, form, change):
+        old = Amount.objects.filter(pk=obj.pk).select_related(
+            'recipe'
+        ).first() if change else None
+        super().save_model(request, obj, form, change)
+        deltas = Counter({obj.ingredient_id: obj.amount})
+        if old is not None and old.recipe_id == obj.recipe_id:
+            deltas[old.ingredient_id] -= old.amount
+        elif old is not None:
+            change_totals(old.recipe, {old.ingredient_id: -old.amount})
+            recipe_ingredients_changed.send(sender=Recipe, recipe=old.recipe)
+        change_totals(obj.recipe, deltas)
+        recipe_ingredients_changed.send(sender=Recipe, recipe=obj.recipe)
+
+    def delete_model(self, request, obj):
+        super().delete_model(request, obj)
+        change_totals(obj.recipe, {obj.ingredient_id: -obj.amount})
+        recipe_ingredients_changed.send(sender=Recipe, recipe=obj.recipe)
+
+    def delete_queryset(self, request, queryset):
+        deltas = defaultdict(dict)
+        for row in queryset.values('recipe', 'ingredient').annotate(
+            total=Sum('amount')
+        ).order_by():
+            deltas[row['recipe']][row['ingredient']] = -row['total']
+        recipes = Recipe.objects.in_bulk(deltas)
+        super().delete_queryset(request, queryset)
+        for recipe_id, recipe in recipes.items():
+            change_totals(recipe, deltas[recipe_id])
+            recipe_ingredients_changed.send(sender=Recipe, recipe=recipe)
@@ -0,0 +1,28 @@
+from concurrent.futures import ThreadPoolExecutor
+
+from django.db import connections, transaction
+
+
+class BackgroundPool:
+    """Пул потоков для работы, которую запрос не ждет.
+
+    Задача запускается после фиксации транзакции, чтобы видеть ее
+    данные, а по завершении поток закрывает свои соединения с базой.
+    """
+
+    def __init__(self, name, workers):
+        self.executor = ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix=name
+        )
+
+    @staticmethod
+    def run(function, *args):
+        try:
+            function(*args)
+        finally:
+            connections.close_all()
+
+    def schedule(self, function, *args):
+        transaction.on_commit(
+            lambda: self.executor.submit(self.run, function, *args)
+        )
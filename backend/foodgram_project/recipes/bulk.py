@@ -0,0 +1,121 @@
+from django.db import connections, router, transaction
+
+from . import feed
+from .counters import defer_many
+from .models import (
+    Favorite, Recipe, ShopCart, ShopCartTotal, Subscription, User
+)
+
+CREATED = 'created'
+EXISTS = 'exists'
+DELETED = 'deleted'
+ABSENT = 'absent'
+NOT_FOUND = 'not_found'
+FORBIDDEN = 'forbidden'
+
+
+def write_sql(connection, relation, user_field, target_field, targets,
+              add, count):
+    """INSERT или DELETE связей с RETURNING id объектов, которые
+    реально изменил этот запрос (PostgreSQL и SQLite 3.35+)."""
+    quote = connection.ops.quote_name
+    table = quote(relation._meta.db_table)
+    user_column = quote(relation._meta.get_field(user_field).column)
+    target_column = quote(relation._meta.get_field(target_field).column)
+    placeholders = ', '.join(['%s'] * count)
+    if not add:
+        return (
+            f'DELETE FROM {table} WHERE {user_column} = %s '
+            f'AND {target_column} IN ({placeholders}) '
+            f'RETURNING {target_column}'
+        )
+    target_pk = quote(targets.model._meta.pk.column)
+    return (
+        f'INSERT INTO {table} ({user_column}, {target_column}) '
+        f'SELECT %s, {target_pk} '
+        f'FROM {quote(targets.model._meta.db_table)} '
+        f'WHERE {target_pk} IN ({placeholders}) '
+        f'ON CONFLICT DO NOTHING RETURNING {target_column}'
+    )
+
+
+def apply(relation, user_field, target_field, targets, user, ids, add,
+          forbidden=()):
+    """Добавляет или удаляет связи user с объектами ids.
+
+    Изменение - один INSERT ... ON CONFLICT DO NOTHING или один DELETE
+    с RETURNING, так что changed - только связи, которые записал этот
+    вызов, даже если те же связи одновременно меняет другой запрос.
+    Запись идет первым запросом транзакции: SQLite сразу берет
+    блокировку записи и ждет ее, а не отвечает database is locked при
+    повышении блокировки чтения. Объекты проверяются затем одним
+    запросом. Сигналы не отправляются, зависимые данные обновляет
+    вызывающий код по changed. Возвращает ({id: статус}, changed).
+    """
+    using = router.db_for_write(relation)
+    allowed = [pk for pk in ids if pk not in forbidden]
+    written = set()
+    if allowed:
+        connection = connections[using]
+        with connection.cursor() as cursor:
+            cursor.execute(
+                write_sql(
+                    connection, relation, user_field, target_field,
+                    targets, add, len(allowed)
+                ),
+                [user.pk, *allowed]
+            )
+            written = {row[0] for row in cursor.fetchall()}
+    found = set(targets.using(using).filter(pk__in=ids).values_list(
+        'pk', flat=True
+    ))
+    statuses, changed = {}, []
+    for pk in ids:
+        if pk not in found:
+            statuses[pk] = NOT_FOUND
+        elif pk in forbidden:
+            statuses[pk] = FORBIDDEN
+        elif pk in written:
+            statuses[pk] = CREATED if add else DELETED
+            changed.append(pk)
+        else:
+            statuses[pk] = EXISTS if add else ABSENT
+    return statuses, changed
+
+
+@transaction.atomic
+def favorites(user, ids, add):
+    statuses, changed = apply(
+        Favorite, 'author', 'recipe', Recipe.objects, user, ids, add
+    )
+    if changed:
+        defer_many(changed, favorites_count=1 if add else -1)
+    return statuses
+
+
+@transaction.atomic
+def shopping_cart(user, ids, add):
+    statuses, changed = apply(
+        ShopCart, 'user', 'recipe', Recipe.objects, user, ids, add
+    )
+    if changed:
+        ShopCartTotal.objects.apply(
+            [user.pk],
+            ShopCartTotal.objects.recipes_deltas(changed, 1 if add else -1)
+        )
+        defer_many(changed, in_carts_count=1 if add else -1)
+    return statuses
+
+
+@transaction.atomic
+def subscriptions(user, ids, add):
+    statuses, changed = apply(
+        Subscription, 'user', 'author', User.objects, user, ids, add,
+        forbidden={user.pk}
+    )
+    if changed and add:
+        for author_id in changed:
+            feed.schedule(feed.backfill, user.pk, author_id)
+    elif changed:
+        feed.unfollow(user.pk, changed)
+    return statuses
@@ -0,0 +1,28 @@
+import time
+
+from django.core.cache import cache, caches
+from django.utils.connection import ConnectionProxy
+
+# Кэш в памяти процесса для того, что не нужно делить с другими
+# процессами, см. CACHES['local'].
+local_cache = ConnectionProxy(caches, 'local')
+
+
+def version_key(model):
+    return f'version:{model._meta.label_lower}'
+
+
+def get_version(models):
+    """Время последнего изменения моделей, оно же версия кэша."""
+    keys = [version_key(model) for model in models]
+    versions = cache.get_many(keys)
+    now = time.time()
+    for key in keys:
+        if key not in versions:
+            cache.add(key, now, None)
+            versions[key] = cache.get(key, now)
+    return max(versions.values())
+
+
+def bump_version(model):
+    cache.set(version_key(model), time.time(), None)
@@ -10,3 +10,43 @@ M_U_LENGTH = 50
 OBJECT_ON_PAGE = 6
 MIN_VALUE_VALID = 1
 MAX_VALUE_VALID = 32000
+COUNT_CACHE_TIMEOUT = 60
+RESPONSE_CACHE_TIMEOUT = 60 * 60
+RECIPE_CACHE_TIMEOUT = 60 * 60
+MAX_IMAGE_SIZE = 5 * 1024 * 1024
+MAX_IMAGE_PIXELS = 5000 * 5000
+IMAGE_FORMATS = ('jpeg', 'png', 'webp')
+THUMBNAIL_SIZE = (600, 400)
+WEBP_QUALITY = 80
+IMAGE_WORKERS = 2
+IMAGE_VARIANTS_TIMEOUT = 24 * 60 * 60
+IMAGE_VARIANTS_MISSING_TIMEOUT = 60
+EXPORT_WORKERS = 2
+# Не больше стольких невыполненных выгрузок у пользователя.
+EXPORT_ACTIVE_LIMIT = 3
+# Через столько дней завершенные выгрузки удаляются вместе с файлами.
+EXPORT_KEEP_DAYS = 7
+EXPORT_STATUS_LENGTH = 16
+EXPORT_FILE_LENGTH = 256
+METRICS_TIME_BUCKETS = (
+    0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10
+)
+METRICS_QUERY_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200)
+TOKEN_CACHE_SIZE = 10000
+TOKEN_CACHE_TIMEOUT = 60
+REPLICA_STICKY_TIMEOUT = 10
+ASYNC_VIEW_WORKERS = 16
+BULK_IDS_LIMIT = 100
+FEED_WORKERS = 2
+# Не чаще раза в столько секунд процесс сворачивает изменения счетчиков
+# рецептов после своей записи.
+COUNTER_FOLD_INTERVAL = 5
+FEED_BATCH_SIZE = 1000
+FEED_BACKFILL = 50
+FEED_PULL_SUBSCRIBERS = 10000
+FEED_PULL_RECIPES = 1000
+INGREDIENT_INDEX_TIMEOUT = 10 * 60
+SIMILAR_LIMIT = 6
+SIMILAR_LIMIT_MAX = 50
+SIMILAR_TAG_WEIGHT = 0.2
+SIMILAR_INDEX_TIMEOUT = 60 * 60
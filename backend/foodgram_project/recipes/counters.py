@@ -0,0 +1,181 @@
+import threading
+import time
+from collections import defaultdict
+
+from django.db import transaction
+from django.db.models import Count, F, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce, Greatest
+
+from . import consts
+from .background import BackgroundPool
+
+BATCH_SIZE = 1000
+
+pool = BackgroundPool('counters', 1)
+fold_lock = threading.Lock()
+last_fold = 0
+
+
+def increment(model, pk, **deltas):
+    """Атомарно прибавляет deltas к счетчикам строки pk.
+
+    Вызывается последним запросом транзакции, чтобы блокировка
+    строки держалась только до COMMIT.
+    """
+    model.objects.filter(pk=pk).update(**shifted(deltas))
+
+
+def increment_many(model, pks, **deltas):
+    """increment для строк pks одним запросом."""
+    model.objects.filter(pk__in=pks).update(**shifted(deltas))
+
+
+def shifted(deltas):
+    return {
+        field: Greatest(F(field) + delta, 0)
+        for field, delta in deltas.items()
+    }
+
+
+def defer(recipe_id, **deltas):
+    """Записывает изменение счетчиков рецепта строкой RecipeCounterDelta.
+
+    INSERT не блокирует строку рецепта, поэтому одновременные
+    переключатели популярного рецепта не ждут друг друга.
+    """
+    defer_many([recipe_id], **deltas)
+
+
+def defer_many(recipe_ids, **deltas):
+    """defer для рецептов recipe_ids одним запросом."""
+    from .models import RecipeCounterDelta
+    RecipeCounterDelta.objects.bulk_create(
+        RecipeCounterDelta(recipe_id=recipe_id, **deltas)
+        for recipe_id in recipe_ids
+    )
+    schedule_fold()
+
+
+def schedule_fold():
+    """Сворачивает изменения в фоне после фиксации транзакции, но не
+    чаще раза в consts.COUNTER_FOLD_INTERVAL секунд на процесс.
+
+    Так счетчики отстают от записей на несколько секунд и без
+    fold_counters --loop; команда нужна, если записей нет, а изменения
+    остались, например после сбоя процесса.
+    """
+    global last_fold
+    with fold_lock:
+        now = time.monotonic()
+        if now - last_fold < consts.COUNTER_FOLD_INTERVAL:
+            return
+        last_fold = now
+    pool.schedule(fold)
+
+
+def fold(batch_size=BATCH_SIZE):
+    """Переносит накопленные RecipeCounterDelta в счетчики рецептов.
+
+    Строки берутся пачками по возрастанию id и удаляются в той же
+    транзакции; рецепты с одинаковыми суммами изменений обновляются
+    одним UPDATE. Изменения удаленных рецептов удаляются, ничего не
+    обновив. Параллельный вызов пропускает заблокированные строки там,
+    где база это умеет. Возвращает число свернутых строк.
+    """
+    from .models import Recipe, RecipeCounterDelta
+    fields = Recipe.counter_fields
+    folded = 0
+    while True:
+        with transaction.atomic():
+            rows = list(RecipeCounterDelta.objects.select_for_update(
+                skip_locked=True
+            ).order_by('pk').values_list('pk', 'recipe', *fields)[
+                :batch_size
+            ])
+            if not rows:
+                return folded
+            totals = defaultdict(lambda: [0] * len(fields))
+            for _, recipe_id, *values in rows:
+                total = totals[recipe_id]
+                for index, value in enumerate(values):
+                    total[index] += value
+            RecipeCounterDelta.objects.filter(
+                pk__in=[row[0] for row in rows]
+            ).delete()
+            groups = defaultdict(list)
+            for recipe_id, total in totals.items():
+                if any(total):
+                    groups[tuple(total)].append(recipe_id)
+            for total, recipe_ids in groups.items():
+                increment_many(Recipe, recipe_ids, **{
+                    field: value
+                    for field, value in zip(fields, total) if value
+                })
+        folded += len(rows)
+
+
+def counters(models=None):
+    """Счетчик, модель строк, которые он считает, ее внешний ключ и
+    модель несвернутых изменений счетчика или None.
+
+    models - четверка (User, Recipe, Favorite, ShopCart), если нужны
+    исторические модели миграции; изменений у них нет.
+    """
+    if models is None:
+        from .models import (
+            Favorite, Recipe, RecipeCounterDelta, ShopCart, User
+        )
+    else:
+        User, Recipe, Favorite, ShopCart = models
+        RecipeCounterDelta = None
+    return (
+        (User, 'recipes_count', Recipe, 'author', None),
+        (Recipe, 'favorites_count', Favorite, 'recipe', RecipeCounterDelta),
+        (Recipe, 'in_carts_count', ShopCart, 'recipe', RecipeCounterDelta),
+    )
+
+
+def total(related, key, field=None):
+    """Число строк related или сумма их field по внешнему ключу key."""
+    return Coalesce(
+        Subquery(
+            related.objects.filter(
+                **{key: OuterRef('pk')}
+            ).order_by().values(key).annotate(
+                total=Sum(field) if field else Count('pk')
+            ).values('total')
+        ),
+        Value(0)
+    )
+
+
+def expected(field, related, key, deltas):
+    """Значение счетчика, при котором он вместе с несвернутыми
+    изменениями равен фактическому числу строк."""
+    actual = total(related, key)
+    if deltas is None:
+        return actual
+    return actual - total(deltas, 'recipe', field)
+
+
+def reconcile(models=None, dry_run=False):
+    """Исправляет разошедшиеся счетчики.
+
+    Перед сверкой сворачивает накопленные изменения, кроме dry_run.
+    Возвращает {имя счетчика: число исправленных строк}.
+    """
+    if models is None and not dry_run:
+        fold()
+    fixed = {}
+    for model, field, related, key, deltas in counters(models):
+        drifted = list(model.objects.annotate(
+            expected=expected(field, related, key, deltas)
+        ).exclude(**{field: F('expected')}).values_list('pk', flat=True))
+        fixed[f'{model._meta.model_name}.{field}'] = len(drifted)
+        if dry_run:
+            continue
+        for start in range(0, len(drifted), BATCH_SIZE):
+            model.objects.filter(
+                pk__in=drifted[start:start + BATCH_SIZE]
+            ).update(**{field: expected(field, related, key, deltas)})
+    return fixed
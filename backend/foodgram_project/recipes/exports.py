@@ -0,0 +1,149 @@
+import json
+import logging
+import os
+from datetime import timedelta
+from pathlib import Path
+
+from django.conf import settings
+from django.db.models import F
+from django.utils import timezone
+
+from . import consts
+from .background import BackgroundPool
+from .models import Amount, ExportJob, Recipe, ShopCartTotal
+
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE = 500
+
+pool = BackgroundPool('exports', consts.EXPORT_WORKERS)
+
+
+def export_path(job):
+    return Path(settings.EXPORT_ROOT) / job.file
+
+
+def write_list(file, items):
+    file.write('[')
+    for number, item in enumerate(items):
+        if number:
+            file.write(',')
+        file.write(json.dumps(item, ensure_ascii=False, default=str))
+    file.write(']')
+
+
+def recipe_batches(queryset):
+    """Рецепты порциями по первичному ключу, без OFFSET."""
+    last_id = 0
+    while True:
+        batch = list(queryset.filter(id__gt=last_id).order_by('id').values(
+            'id', 'name', 'text', 'cooking_time', 'image'
+        )[:BATCH_SIZE])
+        if not batch:
+            return
+        ingredients = {}
+        for amount in Amount.objects.filter(
+            recipe__in=[recipe['id'] for recipe in batch]
+        ).values(
+            'recipe', 'amount',
+            name=F('ingredient__name'),
+            measurement_unit=F('ingredient__measurement_unit')
+        ).order_by('id'):
+            ingredients.setdefault(amount.pop('recipe'), []).append(amount)
+        tags = {}
+        for recipe_id, slug in Recipe.tags.through.objects.filter(
+            recipe__in=[recipe['id'] for recipe in batch]
+        ).values_list('recipe', 'tag__slug'):
+            tags.setdefault(recipe_id, []).append(slug)
+        for recipe in batch:
+            recipe['tags'] = tags.get(recipe['id'], [])
+            recipe['ingredients'] = ingredients.get(recipe['id'], [])
+            yield recipe
+        last_id = batch[-1]['id']
+
+
+def write_export(user, file):
+    """Пишет в file все данные пользователя одним JSON-документом."""
+    file.write('{"user": ')
+    file.write(json.dumps({
+        'id': user.id,
+        'email': user.email,
+        'username': user.username,
+        'first_name': user.first_name,
+        'last_name': user.last_name,
+    }, ensure_ascii=False))
+    file.write(', "recipes": ')
+    write_list(file, recipe_batches(Recipe.objects.filter(author=user)))
+    file.write(', "favorites": ')
+    write_list(file, user.favorite.values(
+        'recipe', name=F('recipe__name')
+    ).order_by('id').iterator())
+    file.write(', "shopping_cart": ')
+    write_list(file, user.shop_cart.values(
+        'recipe', name=F('recipe__name')
+    ).order_by('id').iterator())
+    file.write(', "shopping_list": ')
+    write_list(file, ShopCartTotal.objects.filter(user=user).values(
+        name=F('ingredient__name'),
+        measurement_unit=F('ingredient__measurement_unit'),
+        amount=F('total')
+    ).order_by('name').iterator())
+    file.write('}')
+
+
+def remove_expired(**filters):
+    """Удаляет выгрузки, завершенные больше consts.EXPORT_KEEP_DAYS
+    дней назад; файлы удаляет сигнал post_delete. Возвращает число
+    удаленных задач."""
+    deleted, _ = ExportJob.objects.filter(
+        status__in=(ExportJob.DONE, ExportJob.FAILED),
+        finished__lt=timezone.now() - timedelta(
+            days=consts.EXPORT_KEEP_DAYS
+        ),
+        **filters
+    ).delete()
+    return deleted
+
+
+def run_export(job_id):
+    """Выполняет задачу, если ее еще не забрал другой обработчик.
+
+    Заодно удаляет устаревшие выгрузки того же пользователя.
+    """
+    claimed = ExportJob.objects.filter(
+        pk=job_id, status=ExportJob.PENDING
+    ).update(status=ExportJob.RUNNING)
+    if not claimed:
+        return
+    job = ExportJob.objects.select_related('user').get(pk=job_id)
+    remove_expired(user=job.user_id)
+    job.file = f'{job.user_id}/export_{job.pk}.json'
+    path = export_path(job)
+    partial = path.with_suffix('.part')
+    try:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with open(partial, 'w', encoding='utf-8') as file:
+            write_export(job.user, file)
+        os.replace(partial, path)
+    except Exception as error:
+        logger.exception('Выгрузка %s не удалась', job_id)
+        ExportJob.objects.filter(pk=job_id).update(
+            status=ExportJob.FAILED,
+            error=str(error),
+            finished=timezone.now()
+        )
+    else:
+        ExportJob.objects.filter(pk=job_id).update(
+            status=ExportJob.DONE,
+            file=job.file,
+            finished=timezone.now()
+        )
+
+
+def schedule_export(job):
+    """Отдает задачу пулу потоков после фиксации транзакции.
+
+    Задачи, не доставшиеся пулу (например, после перезапуска), выполняет
+    команда run_export_jobs.
+    """
+    pool.schedule(run_export, job.pk)
@@ -0,0 +1,131 @@
+from django.db import IntegrityError, transaction
+from django.db.models import Count, Q
+
+from . import consts
+from .background import BackgroundPool
+from .models import FeedEntry, Recipe, Subscription, User
+
+pool = BackgroundPool('feed', consts.FEED_WORKERS)
+
+
+def mark_pull(author_id):
+    """Переводит слишком плодовитого или популярного автора на
+    подмешивание при чтении; True, если автор читается так.
+
+    Флаг только ставится: лента автора, уже подмешиваемого при
+    чтении, не раскладывается заново. Снимает флаги rebuild.
+    """
+    popular = Subscription.objects.filter(
+        author=author_id
+    ).order_by()[consts.FEED_PULL_SUBSCRIBERS - 1:]
+    return bool(User.objects.filter(pk=author_id).filter(
+        Q(feed_pull=True)
+        | Q(recipes_count__gte=consts.FEED_PULL_RECIPES)
+        | Q(pk__in=popular.values('author'))
+    ).update(feed_pull=True))
+
+
+def recent(author_id):
+    return list(Recipe.objects.filter(author=author_id).order_by(
+        '-id'
+    ).values_list('id', flat=True)[:consts.FEED_BACKFILL])
+
+
+def push(author_id, recipe_ids, user_ids=None):
+    """Кладет recipe_ids в ленты подписчиков автора пачками.
+
+    Подписчики перебираются по индексу (author, user) с курсором
+    по user, повторная запись пропускается уникальным ограничением.
+    """
+    if not recipe_ids:
+        return
+    subscribers = Subscription.objects.filter(author=author_id)
+    if user_ids is not None:
+        subscribers = subscribers.filter(user__in=user_ids)
+    subscribers = subscribers.order_by('user').values_list('user', flat=True)
+    last = 0
+    while True:
+        batch = list(
+            subscribers.filter(user__gt=last)[:consts.FEED_BATCH_SIZE]
+        )
+        if not batch:
+            return
+        try:
+            FeedEntry.objects.bulk_create(
+                (
+                    FeedEntry(user_id=user_id, recipe_id=recipe_id)
+                    for user_id in batch for recipe_id in recipe_ids
+                ),
+                ignore_conflicts=True
+            )
+        except IntegrityError:
+            # Рецепт удалили, пока шла раскладка.
+            return
+        last = batch[-1]
+
+
+def fan_out(recipe_id):
+    recipe = Recipe.objects.filter(pk=recipe_id).values('author').first()
+    if recipe is None or mark_pull(recipe['author']):
+        return
+    push(recipe['author'], [recipe_id])
+
+
+def backfill(user_id, author_id):
+    """Последние рецепты автора в ленту нового подписчика."""
+    if mark_pull(author_id):
+        return
+    push(author_id, recent(author_id), user_ids=[user_id])
+
+
+def unfollow(user_id, author_ids):
+    FeedEntry.objects.filter(
+        user=user_id, recipe__author__in=author_ids
+    ).delete()
+
+
+def schedule(function, *args):
+    """Отдает раскладку пулу потоков после фиксации транзакции."""
+    pool.schedule(function, *args)
+
+
+def page(user, before=None, limit=consts.OBJECT_ON_PAGE):
+    """Id рецептов ленты по убыванию, меньше before, не больше limit.
+
+    Разложенные рецепты читаются одним обратным проходом индекса
+    (user, recipe), рецепты всех авторов с feed_pull - одним запросом
+    с подзапросом подписок, и списки сливаются.
+    """
+    entries = FeedEntry.objects.filter(user=user)
+    pulled = Recipe.objects.filter(author__in=Subscription.objects.filter(
+        user=user, author__feed_pull=True
+    ).values('author'))
+    if before is not None:
+        entries = entries.filter(recipe_id__lt=before)
+        pulled = pulled.filter(pk__lt=before)
+    ids = set(entries.order_by('-recipe_id').values_list(
+        'recipe_id', flat=True
+    )[:limit])
+    ids.update(pulled.order_by('-id').values_list('id', flat=True)[:limit])
+    return sorted(ids, reverse=True)[:limit]
+
+
+def rebuild():
+    """Пересчитывает флаги feed_pull и заново раскладывает ленты."""
+    popular = Subscription.objects.values('author').annotate(
+        subscribers=Count('pk')
+    ).filter(
+        subscribers__gte=consts.FEED_PULL_SUBSCRIBERS
+    ).values('author')
+    with transaction.atomic():
+        FeedEntry.objects.all().delete()
+        User.objects.filter(feed_pull=True).update(feed_pull=False)
+        User.objects.filter(
+            Q(recipes_count__gte=consts.FEED_PULL_RECIPES)
+            | Q(pk__in=popular)
+        ).update(feed_pull=True)
+    authors = Subscription.objects.filter(
+        author__feed_pull=False
+    ).order_by('author').values_list('author', flat=True).distinct()
+    for author_id in authors.iterator():
+        push(author_id, recent(author_id))
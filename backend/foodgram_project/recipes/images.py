@@ -0,0 +1,114 @@
+import logging
+from io import BytesIO
+from pathlib import PurePosixPath
+
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.dispatch import Signal
+from PIL import Image, ImageOps, UnidentifiedImageError
+
+from . import consts
+from .background import BackgroundPool
+from .caching import local_cache
+
+logger = logging.getLogger(__name__)
+
+# Варианты картинки: None - исходный размер, иначе размер кадра.
+VARIANTS = {
+    'webp': None,
+    'thumbnail': consts.THUMBNAIL_SIZE,
+}
+
+# Варианты картинки рецепта сохранены, аргумент recipe_id.
+image_variants_ready = Signal()
+
+pool = BackgroundPool('images', consts.IMAGE_WORKERS)
+
+
+def clean_image(data):
+    """Проверяет картинку и пересохраняет ее без метаданных.
+
+    Возвращает пару (байты, расширение), при недопустимой картинке
+    вызывает ValueError.
+    """
+    if len(data) > consts.MAX_IMAGE_SIZE:
+        raise ValueError('Слишком большой файл картинки.')
+    try:
+        image = Image.open(BytesIO(data))
+    except UnidentifiedImageError:
+        raise ValueError('Файл не является картинкой.')
+    image_format = (image.format or '').lower()
+    if image_format not in consts.IMAGE_FORMATS:
+        raise ValueError(
+            f'Допустимые форматы: {", ".join(consts.IMAGE_FORMATS)}.'
+        )
+    if image.width * image.height > consts.MAX_IMAGE_PIXELS:
+        raise ValueError('Слишком большое разрешение картинки.')
+    image = ImageOps.exif_transpose(image)
+    buffer = BytesIO()
+    image.save(buffer, format=image_format)
+    extension = 'jpg' if image_format == 'jpeg' else image_format
+    return buffer.getvalue(), extension
+
+
+def variant_name(name, variant):
+    path = PurePosixPath(name)
+    return str(path.parent / 'variants' / f'{path.stem}_{variant}.webp')
+
+
+def ready_key(name):
+    return f'image-variants:{name}'
+
+
+def variants_ready(name):
+    """Готовы ли варианты картинки name.
+
+    Ответ хранилища кэшируется, чтобы сериализация не обращалась к
+    нему на каждый рецепт; отсутствие вариантов - ненадолго, пока их
+    готовит фоновый поток.
+    """
+    key = ready_key(name)
+    ready = local_cache.get(key)
+    if ready is None:
+        ready = default_storage.exists(variant_name(name, 'thumbnail'))
+        local_cache.set(key, ready, (
+            consts.IMAGE_VARIANTS_TIMEOUT if ready
+            else consts.IMAGE_VARIANTS_MISSING_TIMEOUT
+        ))
+    return ready
+
+
+def variant_url(image, variant):
+    """Адрес варианта картинки, пока его нет - адрес исходной."""
+    if variants_ready(image.name):
+        return default_storage.url(variant_name(image.name, variant))
+    return image.url
+
+
+def make_variants(recipe_id, name):
+    try:
+        with default_storage.open(name) as file:
+            image = Image.open(file)
+            image.load()
+        if image.mode not in ('RGB', 'RGBA'):
+            image = image.convert('RGBA')
+        for variant, size in VARIANTS.items():
+            result = image if size is None else ImageOps.fit(image, size)
+            buffer = BytesIO()
+            result.save(buffer, format='WEBP', quality=consts.WEBP_QUALITY)
+            target = variant_name(name, variant)
+            default_storage.delete(target)
+            default_storage.save(target, ContentFile(buffer.getvalue()))
+    except (OSError, ValueError):
+        logger.exception('Не удалось подготовить варианты картинки %s', name)
+        return
+    local_cache.set(ready_key(name), True, consts.IMAGE_VARIANTS_TIMEOUT)
+    image_variants_ready.send(sender=None, recipe_id=recipe_id)
+
+
+def schedule_variants(recipe):
+    """Готовит варианты картинки в фоне после фиксации транзакции."""
+    name = recipe.image.name
+    if not name or variants_ready(name):
+        return
+    pool.schedule(make_variants, recipe.pk, name)
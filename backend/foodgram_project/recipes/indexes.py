@@ -0,0 +1,261 @@
+import bisect
+import heapq
+import threading
+import time
+from array import array
+from collections import defaultdict
+
+from django.db import DEFAULT_DB_ALIAS
+
+from . import consts
+from .caching import get_version
+from .models import Amount, Ingredient, Recipe
+
+
+class IngredientIndex:
+    """Индекс названий ингредиентов в памяти процесса.
+
+    Ингредиенты хранятся в массиве, отсортированном по названию в нижнем
+    регистре: совпадения по префиксу находятся двоичным поиском. Поиск
+    по подстроке двоичным поиском не сделать, поэтому совпадения по
+    подстроке добавляются после префиксных запросом к базе.
+
+    Индекс строится с основной базы и перестраивается, когда меняется
+    версия Ingredient в общем кэше или проходит
+    INGREDIENT_INDEX_TIMEOUT, так что изменения из других процессов
+    доходят и без их сигналов.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._data = None
+
+    def invalidate(self):
+        self._data = None
+
+    def is_fresh(self, data, version):
+        return (
+            data is not None and data[0] == version
+            and time.monotonic() < data[1]
+        )
+
+    def load(self):
+        version = get_version((Ingredient,))
+        data = self._data
+        if not self.is_fresh(data, version):
+            with self._lock:
+                if not self.is_fresh(self._data, version):
+                    ingredients = sorted(
+                        Ingredient.objects.using(DEFAULT_DB_ALIAS),
+                        key=lambda ingredient: (
+                            ingredient.name.lower(), ingredient.id
+                        )
+                    )
+                    names = [
+                        ingredient.name.lower() for ingredient in ingredients
+                    ]
+                    self._data = (
+                        version,
+                        time.monotonic() + consts.INGREDIENT_INDEX_TIMEOUT,
+                        names,
+                        ingredients
+                    )
+                data = self._data
+        return data[2:]
+
+    def search(self, query):
+        names, ingredients = self.load()
+        query = query.lower()
+        start = bisect.bisect_left(names, query)
+        end = bisect.bisect_left(names, query + chr(0x10FFFF), start)
+        contains = Ingredient.objects.filter(
+            name__icontains=query
+        ).exclude(name__istartswith=query).order_by('name', 'id')
+        return ingredients[start:end] + list(contains)
+
+
+ingredient_index = IngredientIndex()
+
+
+class SimilarIndex:
+    """Обратный индекс ингредиент -> рецепты для похожих рецептов.
+
+    Для ингредиента хранятся два массива array('l'): id рецептов по
+    возрастанию и количества ингредиента в них, для рецепта - его
+    ингредиенты, количества, их сумма и теги. Кандидаты - рецепты
+    с общими ингредиентами, они набираются проходом по спискам
+    ингредиентов рецепта без сравнения пар в SQL.
+
+    Изменения рецепта применяются к индексу этого процесса на месте;
+    другие процессы перечитывают индекс раз в SIMILAR_INDEX_TIMEOUT.
+    Новый индекс строится с основной базы вне блокировки индекса и
+    подменяет старый целиком; пока он строится, запросы считают по
+    старому, а изменения рецептов за это время применяются к новому
+    после подмены.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._build_lock = threading.Lock()
+        self._data = None
+        self._loaded = 0
+        self._generation = 0
+        self._dirty = None
+
+    def invalidate(self):
+        with self._lock:
+            self._data = None
+            self._generation += 1
+
+    def is_fresh(self):
+        return (
+            self._data is not None
+            and time.monotonic() - self._loaded
+            <= consts.SIMILAR_INDEX_TIMEOUT
+        )
+
+    def load(self):
+        data = self._data
+        if self.is_fresh():
+            return data
+        # Устаревший индекс отдается, пока другой поток строит новый.
+        if not self._build_lock.acquire(blocking=data is None):
+            return data
+        try:
+            if self.is_fresh():
+                return self._data
+            with self._lock:
+                self._dirty = set()
+                generation = self._generation
+            loaded = time.monotonic()
+            data = self.build()
+            with self._lock:
+                dirty, self._dirty = self._dirty, None
+                self._data = data
+                # Сброшенный во время сборки индекс соберется заново.
+                self._loaded = (
+                    loaded if generation == self._generation else 0
+                )
+                for recipe_id in dirty:
+                    self._update(data, recipe_id)
+            return data
+        finally:
+            self._build_lock.release()
+
+    def build(self):
+        data = ({}, {}, {})
+        rows = Amount.objects.using(DEFAULT_DB_ALIAS).order_by(
+            'recipe', 'ingredient'
+        ).values_list('recipe', 'ingredient', 'amount')
+        recipe_id, vector = None, []
+        for row in rows.iterator():
+            if row[0] != recipe_id:
+                self._add(data, recipe_id, vector)
+                recipe_id, vector = row[0], []
+            vector.append(row[1:])
+        self._add(data, recipe_id, vector)
+        tags = data[2]
+        rows = Recipe.tags.through.objects.using(
+            DEFAULT_DB_ALIAS
+        ).values_list('recipe_id', 'tag_id')
+        for recipe_id, tag_id in rows.iterator():
+            tags.setdefault(recipe_id, array('l')).append(tag_id)
+        return data
+
+    @staticmethod
+    def _add(data, recipe_id, vector, tag_ids=None):
+        if not vector:
+            return
+        postings, vectors, tags = data
+        for ingredient_id, amount in vector:
+            ids, amounts = postings.setdefault(
+                ingredient_id, (array('l'), array('l'))
+            )
+            index = bisect.bisect_left(ids, recipe_id)
+            ids.insert(index, recipe_id)
+            amounts.insert(index, amount)
+        ingredients, amounts = zip(*vector)
+        vectors[recipe_id] = (
+            array('l', ingredients), array('l', amounts), sum(amounts)
+        )
+        if tag_ids:
+            tags[recipe_id] = array('l', tag_ids)
+
+    @staticmethod
+    def _remove(data, recipe_id):
+        postings, vectors, tags = data
+        tags.pop(recipe_id, None)
+        ingredients, _, _ = vectors.pop(recipe_id, ((), (), 0))
+        for ingredient_id in ingredients:
+            ids, amounts = postings[ingredient_id]
+            index = bisect.bisect_left(ids, recipe_id)
+            if index < len(ids) and ids[index] == recipe_id:
+                del ids[index]
+                del amounts[index]
+
+    def _update(self, data, recipe_id):
+        vector = list(Amount.objects.using(DEFAULT_DB_ALIAS).filter(
+            recipe=recipe_id
+        ).values_list('ingredient', 'amount'))
+        tag_ids = list(Recipe.tags.through.objects.using(
+            DEFAULT_DB_ALIAS
+        ).filter(recipe_id=recipe_id).values_list('tag_id', flat=True))
+        self._remove(data, recipe_id)
+        self._add(data, recipe_id, vector, tag_ids)
+
+    def update(self, recipe_id):
+        """Перечитывает ингредиенты и теги одного рецепта."""
+        with self._lock:
+            if self._dirty is not None:
+                self._dirty.add(recipe_id)
+            if self._data is not None:
+                self._update(self._data, recipe_id)
+
+    def remove(self, recipe_id):
+        with self._lock:
+            if self._dirty is not None:
+                self._dirty.add(recipe_id)
+            if self._data is not None:
+                self._remove(self._data, recipe_id)
+
+    def similar(self, recipe_id, limit):
+        """Id limit самых похожих рецептов или None, если рецепта нет.
+
+        Похожесть - взвешенный коэффициент Жаккара по количествам
+        ингредиентов, sum(min) / sum(max), смешанный с коэффициентом
+        Жаккара по тегам с весом SIMILAR_TAG_WEIGHT.
+        """
+        data = self.load()
+        with self._lock:
+            postings, vectors, tags = data
+            if recipe_id not in vectors:
+                return None
+            ingredients, amounts, total = vectors[recipe_id]
+            shared = defaultdict(int)
+            for ingredient_id, amount in zip(ingredients, amounts):
+                for other, other_amount in zip(*postings[ingredient_id]):
+                    shared[other] += min(amount, other_amount)
+            del shared[recipe_id]
+            own_tags = set(tags.get(recipe_id, ()))
+
+            def score(other):
+                overlap = shared[other]
+                similarity = overlap / (total + vectors[other][2] - overlap)
+                other_tags = set(tags.get(other, ()))
+                if own_tags or other_tags:
+                    similarity = (
+                        (1 - consts.SIMILAR_TAG_WEIGHT) * similarity
+                        + consts.SIMILAR_TAG_WEIGHT
+                        * len(own_tags & other_tags)
+                        / len(own_tags | other_tags)
+                    )
+                return similarity, other
+
+            return [
+                other for _, other in heapq.nlargest(
+                    limit, map(score, shared)
+                )
+            ]
+
+
+similar_index = SimilarIndex()
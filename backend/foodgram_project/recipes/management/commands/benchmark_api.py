@@ -0,0 +1,467 @@
+import base64
+import gc
+import json
+import random
+import tempfile
+import time
+import tracemalloc
+from io import BytesIO
+from itertools import islice
+
+from django.core.cache import cache
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test.utils import (
+    CaptureQueriesContext, override_settings, setup_databases,
+    setup_test_environment, teardown_databases, teardown_test_environment
+)
+from django.urls import URLPattern, URLResolver, reverse
+from PIL import Image
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from api import urls
+from recipes.caching import local_cache
+from recipes.counters import reconcile
+from recipes.exports import run_export
+from recipes.feed import rebuild as rebuild_feeds
+from recipes.indexes import similar_index
+from recipes.models import (
+    Amount, ExportJob, Favorite, Ingredient, Recipe, ShopCart, ShopCartTotal,
+    Subscription, Tag, User
+)
+from recipes.search import update_index
+
+BATCH_SIZE = 5000
+INGREDIENTS = 2000
+UNITS = ('г', 'мл', 'шт', 'ст. л.', 'по вкусу')
+PASSWORD = 'benchmark-password'
+BULK_IDS = 20
+# Меньшие изменения p95 и памяти считаются шумом.
+NOISE = {'p95_ms': 2, 'peak_kb': 64}
+
+# Имя маршрута, метод, аргументы адреса, тело запроса. Значения в
+# фигурных скобках подставляются из контекста прогона.
+ROUTES = (
+    ('api-root', 'get', {}, None),
+    ('users-list', 'get', {}, None),
+    ('users-list', 'post', {}, {
+        'email': 'bench{scale}_{i}@example.com',
+        'username': 'bench{scale}_{i}',
+        'first_name': 'Bench', 'last_name': 'User', 'password': PASSWORD,
+    }),
+    ('users-detail', 'get', {'pk': '{author}'}, None),
+    ('users-me', 'get', {}, None),
+    ('users-set-password', 'post', {}, {
+        'current_password': PASSWORD, 'new_password': PASSWORD,
+    }),
+    ('users-subscriptions', 'get', {}, None),
+    ('users-subscribe', 'post', {'pk': '{author}'}, None),
+    ('users-subscribe', 'delete', {'pk': '{author}'}, None),
+    ('users-subscribe-bulk', 'post', {}, {'ids': '{authors}'}),
+    ('users-subscribe-bulk', 'delete', {}, {'ids': '{authors}'}),
+    ('users-exports', 'get', {}, None),
+    ('users-export', 'get', {'job_id': '{job}'}, None),
+    ('users-export-download', 'get', {'job_id': '{job}'}, None),
+    ('tags-list', 'get', {}, None),
+    ('tags-detail', 'get', {'pk': '{tag}'}, None),
+    ('ingredients-list', 'get', {}, None),
+    ('ingredients-list', 'get', {}, {'name': 'ingredient 1'}),
+    ('ingredients-detail', 'get', {'pk': '{ingredient}'}, None),
+    ('recipes-list', 'get', {}, None),
+    ('recipes-list', 'get', {}, {'is_favorited': '1'}),
+    ('recipes-list', 'get', {}, {'tags': 'breakfast', 'limit': '20'}),
+    ('recipes-list', 'get', {}, {'ordering': 'popularity'}),
+    ('recipes-list', 'get', {}, {'search': 'recipe'}),
+    ('recipes-list', 'get', {}, {'cursor': ''}),
+    ('recipes-detail', 'get', {'pk': '{recipe}'}, None),
+    ('recipes-feed', 'get', {}, None),
+    ('recipes-similar', 'get', {'pk': '{recipe}'}, None),
+    ('recipes-list', 'post', {}, '{recipe_payload}'),
+    ('recipes-detail', 'patch', {'pk': '{created}'}, '{recipe_payload}'),
+    ('recipes-detail', 'delete', {'pk': '{created}'}, None),
+    ('recipes-favorite', 'post', {'pk': '{recipe}'}, None),
+    ('recipes-favorite', 'delete', {'pk': '{recipe}'}, None),
+    ('recipes-shopping-cart', 'post', {'pk': '{recipe}'}, None),
+    ('recipes-shopping-cart', 'delete', {'pk': '{recipe}'}, None),
+    ('recipes-favorite-bulk', 'post', {}, {'ids': '{recipes}'}),
+    ('recipes-favorite-bulk', 'delete', {}, {'ids': '{recipes}'}),
+    ('recipes-shopping-cart-bulk', 'post', {}, {'ids': '{recipes}'}),
+    ('recipes-shopping-cart-bulk', 'delete', {}, {'ids': '{recipes}'}),
+    ('recipes-shopping-cart-totals', 'get', {}, None),
+    ('recipes-download-shopping-cart', 'get', {}, {'format': 'txt'}),
+    ('recipes-download-shopping-cart', 'get', {}, {'format': 'pdf'}),
+    ('login', 'post', {}, {'email': '{email}', 'password': PASSWORD}),
+    ('logout', 'post', {}, None),
+    ('metrics', 'get', {}, None),
+)
+
+
+def url_names(patterns):
+    names = set()
+    for pattern in patterns:
+        if isinstance(pattern, URLResolver):
+            names |= url_names(pattern.url_patterns)
+        elif isinstance(pattern, URLPattern) and pattern.name:
+            names.add(pattern.name)
+    return names
+
+
+def fill(value, context):
+    if isinstance(value, str):
+        if value.startswith('{') and value.endswith('}'):
+            return context[value[1:-1]]
+        return value.format(**context)
+    if isinstance(value, dict):
+        return {key: fill(item, context) for key, item in value.items()}
+    return value
+
+
+def percentile(values, share):
+    values = sorted(values)
+    return values[min(len(values) - 1, round(share * (len(values) - 1)))]
+
+
+def skewed(rng, size, power=3):
+    """Индекс от 0 до size с перекосом к началу, как у популярности."""
+    return int(size * rng.random() ** power)
+
+
+def image_data():
+    buffer = BytesIO()
+    Image.new('RGB', (64, 64), 'orange').save(buffer, format='PNG')
+    return (
+        'data:image/png;base64,'
+        + base64.b64encode(buffer.getvalue()).decode()
+    )
+
+
+class Seeder:
+    """Дополняет базу до заданного числа рецептов.
+
+    Авторы, ингредиенты, избранное и подписки выбираются с перекосом:
+    немногие популярные объекты получают большую часть связей.
+    """
+
+    def __init__(self, seed):
+        self.rng = random.Random(seed)
+
+    def bulk(self, model, objects, **kwargs):
+        """Вставляет объекты пачками, не держа их все в памяти."""
+        objects = iter(objects)
+        while True:
+            batch = list(islice(objects, BATCH_SIZE))
+            if not batch:
+                return
+            model.objects.bulk_create(batch, **kwargs)
+
+    def seed(self, recipes):
+        rng = self.rng
+        if not Tag.objects.exists():
+            Tag.objects.bulk_create(
+                Tag(name=slug, slug=slug, color=color)
+                for slug, (color, _) in zip(
+                    ('breakfast', 'lunch', 'dinner'), Tag.COLOR_TAG
+                )
+            )
+        if not Ingredient.objects.exists():
+            self.bulk(Ingredient, (
+                Ingredient(
+                    name=f'ingredient {i}', measurement_unit=rng.choice(UNITS)
+                )
+                for i in range(INGREDIENTS)
+            ))
+        existing = Recipe.objects.count()
+        if existing >= recipes:
+            return
+        users = User.objects.count()
+        wanted = max(recipes // 10, 10)
+        if users < wanted:
+            self.bulk(User, (
+                User(
+                    email=f'user{i}@example.com', username=f'user{i}',
+                    first_name='User', last_name=str(i), password='!'
+                )
+                for i in range(users, wanted)
+            ))
+        user_ids = list(User.objects.order_by('id').values_list(
+            'id', flat=True
+        ))
+        ingredient_ids = list(Ingredient.objects.order_by('id').values_list(
+            'id', flat=True
+        ))
+        tag_ids = list(Tag.objects.values_list('id', flat=True))
+        last_id = Recipe.objects.order_by('-id').values_list(
+            'id', flat=True
+        ).first() or 0
+        with transaction.atomic():
+            self.bulk(Recipe, (
+                Recipe(
+                    author_id=user_ids[skewed(rng, len(user_ids))],
+                    name=f'Recipe {i}',
+                    text=f'Benchmark recipe {i}',
+                    cooking_time=rng.randint(1, 180),
+                    image='static/images/benchmark.png'
+                )
+                for i in range(existing, recipes)
+            ))
+            recipe_ids = list(Recipe.objects.filter(
+                id__gt=last_id
+            ).order_by('id').values_list('id', flat=True))
+            self.bulk(Amount, (
+                Amount(recipe_id=recipe_id, ingredient_id=ingredient_id,
+                       amount=rng.randint(1, 500))
+                for recipe_id in recipe_ids
+                for ingredient_id in {
+                    ingredient_ids[skewed(rng, len(ingredient_ids), 2)]
+                    for _ in range(rng.randint(3, 12))
+                }
+            ))
+            self.bulk(Recipe.tags.through, (
+                Recipe.tags.through(recipe_id=recipe_id, tag_id=tag_id)
+                for recipe_id in recipe_ids
+                for tag_id in rng.sample(tag_ids, rng.randint(1, 3))
+            ))
+            all_recipes = list(Recipe.objects.order_by('-id').values_list(
+                'id', flat=True
+            ))
+            self.bulk(Favorite, (
+                Favorite(
+                    author_id=rng.choice(user_ids),
+                    recipe_id=all_recipes[skewed(rng, len(all_recipes))]
+                )
+                for _ in range(len(recipe_ids) * 3)
+            ), ignore_conflicts=True)
+            self.bulk(ShopCart, (
+                ShopCart(
+                    user_id=rng.choice(user_ids),
+                    recipe_id=all_recipes[skewed(rng, len(all_recipes))]
+                )
+                for _ in range(len(recipe_ids) // 2)
+            ), ignore_conflicts=True)
+            self.bulk(Subscription, (
+                Subscription(user_id=user_id, author_id=author_id)
+                for user_id, author_id in (
+                    (
+                        rng.choice(user_ids),
+                        user_ids[skewed(rng, len(user_ids))]
+                    )
+                    for _ in range(len(recipe_ids) // 5)
+                )
+                if user_id != author_id
+            ), ignore_conflicts=True)
+            ShopCartTotal.objects.rebuild()
+            reconcile()
+        for start in range(0, len(recipe_ids), BATCH_SIZE):
+            update_index(recipe_ids[start:start + BATCH_SIZE])
+        rebuild_feeds()
+
+
+class Command(BaseCommand):
+    help = (
+        'Засевает тестовую базу рецептами в нескольких масштабах и '
+        'замеряет каждый маршрут API: число запросов, p50/p95 и пик памяти.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--scales',
+            default='1000,10000',
+            help='Числа рецептов через запятую, например 1000,100000,1000000.'
+        )
+        parser.add_argument(
+            '--repeat', type=int, default=20,
+            help='Сколько раз вызывать каждый маршрут.'
+        )
+        parser.add_argument(
+            '--seed', type=int, default=0,
+            help='Зерно генератора данных.'
+        )
+        parser.add_argument(
+            '--output', default='benchmark.json',
+            help='Куда записать отчет.'
+        )
+        parser.add_argument(
+            '--baseline',
+            help='Отчет, с которым сравнить результаты.'
+        )
+        parser.add_argument(
+            '--tolerance', type=float, default=0.5,
+            help='Допустимый рост p95 и памяти относительно базового отчета.'
+        )
+
+    def handle(self, *args, **options):
+        scales = sorted(int(scale) for scale in options['scales'].split(','))
+        if options['repeat'] < 1:
+            raise CommandError('--repeat должен быть положительным.')
+        setup_test_environment()
+        databases = setup_databases(
+            verbosity=0, interactive=False, aliases={'default'}
+        )
+        try:
+            with override_settings(MEDIA_ROOT=tempfile.mkdtemp()):
+                report = self.run(scales, options)
+        finally:
+            teardown_databases(databases, verbosity=0)
+            teardown_test_environment()
+        with open(options['output'], 'w', encoding='utf-8') as file:
+            json.dump(report, file, ensure_ascii=False, indent=2)
+        self.stdout.write(f'Отчет записан в {options["output"]}.')
+        if options['baseline']:
+            self.compare(report, options['baseline'], options['tolerance'])
+
+    def run(self, scales, options):
+        seeder = Seeder(options['seed'])
+        report = {'repeat': options['repeat'], 'scales': {}}
+        covered = {name for name, *_ in ROUTES}
+        report['uncovered'] = sorted(url_names(urls.urlpatterns) - covered)
+        for scale in scales:
+            started = time.perf_counter()
+            seeder.seed(scale)
+            self.stdout.write(
+                f'{scale} рецептов засеяно за '
+                f'{time.perf_counter() - started:.1f} с.'
+            )
+            report['scales'][str(scale)] = self.measure(
+                scale, options['repeat']
+            )
+        return report
+
+    def context(self):
+        user = User.objects.order_by('id').first()
+        user.set_password(PASSWORD)
+        user.save()
+        job = ExportJob.objects.create(user=user)
+        run_export(job.pk)
+        return user, {
+            'email': user.email,
+            'author': User.objects.exclude(pk=user.pk).order_by(
+                'id'
+            ).values_list('id', flat=True).first(),
+            'job': job.pk,
+            'tag': Tag.objects.values_list('id', flat=True).first(),
+            'ingredient': Ingredient.objects.values_list(
+                'id', flat=True
+            ).first(),
+            'recipe': Recipe.objects.exclude(author=user).exclude(
+                favorite__author=user
+            ).exclude(
+                shop_cart__user=user
+            ).values_list('id', flat=True).first(),
+            'recipes': list(Recipe.objects.exclude(author=user).exclude(
+                favorite__author=user
+            ).exclude(
+                shop_cart__user=user
+            ).values_list('id', flat=True)[:BULK_IDS]),
+            'authors': list(User.objects.exclude(pk=user.pk).exclude(
+                subscribed__user=user
+            ).values_list('id', flat=True)[:BULK_IDS]),
+            'recipe_payload': {
+                'name': 'Benchmark recipe',
+                'text': 'Benchmark recipe',
+                'cooking_time': 10,
+                'image': image_data(),
+                'tags': list(Tag.objects.values_list('id', flat=True)[:2]),
+                'ingredients': [
+                    {'id': ingredient_id, 'amount': 10}
+                    for ingredient_id in Ingredient.objects.values_list(
+                        'id', flat=True
+                    )[:5]
+                ],
+            },
+        }
+
+    @staticmethod
+    def authenticate(client, user):
+        """Заголовок с токеном, как у настоящего клиента: запросы
+        проходят аутентификацию по токену и ее кэш."""
+        token, _ = Token.objects.get_or_create(user=user)
+        client.credentials(HTTP_AUTHORIZATION=f'Token {token.key}')
+
+    def measure(self, scale, repeat):
+        cache.clear()
+        local_cache.clear()
+        # Засев идет без сигналов, индекс прошлого масштаба устарел.
+        similar_index.invalidate()
+        user, context = self.context()
+        context['scale'] = scale
+        client = APIClient(raise_request_exception=False)
+        self.authenticate(client, user)
+        samples = {}
+        # Первый проход прогревает кэши, последний замеряет память.
+        for iteration in range(repeat + 2):
+            context['i'] = iteration
+            trace = iteration == repeat + 1
+            if trace:
+                tracemalloc.start()
+            for name, method, kwargs, data in ROUTES:
+                gc.collect()
+                key = f'{method.upper()} {name}'
+                if method == 'get' and data:
+                    key += '?' + '&'.join(f'{k}={v}' for k, v in data.items())
+                result = samples.setdefault(key, {'times': []})
+                path = reverse(name, kwargs=fill(kwargs, context))
+                data = fill(data, context)
+                if trace:
+                    tracemalloc.reset_peak()
+                    before = tracemalloc.get_traced_memory()[0]
+                with CaptureQueriesContext(connection) as queries:
+                    started = time.perf_counter()
+                    response = getattr(client, method)(
+                        path, data, format=None if method == 'get' else 'json'
+                    )
+                    if response.streaming:
+                        b''.join(response.streaming_content)
+                    elapsed = time.perf_counter() - started
+                if trace:
+                    result['peak_kb'] = round(
+                        (tracemalloc.get_traced_memory()[1] - before) / 1024, 1
+                    )
+                elif iteration:
+                    result['times'].append(elapsed)
+                result['queries'] = len(queries)
+                result['status'] = response.status_code
+                if name == 'recipes-list' and method == 'post':
+                    context['created'] = response.data.get('id')
+                elif name == 'logout':
+                    self.authenticate(client, user)
+        tracemalloc.stop()
+        return {
+            key: {
+                'status': result['status'],
+                'queries': result['queries'],
+                'p50_ms': round(percentile(result['times'], 0.5) * 1000, 2),
+                'p95_ms': round(percentile(result['times'], 0.95) * 1000, 2),
+                'peak_kb': result['peak_kb'],
+            }
+            for key, result in samples.items()
+        }
+
+    def compare(self, report, path, tolerance):
+        with open(path, encoding='utf-8') as file:
+            baseline = json.load(file)
+        regressions = []
+        for scale, routes in report['scales'].items():
+            for key, result in routes.items():
+                base = baseline['scales'].get(scale, {}).get(key)
+                if base is None:
+                    continue
+                if result['queries'] > base['queries']:
+                    regressions.append(
+                        f'{scale} {key}: запросов {base["queries"]} -> '
+                        f'{result["queries"]}'
+                    )
+                for metric, noise in NOISE.items():
+                    if (
+                        result[metric] > base[metric] * (1 + tolerance)
+                        and result[metric] - base[metric] > noise
+                    ):
+                        regressions.append(
+                            f'{scale} {key}: {metric} {base[metric]} -> '
+                            f'{result[metric]}'
+                        )
+        if regressions:
+            for line in regressions:
+                self.stdout.write(self.style.ERROR(line))
+            raise CommandError(f'Регрессий: {len(regressions)}.')
+        self.stdout.write(self.style.SUCCESS('Регрессий нет.'))
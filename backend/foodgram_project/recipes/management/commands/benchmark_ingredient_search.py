@@ -0,0 +1,47 @@
+import timeit
+
+from django.core.management.base import BaseCommand
+
+from recipes.indexes import IngredientIndex
+from recipes.models import Ingredient
+
+
+class Command(BaseCommand):
+    help = 'Сравнивает поиск ингредиентов по индексу в памяти и через ORM.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--repeat',
+            type=int,
+            default=100,
+            help='Сколько раз повторить каждый запрос.'
+        )
+        parser.add_argument(
+            'queries',
+            nargs='*',
+            help='Строки поиска, по умолчанию первые буквы названий.'
+        )
+
+    def handle(self, *args, **options):
+        queries = options['queries'] or sorted({
+            name[:length].lower()
+            for name in Ingredient.objects.values_list('name', flat=True)[:50]
+            for length in (1, 2, 3)
+        })
+        repeat = options['repeat']
+        index = IngredientIndex()
+        build = timeit.timeit(index.load, number=1)
+        self.stdout.write(f'Построение индекса: {build * 1000:.1f} мс')
+
+        def orm(query):
+            return list(Ingredient.objects.filter(name__istartswith=query))
+
+        for title, search in (('ORM', orm), ('Индекс', index.search)):
+            total = sum(
+                timeit.timeit(lambda: search(query), number=repeat)
+                for query in queries
+            )
+            self.stdout.write(
+                f'{title}: {total / repeat / len(queries) * 10 ** 6:.1f} мкс '
+                f'на запрос ({len(queries)} строк x {repeat})'
+            )
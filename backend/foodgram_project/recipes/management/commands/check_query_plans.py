@@ -0,0 +1,40 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from recipes.plans import explain_checks
+
+
+class Command(BaseCommand):
+    help = (
+        'Проверяет планы основных запросов API и падает, если какой-то '
+        'из них читает таблицу целиком.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--database',
+            default='default',
+            help='Псевдоним базы из DATABASES.'
+        )
+        parser.add_argument(
+            '--show',
+            action='store_true',
+            help='Печатать планы всех запросов.'
+        )
+
+    def handle(self, *args, **options):
+        failures = []
+        try:
+            for name, plan, scans in explain_checks(options['database']):
+                if options['show'] or scans:
+                    self.stdout.write(f'{name}:')
+                    for line in plan:
+                        self.stdout.write(f'    {line}')
+                if scans:
+                    failures.append(f'{name} ({", ".join(sorted(scans))})')
+        except NotImplementedError as error:
+            raise CommandError(error)
+        if failures:
+            raise CommandError(
+                'Полное чтение таблиц: ' + '; '.join(failures) + '.'
+            )
+        self.stdout.write(self.style.SUCCESS('Полных сканирований нет.'))
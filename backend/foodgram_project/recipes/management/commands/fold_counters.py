@@ -0,0 +1,36 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from recipes.counters import fold
+
+
+class Command(BaseCommand):
+    help = (
+        'Сворачивает накопленные изменения счетчиков избранного и '
+        'списков покупок в счетчики рецептов. Процессы приложения '
+        'делают это сами после записи, не чаще COUNTER_FOLD_INTERVAL '
+        'секунд; команда дочищает изменения, оставшиеся без записей.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--loop',
+            action='store_true',
+            help='Не завершаться, а сворачивать новые изменения.'
+        )
+        parser.add_argument(
+            '--interval',
+            type=float,
+            default=5,
+            help='Пауза между проходами в секундах.'
+        )
+
+    def handle(self, *args, **options):
+        while True:
+            folded = fold()
+            if folded or not options['loop']:
+                self.stdout.write(f'Свернуто изменений: {folded}.')
+            if not options['loop']:
+                return
+            time.sleep(options['interval'])
@@ -0,0 +1,129 @@
+import csv
+import json
+import time
+from itertools import islice
+from pathlib import Path
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from recipes.caching import bump_version
+from recipes.models import Ingredient
+
+JSON_CHUNK_SIZE = 64 * 1024
+
+
+def read_csv(file):
+    reader = csv.reader(file)
+    for row in reader:
+        if not row:
+            continue
+        if len(row) < 2:
+            raise CommandError(
+                f'Строка {reader.line_num}: ожидается название '
+                'и единица измерения.'
+            )
+        yield row[0], row[1]
+
+
+def read_json(file):
+    """Читает JSON-массив объектов по частям, не загружая файл целиком."""
+    decoder = json.JSONDecoder()
+    buffer = ''
+    started = False
+    number = 0
+    for chunk in iter(lambda: file.read(JSON_CHUNK_SIZE), ''):
+        buffer += chunk
+        while True:
+            buffer = buffer.lstrip()
+            if not started:
+                if not buffer:
+                    break
+                if buffer[0] != '[':
+                    raise CommandError('Ожидается JSON-массив.')
+                buffer = buffer[1:]
+                started = True
+                continue
+            if buffer.startswith(','):
+                buffer = buffer[1:]
+                continue
+            if buffer.startswith(']'):
+                return
+            try:
+                item, end = decoder.raw_decode(buffer)
+            except ValueError:
+                # Запись может быть дочитана следующей порцией файла.
+                break
+            buffer = buffer[end:]
+            number += 1
+            try:
+                name, measurement_unit = item['name'], item['measurement_unit']
+            except (KeyError, TypeError):
+                raise CommandError(
+                    f'Запись {number}: ожидается объект с полями name '
+                    'и measurement_unit.'
+                )
+            yield name, measurement_unit
+    if not started:
+        raise CommandError('Ожидается JSON-массив.')
+    if buffer:
+        raise CommandError(f'Запись {number + 1}: некорректный JSON.')
+    raise CommandError('JSON-массив не закрыт.')
+
+
+READERS = {
+    '.csv': read_csv,
+    '.json': read_json,
+}
+
+
+class Command(BaseCommand):
+    help = 'Загружает ингредиенты из CSV или JSON, пропуская существующие.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', type=Path, help='Файл с ингредиентами.')
+        parser.add_argument(
+            '--format',
+            choices=[extension.lstrip('.') for extension in READERS],
+            help='Формат файла, по умолчанию по расширению.'
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=5000,
+            help='Сколько строк вставлять за один запрос.'
+        )
+
+    def handle(self, *args, **options):
+        path = options['path']
+        extension = (
+            f'.{options["format"]}' if options['format'] else path.suffix
+        )
+        reader = READERS.get(extension.lower())
+        if reader is None:
+            raise CommandError(f'Неизвестный формат файла: {path.name}.')
+        batch_size = options['batch_size']
+        started = time.monotonic()
+        read = 0
+        with open(path, encoding='utf-8') as file, transaction.atomic():
+            before = Ingredient.objects.count()
+            rows = reader(file)
+            while True:
+                batch = [
+                    Ingredient(name=name, measurement_unit=measurement_unit)
+                    for name, measurement_unit in islice(rows, batch_size)
+                ]
+                if not batch:
+                    break
+                Ingredient.objects.bulk_create(
+                    batch, ignore_conflicts=True
+                )
+                read += len(batch)
+            created = Ingredient.objects.count() - before
+        elapsed = time.monotonic() - started
+        if created:
+            bump_version(Ingredient)
+        self.stdout.write(self.style.SUCCESS(
+            f'Прочитано {read}, добавлено {created} ингредиентов '
+            f'за {elapsed:.2f} с ({read / max(elapsed, 1e-6):.0f} строк/с).'
+        ))
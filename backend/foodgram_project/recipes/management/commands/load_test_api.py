@@ -0,0 +1,258 @@
+import asyncio
+import json
+import os
+import time
+from urllib.parse import urlencode, urlsplit
+
+from django.core.management.base import BaseCommand, CommandError
+
+TIMEOUT = 30
+SAMPLE_INTERVAL = 0.25
+
+
+def percentile(values, share):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * share))]
+
+
+def process_tree(pid):
+    pids, stack = [], [pid]
+    while stack:
+        pid = stack.pop()
+        pids.append(pid)
+        for task in os.listdir(f'/proc/{pid}/task'):
+            with open(f'/proc/{pid}/task/{task}/children') as file:
+                stack.extend(int(child) for child in file.read().split())
+    return pids
+
+
+def rss_kb(pid):
+    """Память процесса сервера вместе с дочерними воркерами."""
+    total = 0
+    for child in process_tree(pid):
+        with open(f'/proc/{child}/status') as file:
+            for line in file:
+                if line.startswith('VmRSS:'):
+                    total += int(line.split()[1])
+    return total
+
+
+class Target:
+
+    def __init__(self, url, token):
+        parts = urlsplit(url)
+        self.host = parts.hostname
+        self.port = parts.port or 80
+        self.headers = f'Host: {parts.netloc}\r\nAccept: application/json\r\n'
+        if token:
+            self.headers += f'Authorization: Token {token}\r\n'
+
+    def request(self, path):
+        return (
+            f'GET {path} HTTP/1.1\r\n{self.headers}'
+            'Connection: close\r\n\r\n'
+        ).encode()
+
+    async def fetch(self, path):
+        """Статус и тело ответа на GET path."""
+        reader, writer = await asyncio.wait_for(
+            asyncio.open_connection(self.host, self.port), TIMEOUT
+        )
+        try:
+            writer.write(self.request(path))
+            await writer.drain()
+            return await self.read(reader)
+        finally:
+            writer.close()
+
+    async def fetch_slowly(self, path, deadline, interval):
+        """Медленный клиент: шлет заголовки по одному до deadline."""
+        reader, writer = await asyncio.wait_for(
+            asyncio.open_connection(self.host, self.port), TIMEOUT
+        )
+        try:
+            head, _ = self.request(path).split(b'\r\n\r\n')
+            writer.write(head + b'\r\n')
+            number = 0
+            while time.monotonic() < deadline:
+                await asyncio.sleep(interval)
+                number += 1
+                writer.write(f'X-Slow-{number}: 1\r\n'.encode())
+                await writer.drain()
+            writer.write(b'\r\n')
+            await writer.drain()
+            return await self.read(reader)
+        finally:
+            writer.close()
+
+    @staticmethod
+    async def read(reader):
+        status = await asyncio.wait_for(reader.readline(), TIMEOUT)
+        body = await asyncio.wait_for(reader.read(), TIMEOUT)
+        return int(status.split()[1]), body.split(b'\r\n\r\n', 1)[-1]
+
+
+class Command(BaseCommand):
+    help = (
+        'Нагрузочный тест запущенного сервера: параллельные клиенты '
+        'на маршрутах чтения и медленные соединения. Запускается '
+        'против WSGI и ASGI развертываний с разными --label, '
+        'результаты сравниваются в файле --output.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--url', default='http://127.0.0.1:8000',
+            help='Адрес сервера.'
+        )
+        parser.add_argument(
+            '--label', required=True,
+            help='Название развертывания, например wsgi или asgi.'
+        )
+        parser.add_argument(
+            '--token',
+            help='Токен пользователя для рецептов и users/me.'
+        )
+        parser.add_argument(
+            '--clients', default='10,100,500',
+            help='Уровни числа параллельных клиентов через запятую.'
+        )
+        parser.add_argument(
+            '--slow-clients', type=int, default=0,
+            help='Сколько медленных соединений держать на каждом уровне.'
+        )
+        parser.add_argument(
+            '--slow-interval', type=float, default=1.0,
+            help='Пауза медленного клиента между заголовками, секунды.'
+        )
+        parser.add_argument(
+            '--duration', type=float, default=10.0,
+            help='Длительность уровня, секунды.'
+        )
+        parser.add_argument(
+            '--pid', type=int,
+            help='PID сервера: его память и память воркеров.'
+        )
+        parser.add_argument(
+            '--output',
+            help='JSON с результатами прогонов по --label.'
+        )
+
+    def handle(self, *args, **options):
+        try:
+            levels = [int(level) for level in options['clients'].split(',')]
+        except ValueError:
+            raise CommandError('--clients: числа через запятую.')
+        target = Target(options['url'], options['token'])
+        paths = asyncio.run(self.paths(target, options['token']))
+        self.stdout.write('Маршруты: ' + ', '.join(paths))
+        report = {}
+        for clients in levels:
+            result = asyncio.run(self.level(target, paths, clients, options))
+            report[str(clients)] = result
+            self.stdout.write(
+                f'{clients} клиентов: {result["rps"]} rps, '
+                f'p50 {result["p50_ms"]} мс, p95 {result["p95_ms"]} мс, '
+                f'ошибок {result["errors"]}, медленных ответов '
+                f'{result["slow_done"]}/{options["slow_clients"]}, '
+                f'память {result["rss_mb"]} МБ'
+            )
+        if options['output']:
+            self.save(report, options['label'], options['output'])
+
+    async def paths(self, target, token):
+        paths = [
+            '/api/tags/', '/api/ingredients/?' + urlencode({'name': 'а'})
+        ]
+        if not token:
+            return paths
+        status, body = await target.fetch('/api/recipes/?limit=1')
+        if status != 200:
+            raise CommandError(f'/api/recipes/ ответил {status}.')
+        paths.append('/api/recipes/')
+        results = json.loads(body)['results']
+        if results:
+            paths.append(f'/api/recipes/{results[0]["id"]}/')
+        paths.append('/api/users/me/')
+        return paths
+
+    async def level(self, target, paths, clients, options):
+        deadline = time.monotonic() + options['duration']
+        times, errors = [], 0
+        memory = []
+
+        async def client(number):
+            nonlocal errors
+            index = number
+            while time.monotonic() < deadline:
+                started = time.perf_counter()
+                try:
+                    status, _ = await target.fetch(paths[index % len(paths)])
+                except (OSError, asyncio.TimeoutError, ValueError):
+                    status = None
+                if status is None or status >= 400:
+                    errors += 1
+                else:
+                    times.append(time.perf_counter() - started)
+                index += 1
+
+        async def slow_client():
+            try:
+                status, _ = await target.fetch_slowly(
+                    paths[0], deadline, options['slow_interval']
+                )
+            except (OSError, asyncio.TimeoutError, ValueError):
+                return False
+            return status < 400
+
+        async def sample():
+            while time.monotonic() < deadline:
+                memory.append(rss_kb(options['pid']))
+                await asyncio.sleep(SAMPLE_INTERVAL)
+
+        started = time.monotonic()
+        tasks = [client(number) for number in range(clients)]
+        slow = [slow_client() for _ in range(options['slow_clients'])]
+        if options['pid']:
+            tasks.append(sample())
+        *_, slow_done = await asyncio.gather(
+            asyncio.gather(*tasks), asyncio.gather(*slow)
+        )
+        elapsed = time.monotonic() - started
+        return {
+            'requests': len(times),
+            'errors': errors,
+            'rps': round(len(times) / elapsed, 1),
+            'p50_ms': (
+                round(percentile(times, 0.5) * 1000, 1) if times else None
+            ),
+            'p95_ms': (
+                round(percentile(times, 0.95) * 1000, 1) if times else None
+            ),
+            'slow_done': sum(slow_done),
+            'rss_mb': round(max(memory) / 1024, 1) if memory else None,
+        }
+
+    def save(self, report, label, path):
+        runs = {}
+        if os.path.exists(path):
+            with open(path, encoding='utf-8') as file:
+                runs = json.load(file)
+        runs[label] = report
+        with open(path, 'w', encoding='utf-8') as file:
+            json.dump(runs, file, ensure_ascii=False, indent=2)
+        self.stdout.write(f'Сравнение прогонов из {path}:')
+        for clients in sorted(
+            {clients for report in runs.values() for clients in report},
+            key=int
+        ):
+            for run_label, run in sorted(runs.items()):
+                result = run.get(clients)
+                if result is None:
+                    continue
+                self.stdout.write(
+                    f'  {clients:>6} {run_label:<10} {result["rps"]:>8} rps '
+                    f'p95 {result["p95_ms"]} мс, ошибок {result["errors"]}, '
+                    f'медленных {result["slow_done"]}, '
+                    f'память {result["rss_mb"]} МБ'
+                )
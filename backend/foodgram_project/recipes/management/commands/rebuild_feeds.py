@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+
+from recipes.feed import rebuild
+from recipes.models import FeedEntry, User
+
+
+class Command(BaseCommand):
+    help = (
+        'Пересчитывает, чьи рецепты подмешиваются в ленты при чтении, '
+        'и заново раскладывает последние рецепты остальных авторов.'
+    )
+
+    def handle(self, *args, **options):
+        rebuild()
+        self.stdout.write(self.style.SUCCESS(
+            f'Ленты перестроены: записей {FeedEntry.objects.count()}, '
+            'авторов при чтении '
+            f'{User.objects.filter(feed_pull=True).count()}.'
+        ))
@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from recipes.models import Recipe
+from recipes.search import update_index
+
+
+class Command(BaseCommand):
+    help = 'Перестраивает полнотекстовый индекс рецептов.'
+
+    def handle(self, *args, **options):
+        recipe_ids = list(Recipe.objects.values_list('id', flat=True))
+        update_index(recipe_ids)
+        self.stdout.write(self.style.SUCCESS(
+            f'Индекс поиска перестроен: {len(recipe_ids)} рецептов.'
+        ))
@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from recipes.models import ShopCartTotal
+
+
+class Command(BaseCommand):
+    help = 'Пересчитывает итоги списков покупок по корзинам пользователей.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--verify',
+            action='store_true',
+            help='Только сверить итоги, ничего не меняя.'
+        )
+
+    def handle(self, *args, **options):
+        if options['verify']:
+            mismatches = ShopCartTotal.objects.verify()
+            if mismatches:
+                raise CommandError(
+                    f'Расходящихся строк в итогах: {len(mismatches)}.'
+                )
+            self.stdout.write(self.style.SUCCESS('Итоги совпадают.'))
+            return
+        ShopCartTotal.objects.rebuild()
+        self.stdout.write(self.style.SUCCESS(
+            f'Итоги пересчитаны: {ShopCartTotal.objects.count()} строк.'
+        ))
@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from recipes.counters import reconcile
+
+
+class Command(BaseCommand):
+    help = (
+        'Сверяет счетчики рецептов, избранного и списков покупок '
+        'с фактическими данными и исправляет расхождения.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Только найти расхождения, ничего не меняя.'
+        )
+
+    def handle(self, *args, **options):
+        fixed = reconcile(dry_run=options['dry_run'])
+        for counter, count in fixed.items():
+            self.stdout.write(f'{counter}: {count}')
+        drifted = sum(fixed.values())
+        if options['dry_run'] and drifted:
+            raise CommandError(f'Расходящихся счетчиков: {drifted}.')
+        self.stdout.write(self.style.SUCCESS(
+            f'Исправлено счетчиков: {drifted}.'
+            if drifted else 'Счетчики совпадают.'
+        ))
@@ -0,0 +1,52 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from recipes.exports import remove_expired, run_export
+from recipes.models import ExportJob
+
+
+class Command(BaseCommand):
+    help = (
+        'Выполняет ожидающие выгрузки данных пользователей и удаляет '
+        'устаревшие.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--loop',
+            action='store_true',
+            help='Не завершаться, а ждать новые задачи.'
+        )
+        parser.add_argument(
+            '--interval',
+            type=float,
+            default=5,
+            help='Пауза между проверками очереди в секундах.'
+        )
+        parser.add_argument(
+            '--requeue',
+            action='store_true',
+            help='Вернуть в очередь задачи, прерванные остановкой сервера.'
+        )
+
+    def handle(self, *args, **options):
+        if options['requeue']:
+            requeued = ExportJob.objects.filter(
+                status=ExportJob.RUNNING
+            ).update(status=ExportJob.PENDING)
+            self.stdout.write(f'Возвращено в очередь: {requeued}.')
+        while True:
+            removed = remove_expired()
+            if removed:
+                self.stdout.write(f'Удалено устаревших выгрузок: {removed}.')
+            job_ids = list(ExportJob.objects.filter(
+                status=ExportJob.PENDING
+            ).order_by('id').values_list('id', flat=True))
+            for job_id in job_ids:
+                run_export(job_id)
+            if job_ids:
+                self.stdout.write(f'Обработано задач: {len(job_ids)}.')
+            if not options['loop']:
+                return
+            time.sleep(options['interval'])
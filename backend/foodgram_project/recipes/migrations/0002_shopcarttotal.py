@@ -0,0 +1,146 @@
+# Generated by Django 3.2.16 on 2026-10-18 18:16
+
+from django.conf import settings
+import django.core.validators
+from django.db import migrations, models
+import django.db.models.deletion
+
+BATCH_SIZE = 1000
+
+
+def fill_totals(apps, schema_editor):
+    """Итоги для корзин, собранных до появления ShopCartTotal."""
+    Amount = apps.get_model('recipes', 'Amount')
+    ShopCartTotal = apps.get_model('recipes', 'ShopCartTotal')
+    rows = Amount.objects.filter(
+        recipe__shop_cart__isnull=False
+    ).values(
+        'ingredient', user=models.F('recipe__shop_cart__user')
+    ).annotate(total=models.Sum('amount')).order_by()
+    ShopCartTotal.objects.bulk_create(
+        (
+            ShopCartTotal(
+                user_id=row['user'],
+                ingredient_id=row['ingredient'],
+                total=row['total']
+            )
+            for row in rows.iterator()
+        ),
+        batch_size=BATCH_SIZE
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AlterModelOptions(
+            name='ingredient',
+            options={'default_related_name': 'ingredients', 'ordering': ['id'], 'verbose_name': 'Ингредиенты', 'verbose_name_plural': 'ингредиенты'},
+        ),
+        migrations.AlterModelOptions(
+            name='recipe',
+            options={'ordering': ['-id'], 'verbose_name': 'Рецепт', 'verbose_name_plural': 'рецепты'},
+        ),
+        migrations.AlterField(
+            model_name='amount',
+            name='amount',
+            field=models.PositiveSmallIntegerField(help_text='Введите количество ингредиента', validators=[django.core.validators.MinValueValidator(1, 'Минимальное количество ингредиента'), django.core.validators.MaxValueValidator(32000, 'Максимальное количество ингредиента')]),
+        ),
+        migrations.AlterField(
+            model_name='amount',
+            name='ingredient',
+            field=models.ForeignKey(help_text='Выберите ингредиент', on_delete=django.db.models.deletion.CASCADE, related_name='in_recipe', to='recipes.ingredient'),
+        ),
+        migrations.AlterField(
+            model_name='amount',
+            name='recipe',
+            field=models.ForeignKey(help_text='Выберите рецепт', on_delete=django.db.models.deletion.CASCADE, related_name='recipe_ingredients', to='recipes.recipe'),
+        ),
+        migrations.AlterField(
+            model_name='ingredient',
+            name='measurement_unit',
+            field=models.CharField(help_text='Укажите единицу измерения ингредиента', max_length=50),
+        ),
+        migrations.AlterField(
+            model_name='ingredient',
+            name='name',
+            field=models.CharField(help_text='Введите название ингредиента', max_length=256),
+        ),
+        migrations.AlterField(
+            model_name='recipe',
+            name='author',
+            field=models.ForeignKey(help_text='Автор рецепта', on_delete=django.db.models.deletion.CASCADE, related_name='recipes', to=settings.AUTH_USER_MODEL, verbose_name='Автор'),
+        ),
+        migrations.AlterField(
+            model_name='recipe',
+            name='cooking_time',
+            field=models.PositiveSmallIntegerField(help_text='Укажите время приготовления в минутах', validators=[django.core.validators.MinValueValidator(1, 'Минимальное время приготовления'), django.core.validators.MaxValueValidator(32000, 'Максимальное время приготовления')], verbose_name='Время приготовления'),
+        ),
+        migrations.AlterField(
+            model_name='recipe',
+            name='image',
+            field=models.ImageField(help_text='Добавьте фото рецепта', upload_to='static/images/', verbose_name='Фото рецепта'),
+        ),
+        migrations.AlterField(
+            model_name='recipe',
+            name='name',
+            field=models.CharField(help_text='Введите название рецепта', max_length=256, verbose_name='Название рецепта'),
+        ),
+        migrations.AlterField(
+            model_name='recipe',
+            name='tags',
+            field=models.ManyToManyField(help_text='Тэг рецепта', related_name='recipes', to='recipes.Tag', verbose_name='Название тэга'),
+        ),
+        migrations.AlterField(
+            model_name='recipe',
+            name='text',
+            field=models.TextField(help_text='Добавьте описание приготовления рецепта', max_length=512, verbose_name='Описание рецепта'),
+        ),
+        migrations.AlterField(
+            model_name='subscription',
+            name='author',
+            field=models.ForeignKey(help_text='Подписаться на автора рецепта', on_delete=django.db.models.deletion.CASCADE, related_name='subscribed', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AlterField(
+            model_name='subscription',
+            name='user',
+            field=models.ForeignKey(help_text='Текущий пользователь', on_delete=django.db.models.deletion.CASCADE, related_name='subscriber', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AlterField(
+            model_name='tag',
+            name='color',
+            field=models.CharField(choices=[('#7CFC00', 'Зеленый'), ('#FF6347', 'Оранжевый'), ('#8A2BE2', 'Фиолетовый')], help_text='Выберите цвет тэга', max_length=50),
+        ),
+        migrations.AlterField(
+            model_name='tag',
+            name='name',
+            field=models.CharField(help_text='Введите название тэга', max_length=50, unique=True),
+        ),
+        migrations.AlterField(
+            model_name='tag',
+            name='slug',
+            field=models.SlugField(help_text='Введите слаг тэга', unique=True),
+        ),
+        migrations.CreateModel(
+            name='ShopCartTotal',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('total', models.IntegerField(verbose_name='Количество')),
+                ('ingredient', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='shop_cart_totals', to='recipes.ingredient', verbose_name='Ингредиент')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='shop_cart_totals', to=settings.AUTH_USER_MODEL, verbose_name='Пользователь')),
+            ],
+            options={
+                'verbose_name': 'Итог списка покупок',
+                'verbose_name_plural': 'Итоги списков покупок',
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='shopcarttotal',
+            constraint=models.UniqueConstraint(fields=('user', 'ingredient'), name='unique_cart_total'),
+        ),
+        migrations.RunPython(fill_totals, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,31 @@
+from django.db import migrations
+
+from recipes.search import create_index, drop_index, update_index
+
+
+def create_search_index(apps, schema_editor):
+    create_index(schema_editor)
+    Recipe = apps.get_model('recipes', 'Recipe')
+    Amount = apps.get_model('recipes', 'Amount')
+    update_index(
+        Recipe.objects.using(
+            schema_editor.connection.alias
+        ).values_list('id', flat=True),
+        using=schema_editor.connection.alias,
+        models=(Recipe, Amount)
+    )
+
+
+def drop_search_index(apps, schema_editor):
+    drop_index(schema_editor)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0002_shopcarttotal'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
@@ -0,0 +1,65 @@
+# Generated by Django 3.2.16 on 2026-10-18 18:22
+
+from django.db import migrations, models
+
+
+def merge_duplicate_ingredients(apps, schema_editor):
+    """Сводит повторы, оставшиеся от повторных запусков import_csv.py.
+
+    Итоги корзин по сведенным ингредиентам пересчитываются заново.
+    """
+    Ingredient = apps.get_model('recipes', 'Ingredient')
+    Amount = apps.get_model('recipes', 'Amount')
+    ShopCartTotal = apps.get_model('recipes', 'ShopCartTotal')
+    duplicates = Ingredient.objects.values(
+        'name', 'measurement_unit'
+    ).annotate(
+        keep=models.Min('id'), total=models.Count('id')
+    ).filter(total__gt=1).order_by()
+    merged = []
+    for duplicate in duplicates:
+        keep = duplicate['keep']
+        others = Ingredient.objects.filter(
+            name=duplicate['name'],
+            measurement_unit=duplicate['measurement_unit']
+        ).exclude(id=keep)
+        Amount.objects.filter(ingredient__in=others).exclude(
+            recipe__in=Amount.objects.filter(
+                ingredient=keep
+            ).values('recipe')
+        ).update(ingredient=keep)
+        ShopCartTotal.objects.filter(ingredient__in=others).delete()
+        others.delete()
+        merged.append(keep)
+    ShopCartTotal.objects.filter(ingredient__in=merged).delete()
+    ShopCartTotal.objects.bulk_create(
+        ShopCartTotal(
+            user_id=row['user'],
+            ingredient_id=row['ingredient'],
+            total=row['total']
+        )
+        for row in Amount.objects.filter(
+            ingredient__in=merged, recipe__shop_cart__isnull=False
+        ).values(
+            'ingredient', user=models.F('recipe__shop_cart__user')
+        ).annotate(
+            total=models.Sum('amount')
+        ).order_by()
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0004_recipe_filter_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(
+            merge_duplicate_ingredients, migrations.RunPython.noop
+        ),
+        migrations.AddConstraint(
+            model_name='ingredient',
+            constraint=models.UniqueConstraint(fields=('name', 'measurement_unit'), name='unique_ingredient'),
+        ),
+    ]
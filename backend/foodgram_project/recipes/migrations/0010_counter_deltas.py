@@ -0,0 +1,27 @@
+# Generated by Django 3.2.16 on 2026-10-18 19:27
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0009_feed'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RecipeCounterDelta',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('favorites_count', models.IntegerField(default=0, verbose_name='в избранном')),
+                ('in_carts_count', models.IntegerField(default=0, verbose_name='в списках покупок')),
+                ('recipe', models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to='recipes.recipe', verbose_name='Рецепт')),
+            ],
+            options={
+                'verbose_name': 'Изменение счетчиков рецепта',
+                'verbose_name_plural': 'Изменения счетчиков рецептов',
+            },
+        ),
+    ]
@@ -1,11 +1,30 @@
 from django.contrib.auth.models import AbstractUser
 from django.core.validators import MinValueValidator, MaxValueValidator
-from django.db import models
+from django.db import connections, models, router, transaction
 
-from . import consts
+from . import consts, search
 
 
-class User(AbstractUser):
+class CountersMixin:
+    """Обычный save не перезаписывает счетчики из counter_fields.
+
+    Счетчики меняются только атомарным UPDATE, и устаревшее значение
+    в загруженном объекте не должно затереть чужие изменения.
+    """
+
+    counter_fields = ()
+
+    def save(self, *args, **kwargs):
+        if not self._state.adding and kwargs.get('update_fields') is None:
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key
+                and field.name not in self.counter_fields
+            ]
+        super().save(*args, **kwargs)
+
+
+class User(CountersMixin, AbstractUser):
     username = models.CharField(
         verbose_name='имя пользователя',
         max_length=consts.USERNAME_LENGTH,
@@ -24,6 +43,16 @@ class User(AbstractUser):
         max_length=consts.EMAIL_LENGTH,
         unique=True,
     )
+    recipes_count = models.PositiveIntegerField(
+        'число рецептов', default=0, editable=False
+    )
+    # Рецепты автора не раскладываются по лентам подписчиков, а
+    # подмешиваются при чтении ленты; флаг ставит recipes.feed.
+    feed_pull = models.BooleanField(
+        'лента при чтении', default=False, editable=False
+    )
+
+    counter_fields = ('recipes_count', 'feed_pull')
     USERNAME_FIELD = 'email'
     REQUIRED_FIELDS = ['username', 'first_name', 'last_name']
 
@@ -37,18 +66,44 @@ class User(AbstractUser):
         return f'{self.first_name} {self.last_name}'
 
 
+class SubscriptionQuerySet(models.QuerySet):
+
+    def with_recipes(self, recipes_limit=None):
+        """Автор и не более recipes_limit его последних рецептов."""
+        recipes = Recipe.objects.all()
+        if recipes_limit is not None:
+            recipes = recipes.filter(
+                pk__in=models.Subquery(
+                    Recipe.objects.filter(
+                        author=models.OuterRef('author')
+                    ).values('pk')[:recipes_limit]
+                )
+            )
+        return self.select_related('author').prefetch_related(
+            models.Prefetch(
+                'author__recipes',
+                queryset=recipes,
+                to_attr='limited_recipes'
+            )
+        )
+
+
 class Subscription(models.Model):
     user = models.ForeignKey(
         User, on_delete=models.CASCADE,
         related_name='subscriber',
+        db_index=False,
         help_text='Текущий пользователь'
     )
     author = models.ForeignKey(
         User, on_delete=models.CASCADE,
         related_name='subscribed',
+        db_index=False,
         help_text='Подписаться на автора рецепта'
     )
 
+    objects = SubscriptionQuerySet.as_manager()
+
     class Meta:
         constraints = [
             models.UniqueConstraint(
@@ -56,6 +111,14 @@ class Subscription(models.Model):
                 name='unique_user_author'
             )
         ]
+        indexes = [
+            models.Index(
+                fields=['user', '-id'], name='subscription_user_idx'
+            ),
+            models.Index(
+                fields=['author', 'user'], name='subscription_author_idx'
+            ),
+        ]
         verbose_name = 'Подписки'
         verbose_name_plural = 'подписки'
         default_related_name = 'subscripions'
@@ -113,12 +176,82 @@ class Ingredient(models.Model):
         verbose_name = 'Ингредиенты'
         verbose_name_plural = 'ингредиенты'
         default_related_name = 'ingredients'
+        constraints = [
+            models.UniqueConstraint(
+                fields=['name', 'measurement_unit'],
+                name='unique_ingredient'
+            )
+        ]
 
     def __str__(self):
         return self.name
 
 
-class Recipe(models.Model):
+class RecipeQuerySet(models.QuerySet):
+
+    def with_relations(self):
+        return self.select_related('author').prefetch_related(
+            'tags',
+            models.Prefetch(
+                'recipe_ingredients',
+                queryset=Amount.objects.select_related('ingredient')
+            )
+        )
+
+    def with_user_flags(self, user):
+        """Флаги избранного, корзины и подписки на автора для user."""
+        if user.is_anonymous:
+            return self.annotate(
+                is_favorite=models.Value(
+                    False, output_field=models.BooleanField()
+                ),
+                is_in_shopping_cart=models.Value(
+                    False, output_field=models.BooleanField()
+                ),
+                author_is_subscribed=models.Value(
+                    False, output_field=models.BooleanField()
+                ),
+            )
+        return self.annotate(
+            is_favorite=models.Exists(
+                Favorite.objects.filter(
+                    author=user, recipe=models.OuterRef('pk')
+                )
+            ),
+            is_in_shopping_cart=models.Exists(
+                ShopCart.objects.filter(
+                    user=user, recipe=models.OuterRef('pk')
+                )
+            ),
+            author_is_subscribed=models.Exists(
+                Subscription.objects.filter(
+                    user=user, author=models.OuterRef('author')
+                )
+            ),
+        )
+
+    def with_tags(self, tags):
+        return self.filter(
+            pk__in=Recipe.tags.through.objects.filter(
+                tag__in=tags
+            ).values('recipe')
+        )
+
+    def favorited_by(self, user):
+        return self.filter(
+            pk__in=Favorite.objects.filter(author=user).values('recipe')
+        )
+
+    def in_shopping_cart_of(self, user):
+        return self.filter(
+            pk__in=ShopCart.objects.filter(user=user).values('recipe')
+        )
+
+    def search(self, query):
+        return search.search(self, query)
+
+
+class Recipe(CountersMixin, models.Model):
     tags = models.ManyToManyField(
         Tag,
         related_name='recipes',
@@ -129,6 +262,7 @@ class Recipe(models.Model):
         User,
         on_delete=models.CASCADE,
         related_name='recipes',
+        db_index=False,
         verbose_name='Автор',
         help_text='Автор рецепта'
     )
@@ -164,11 +298,31 @@ class Recipe(models.Model):
         ],
         help_text='Укажите время приготовления в минутах'
     )
+    favorites_count = models.PositiveIntegerField(
+        'в избранном', default=0, editable=False
+    )
+    in_carts_count = models.PositiveIntegerField(
+        'в списках покупок', default=0, editable=False
+    )
+
+    objects = RecipeQuerySet.as_manager()
+    counter_fields = ('favorites_count', 'in_carts_count')
 
     class Meta:
         ordering = ['-id']
         verbose_name = 'Рецепт'
         verbose_name_plural = 'рецепты'
+        indexes = [
+            models.Index(
+                fields=['cooking_time', '-id'],
+                name='recipe_cooking_time_idx'
+            ),
+            models.Index(fields=['author', '-id'], name='recipe_author_idx'),
+            models.Index(
+                fields=['favorites_count', 'id'],
+                name='recipe_popularity_idx'
+            ),
+        ]
         constraints = [
             models.UniqueConstraint(
                 fields=['name', 'author'],
@@ -183,12 +337,14 @@ class Amount(models.Model):
         Recipe,
         on_delete=models.CASCADE,
         related_name='recipe_ingredients',
+        db_index=False,
         help_text='Выберите рецепт'
     )
     ingredient = models.ForeignKey(
         Ingredient,
         on_delete=models.CASCADE,
         related_name='in_recipe',
+        db_index=False,
         help_text='Выберите ингредиент'
     )
     amount = models.PositiveSmallIntegerField(
@@ -210,6 +366,11 @@ class Amount(models.Model):
             models.UniqueConstraint(
                 fields=['recipe', 'ingredient'],
                 name='unique_ingredients')]
+        indexes = [
+            models.Index(
+                fields=['ingredient', 'recipe'], name='amount_ingredient_idx'
+            ),
+        ]
 
     def __str__(self):
         return (
@@ -223,12 +384,14 @@ class Favorite(models.Model):
         User,
         related_name='favorite',
         on_delete=models.CASCADE,
+        db_index=False,
         verbose_name='Автор рецепта'
     )
     recipe = models.ForeignKey(
         Recipe,
         related_name='favorite',
         on_delete=models.CASCADE,
+        db_index=False,
         verbose_name='Рецепт'
     )
 
@@ -238,6 +401,11 @@ class Favorite(models.Model):
         constraints = [models.UniqueConstraint(
             fields=['author', 'recipe'],
             name='unique_favorite')]
+        indexes = [
+            models.Index(
+                fields=['recipe', 'author'], name='favorite_recipe_idx'
+            ),
+        ]
 
     def __str__(self):
         return f'{self.recipe.name} в избранном у {self.author.username}'
@@ -248,12 +416,14 @@ class ShopCart(models.Model):
         User,
         related_name='shop_cart',
         on_delete=models.CASCADE,
+        db_index=False,
         verbose_name='Пользователь'
     )
     recipe = models.ForeignKey(
         Recipe,
         related_name='shop_cart',
         on_delete=models.CASCADE,
+        db_index=False,
         verbose_name='Рецепт для готовки'
     )
 
@@ -263,6 +433,243 @@ class ShopCart(models.Model):
         constraints = [models.UniqueConstraint(
             fields=['user', 'recipe'],
             name='unique_cart')]
+        indexes = [
+            models.Index(fields=['recipe', 'user'], name='cart_recipe_idx'),
+        ]
 
     def __str__(self):
         return f'{self.recipe.name} в списке покупок у {self.user.username}'
+
+
+class ShopCartTotalManager(models.Manager):
+
+    def apply(self, user_ids, deltas):
+        """Прибавляет deltas {ingredient_id: количество} к итогам user_ids.
+
+        Один INSERT ... ON CONFLICT DO UPDATE на пачку строк: новые
+        итоги вставляются, существующие увеличиваются в той же
+        команде, поэтому параллельные запросы не теряют и не дублируют
+        строки (PostgreSQL и SQLite 3.24+). Затем удаляются обнулившиеся.
+        """
+        user_ids = list(user_ids)
+        deltas = {
+            ingredient_id: delta
+            for ingredient_id, delta in deltas.items() if delta
+        }
+        if not user_ids or not deltas:
+            return
+        rows = [
+            (user_id, ingredient_id, delta)
+            for user_id in user_ids
+            for ingredient_id, delta in deltas.items()
+        ]
+        using = router.db_for_write(self.model)
+        connection = connections[using]
+        fields = [
+            self.model._meta.get_field(name)
+            for name in ('user', 'ingredient', 'total')
+        ]
+        quote = connection.ops.quote_name
+        table = quote(self.model._meta.db_table)
+        user, ingredient, total = (quote(field.column) for field in fields)
+        batch_size = connection.ops.bulk_batch_size(fields, rows)
+        with transaction.atomic(using=using), connection.cursor() as cursor:
+            for start in range(0, len(rows), batch_size):
+                batch = rows[start:start + batch_size]
+                cursor.execute(
+                    f'INSERT INTO {table} ({user}, {ingredient}, {total}) '
+                    f'VALUES {", ".join(["(%s, %s, %s)"] * len(batch))} '
+                    f'ON CONFLICT ({user}, {ingredient}) DO UPDATE '
+                    f'SET {total} = {table}.{total} + EXCLUDED.{total}',
+                    [value for row in batch for value in row]
+                )
+            self.filter(user__in=user_ids, total__lte=0).delete()
+
+    @staticmethod
+    def recipe_deltas(recipe_id, sign=1):
+        return ShopCartTotalManager.recipes_deltas([recipe_id], sign)
+
+    @staticmethod
+    def recipes_deltas(recipe_ids, sign=1):
+        """Суммарные количества ингредиентов рецептов recipe_ids."""
+        return {
+            ingredient_id: sign * total
+            for ingredient_id, total in Amount.objects.filter(
+                recipe__in=recipe_ids
+            ).values('ingredient').annotate(
+                total=models.Sum('amount')
+            ).values_list('ingredient', 'total').order_by()
+        }
+
+    def add_recipe(self, user_id, recipe_id):
+        self.apply([user_id], self.recipe_deltas(recipe_id))
+
+    def remove_recipe(self, user_id, recipe_id):
+        self.apply([user_id], self.recipe_deltas(recipe_id, sign=-1))
+
+    def change_recipe(self, recipe, deltas):
+        """Учитывает изменение ингредиентов рецепта во всех корзинах."""
+        self.apply(recipe.shop_cart.values_list('user', flat=True), deltas)
+
+    @staticmethod
+    def expected():
+        return Amount.objects.filter(
+            recipe__shop_cart__isnull=False
+        ).values(
+            'ingredient', user=models.F('recipe__shop_cart__user')
+        ).annotate(
+            total=models.Sum('amount')
+        ).order_by()
+
+    def rebuild(self):
+        with transaction.atomic():
+            self.all().delete()
+            self.bulk_create(
+                self.model(
+                    user_id=row['user'],
+                    ingredient_id=row['ingredient'],
+                    total=row['total']
+                )
+                for row in self.expected().iterator()
+            )
+
+    def verify(self):
+        """Возвращает строки (user, ingredient, total), которые расходятся."""
+        expected = {
+            (row['user'], row['ingredient'], row['total'])
+            for row in self.expected().iterator()
+        }
+        stored = set(self.values_list('user', 'ingredient', 'total'))
+        return expected ^ stored
+
+
+class ShopCartTotal(models.Model):
+    user = models.ForeignKey(
+        User,
+        related_name='shop_cart_totals',
+        on_delete=models.CASCADE,
+        db_index=False,
+        verbose_name='Пользователь'
+    )
+    ingredient = models.ForeignKey(
+        Ingredient,
+        related_name='shop_cart_totals',
+        on_delete=models.CASCADE,
+        verbose_name='Ингредиент'
+    )
+    total = models.IntegerField(verbose_name='Количество')
+
+    objects = ShopCartTotalManager()
+
+    class Meta:
+        verbose_name = 'Итог списка покупок'
+        verbose_name_plural = 'Итоги списков покупок'
+        constraints = [models.UniqueConstraint(
+            fields=['user', 'ingredient'],
+            name='unique_cart_total')]
+
+    def __str__(self):
+        return (
+            f'{self.total} {self.ingredient.measurement_unit} '
+            f'{self.ingredient.name} у {self.user.username}'
+        )
+
+
+class ExportJob(models.Model):
+    PENDING = 'pending'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATUSES = (
+        (PENDING, 'В очереди'),
+        (RUNNING, 'Выполняется'),
+        (DONE, 'Готово'),
+        (FAILED, 'Ошибка'),
+    )
+
+    user = models.ForeignKey(
+        User,
+        related_name='export_jobs',
+        on_delete=models.CASCADE,
+        db_index=False,
+        verbose_name='Пользователь'
+    )
+    status = models.CharField(
+        'статус',
+        max_length=consts.EXPORT_STATUS_LENGTH,
+        choices=STATUSES,
+        default=PENDING,
+        db_index=True
+    )
+    file = models.CharField(
+        'файл', max_length=consts.EXPORT_FILE_LENGTH, blank=True
+    )
+    error = models.TextField('ошибка', blank=True)
+    created = models.DateTimeField('создано', auto_now_add=True)
+    finished = models.DateTimeField('завершено', null=True, blank=True)
+
+    class Meta:
+        verbose_name = 'Выгрузка данных'
+        verbose_name_plural = 'Выгрузки данных'
+        ordering = ('-id',)
+        indexes = [
+            models.Index(fields=['user', '-id'], name='export_job_user_idx'),
+        ]
+
+    def __str__(self):
+        return f'Выгрузка {self.pk} для {self.user.username}: {self.status}'
+
+
+class FeedEntry(models.Model):
+    """Рецепт автора в ленте подписчика, записанный при публикации."""
+
+    user = models.ForeignKey(
+        User,
+        related_name='feed_entries',
+        on_delete=models.CASCADE,
+        db_index=False,
+        verbose_name='Подписчик'
+    )
+    recipe = models.ForeignKey(
+        Recipe,
+        related_name='feed_entries',
+        on_delete=models.CASCADE,
+        verbose_name='Рецепт'
+    )
+
+    class Meta:
+        verbose_name = 'Запись ленты'
+        verbose_name_plural = 'Записи лент'
+        # Страница ленты - обратный проход этого индекса от курсора.
+        constraints = [models.UniqueConstraint(
+            fields=['user', 'recipe'],
+            name='unique_feed_entry')]
+
+    def __str__(self):
+        return f'{self.recipe.name} в ленте {self.user.username}'
+
+
+class RecipeCounterDelta(models.Model):
+    """Изменение счетчиков рецепта, еще не перенесенное в Recipe.
+
+    Переключатели избранного и списка покупок только добавляют такие
+    строки и не ждут блокировки строки популярного рецепта;
+    recipes.counters.fold периодически сворачивает их в счетчики.
+    """
+
+    recipe = models.ForeignKey(
+        Recipe,
+        related_name='+',
+        on_delete=models.DO_NOTHING,
+        db_constraint=False,
+        verbose_name='Рецепт'
+    )
+    favorites_count = models.IntegerField('в избранном', default=0)
+    in_carts_count = models.IntegerField('в списках покупок', default=0)
+
+    class Meta:
+        verbose_name = 'Изменение счетчиков рецепта'
+        verbose_name_plural = 'Изменения счетчиков рецептов'
+
+    def __str__(self):
+        return f'Изменение счетчиков рецепта {self.recipe_id}'
@@ -0,0 +1,139 @@
+import json
+
+from django.db import connections, models, transaction
+
+from . import consts
+from .models import (
+    Amount, ExportJob, Favorite, FeedEntry, Recipe, ShopCart, ShopCartTotal,
+    Subscription, Tag, User
+)
+
+
+def sqlite_scans(cursor, sql, params):
+    cursor.execute('EXPLAIN QUERY PLAN ' + sql, params)
+    plan = [row[-1] for row in cursor.fetchall()]
+    scans = {
+        detail.split()[1] for detail in plan if detail.startswith('SCAN ')
+    }
+    return plan, scans
+
+
+def postgresql_scans(cursor, sql, params):
+    cursor.execute('SET LOCAL enable_seqscan = off')
+    cursor.execute('EXPLAIN (FORMAT JSON) ' + sql, params)
+    plan = cursor.fetchone()[0]
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    scans = set()
+    nodes = [plan[0]['Plan']]
+    while nodes:
+        node = nodes.pop()
+        if node['Node Type'] == 'Seq Scan':
+            scans.add(node['Relation Name'])
+        nodes.extend(node.get('Plans', ()))
+    return json.dumps(plan, indent=2).splitlines(), scans
+
+
+EXPLAIN = {
+    'sqlite': sqlite_scans,
+    'postgresql': postgresql_scans,
+}
+
+
+def checks(user, page=consts.OBJECT_ON_PAGE):
+    """Основные запросы эндпоинтов: имя, запрос и таблицы, которые
+    разрешено читать целиком (страница списка берется сканированием
+    в порядке индекса с LIMIT)."""
+    recipe_ids = [1, 2, 3]
+    table = Recipe._meta.db_table
+    recipes = Recipe.objects.with_user_flags(user)
+    return [
+        ('recipes list', recipes[:page], {table}),
+        ('recipes by author', recipes.filter(author=user)[:page], set()),
+        ('recipes by tags',
+         recipes.with_tags([Tag(pk=1)])[:page], set()),
+        ('recipes in favorites',
+         recipes.favorited_by(user)[:page], set()),
+        ('recipes in shopping cart',
+         recipes.in_shopping_cart_of(user)[:page], set()),
+        ('recipes by cooking time',
+         recipes.order_by('cooking_time', '-id')[:page], {table}),
+        ('recipe detail', recipes.filter(pk=1), set()),
+        ('recipe ingredients',
+         Amount.objects.filter(
+             recipe__in=recipe_ids
+         ).select_related('ingredient'), set()),
+        ('recipe tags',
+         Recipe.tags.through.objects.filter(recipe__in=recipe_ids), set()),
+        ('author recipes count',
+         Recipe.objects.filter(author=user).values('pk'), set()),
+        ('subscriptions',
+         Subscription.objects.filter(
+             user=user
+         ).with_recipes().order_by('-id')[:page], set()),
+        ('subscription recipes',
+         Recipe.objects.filter(
+             author__in=[user.pk],
+             pk__in=models.Subquery(
+                 Recipe.objects.filter(
+                     author=models.OuterRef('author')
+                 ).values('pk')[:3]
+             )
+         ), set()),
+        ('subscribers of author',
+         Subscription.objects.filter(author=user).values('user'), set()),
+        ('favorite toggle',
+         Favorite.objects.filter(author=user, recipe=1), set()),
+        ('favorites of author',
+         Favorite.objects.filter(author=user).values('recipe'), set()),
+        ('carts of user', ShopCart.objects.filter(user=user), set()),
+        ('carts with recipe',
+         ShopCart.objects.filter(recipe=1).values('user'), set()),
+        ('shopping cart totals',
+         ShopCartTotal.objects.filter(
+             user=user
+         ).select_related('ingredient').order_by('ingredient__name'),
+         set()),
+        ('recipes by ingredient',
+         Amount.objects.filter(ingredient=1).values('recipe'), set()),
+        ('export jobs',
+         ExportJob.objects.filter(user=user)[:page], set()),
+        ('active export jobs',
+         ExportJob.objects.filter(
+             user=user, status__in=(ExportJob.PENDING, ExportJob.RUNNING)
+         ).values('pk'), set()),
+        ('feed page',
+         FeedEntry.objects.filter(user=user, recipe_id__lt=100).order_by(
+             '-recipe_id'
+         ).values_list('recipe_id')[:page], set()),
+        ('feed pull recipes',
+         Recipe.objects.filter(author__in=Subscription.objects.filter(
+             user=user, author__feed_pull=True
+         ).values('author'), pk__lt=100).order_by('-id').values_list(
+             'id'
+         )[:page], set()),
+        ('feed of unfollowed author',
+         FeedEntry.objects.filter(
+             user=user, recipe__author__in=[1]
+         ).values('pk'), set()),
+    ]
+
+
+def explain_checks(using='default'):
+    """Планы запросов checks(): тройки (имя, строки плана, таблицы,
+    прочитанные целиком сверх разрешенных).
+
+    Для СУБД без поддержки вызывает NotImplementedError.
+    """
+    connection = connections[using]
+    explain = EXPLAIN.get(connection.vendor)
+    if explain is None:
+        raise NotImplementedError(
+            f'Проверка планов для {connection.vendor} не поддерживается.'
+        )
+    for name, queryset, allowed in checks(User(pk=1)):
+        sql, params = queryset.using(using).query.sql_with_params()
+        with transaction.atomic(using=using):
+            with connection.cursor() as cursor:
+                plan, scans = explain(cursor, sql, params)
+        yield name, plan, scans - allowed
@@ -0,0 +1,156 @@
+import re
+
+from django.db import connections, models
+from django.db.models.expressions import RawSQL
+
+WORD = re.compile(r'\w+')
+
+
+def normalize(text):
+    return text.lower().replace('ё', 'е')
+
+
+def terms(query):
+    return WORD.findall(normalize(query))
+
+
+class SQLiteSearch:
+    """Полнотекстовый индекс рецептов на виртуальной таблице FTS5."""
+
+    table = 'recipes_recipe_fts'
+    create_sql = (
+        f'CREATE VIRTUAL TABLE IF NOT EXISTS {table} USING fts5('
+        'name, ingredients, text, tokenize="unicode61 remove_diacritics 2")'
+    )
+    drop_sql = f'DROP TABLE IF EXISTS {table}'
+    delete_sql = f'DELETE FROM {table} WHERE rowid = %s'
+    insert_sql = (
+        f'INSERT INTO {table} (rowid, name, ingredients, text) '
+        'VALUES (%s, %s, %s, %s)'
+    )
+    match_sql = f'SELECT rowid FROM {table} WHERE {table} MATCH %s'
+    rank_sql = (
+        f'SELECT bm25({table}, 10.0, 5.0, 1.0) FROM {table} '
+        f'WHERE {table} MATCH %s AND {table}.rowid = recipes_recipe.id'
+    )
+    rank_ordering = 'search_rank'
+
+    @staticmethod
+    def query(query):
+        return ' '.join(f'"{term}"*' for term in terms(query))
+
+
+class PostgreSQLSearch:
+    """Полнотекстовый индекс рецептов: tsvector с GIN-индексом."""
+
+    table = 'recipes_recipe_search'
+    create_sql = (
+        f'CREATE TABLE IF NOT EXISTS {table} ('
+        'recipe_id bigint PRIMARY KEY REFERENCES recipes_recipe (id) '
+        'ON DELETE CASCADE DEFERRABLE INITIALLY DEFERRED, '
+        'document tsvector NOT NULL); '
+        f'CREATE INDEX IF NOT EXISTS {table}_document_gin '
+        f'ON {table} USING gin (document)'
+    )
+    drop_sql = f'DROP TABLE IF EXISTS {table}'
+    delete_sql = f'DELETE FROM {table} WHERE recipe_id = %s'
+    insert_sql = (
+        f'INSERT INTO {table} (recipe_id, document) VALUES (%s, '
+        "setweight(to_tsvector('russian', %s), 'A') || "
+        "setweight(to_tsvector('russian', %s), 'B') || "
+        "setweight(to_tsvector('russian', %s), 'C'))"
+    )
+    match_sql = (
+        f'SELECT recipe_id FROM {table} '
+        "WHERE document @@ to_tsquery('russian', %s)"
+    )
+    rank_sql = (
+        f"SELECT ts_rank(document, to_tsquery('russian', %s)) FROM {table} "
+        f'WHERE {table}.recipe_id = recipes_recipe.id'
+    )
+    rank_ordering = '-search_rank'
+
+    @staticmethod
+    def query(query):
+        return ' & '.join(f'{term}:*' for term in terms(query))
+
+
+BACKENDS = {
+    'sqlite': SQLiteSearch,
+    'postgresql': PostgreSQLSearch,
+}
+
+
+def get_backend(using='default'):
+    return BACKENDS.get(connections[using].vendor)
+
+
+def create_index(schema_editor):
+    backend = BACKENDS.get(schema_editor.connection.vendor)
+    if backend is not None:
+        schema_editor.execute(backend.create_sql)
+
+
+def drop_index(schema_editor):
+    backend = BACKENDS.get(schema_editor.connection.vendor)
+    if backend is not None:
+        schema_editor.execute(backend.drop_sql)
+
+
+def update_index(recipe_ids, using='default', models=None):
+    """Перестраивает документы поиска для рецептов recipe_ids.
+
+    models - пара (Recipe, Amount), если нужны исторические модели
+    миграции.
+    """
+    if models is None:
+        from .models import Amount, Recipe
+    else:
+        Recipe, Amount = models
+    backend = get_backend(using)
+    if backend is None:
+        return
+    recipe_ids = list(recipe_ids)
+    ingredients = {}
+    for recipe_id, name in Amount.objects.using(using).filter(
+        recipe__in=recipe_ids
+    ).values_list('recipe', 'ingredient__name'):
+        ingredients.setdefault(recipe_id, []).append(name)
+    recipes = Recipe.objects.using(using).filter(
+        pk__in=recipe_ids
+    ).values_list('id', 'name', 'text')
+    with connections[using].cursor() as cursor:
+        cursor.executemany(
+            backend.delete_sql, [(recipe_id,) for recipe_id in recipe_ids]
+        )
+        cursor.executemany(backend.insert_sql, [
+            (
+                recipe_id,
+                normalize(name),
+                normalize(' '.join(ingredients.get(recipe_id, ()))),
+                normalize(text)
+            )
+            for recipe_id, name, text in recipes
+        ])
+
+
+def search(queryset, query):
+    """Отбирает рецепты по запросу и упорядочивает их по релевантности.
+
+    Совпадения отбираются некоррелированным подзапросом к индексу,
+    который выполняется один раз; релевантность считается только для
+    отобранных рецептов поиском в индексе по их id.
+    """
+    backend = get_backend(queryset.db)
+    if backend is None:
+        return queryset.filter(name__icontains=query)
+    query = backend.query(query)
+    if not query:
+        return queryset.none()
+    return queryset.filter(
+        pk__in=RawSQL(backend.match_sql, (query,))
+    ).annotate(
+        search_rank=RawSQL(
+            backend.rank_sql, (query,), output_field=models.FloatField()
+        )
+    ).order_by(backend.rank_ordering, '-id')
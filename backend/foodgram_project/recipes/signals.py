@@ -0,0 +1,155 @@
+from django.db import transaction
+from django.db.models.signals import (
+    m2m_changed, post_delete, post_save, pre_delete
+)
+from django.dispatch import Signal, receiver
+
+from . import feed
+from .counters import defer, increment
+from .exports import export_path
+from .images import schedule_variants
+from .indexes import ingredient_index, similar_index
+from .models import (
+    ExportJob, Favorite, Ingredient, Recipe, ShopCart, ShopCartTotal,
+    Subscription, User
+)
+from .search import update_index
+
+# Состав ингредиентов рецепта изменился; отправляется после записи
+# строк Amount, в том числе массовой, аргумент recipe.
+recipe_ingredients_changed = Signal()
+
+
+@receiver(post_save, sender=ShopCart)
+def add_to_cart_totals(sender, instance, created, **kwargs):
+    if created:
+        ShopCartTotal.objects.add_recipe(instance.user_id, instance.recipe_id)
+
+
+@receiver(pre_delete, sender=ShopCart)
+def remove_from_cart_totals(sender, instance, **kwargs):
+    ShopCartTotal.objects.remove_recipe(instance.user_id, instance.recipe_id)
+
+
+@receiver(post_save, sender=Ingredient)
+@receiver(post_delete, sender=Ingredient)
+def invalidate_ingredient_index(sender, **kwargs):
+    ingredient_index.invalidate()
+
+
+@receiver(post_delete, sender=Ingredient)
+def invalidate_similar_index(sender, **kwargs):
+    similar_index.invalidate()
+
+
+def update_similar(recipe_ids):
+    """Обновляет индекс похожих рецептов после фиксации транзакции."""
+    def update():
+        for recipe_id in recipe_ids:
+            similar_index.update(recipe_id)
+    transaction.on_commit(update)
+
+
+@receiver(post_save, sender=Recipe)
+def update_similar_recipe(sender, instance, **kwargs):
+    update_similar([instance.pk])
+
+
+@receiver(recipe_ingredients_changed, sender=Recipe)
+def update_similar_ingredients(sender, recipe, **kwargs):
+    update_similar([recipe.pk])
+
+
+@receiver(m2m_changed, sender=Recipe.tags.through)
+def update_similar_tags(sender, instance, action, reverse, pk_set,
+                        **kwargs):
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    if not reverse:
+        update_similar([instance.pk])
+    elif pk_set is not None:
+        update_similar(pk_set)
+    else:
+        similar_index.invalidate()
+
+
+@receiver(post_delete, sender=Recipe)
+def remove_similar_recipe(sender, instance, **kwargs):
+    recipe_id = instance.pk
+    transaction.on_commit(lambda: similar_index.remove(recipe_id))
+
+
+@receiver(post_save, sender=Recipe)
+@receiver(post_delete, sender=Recipe)
+def update_recipe_search(sender, instance, using, **kwargs):
+    update_index([instance.pk], using=using)
+
+
+@receiver(post_save, sender=Recipe)
+def make_image_variants(sender, instance, **kwargs):
+    schedule_variants(instance)
+
+
+@receiver(recipe_ingredients_changed, sender=Recipe)
+def update_ingredients_search(sender, recipe, **kwargs):
+    update_index([recipe.pk])
+
+
+@receiver(post_save, sender=Recipe)
+def fan_out_recipe(sender, instance, created, **kwargs):
+    if created:
+        feed.schedule(feed.fan_out, instance.pk)
+
+
+@receiver(post_save, sender=Subscription)
+def backfill_feed(sender, instance, created, **kwargs):
+    if created:
+        feed.schedule(feed.backfill, instance.user_id, instance.author_id)
+
+
+@receiver(post_delete, sender=Subscription)
+def clear_feed(sender, instance, **kwargs):
+    feed.unfollow(instance.user_id, [instance.author_id])
+
+
+@receiver(post_delete, sender=ExportJob)
+def remove_export_file(sender, instance, **kwargs):
+    if instance.file:
+        export_path(instance).unlink(missing_ok=True)
+
+
+# Счетчики обновляются последними: их receivers подключены после
+# остальных, так что блокировка строки автора держится до COMMIT
+# как можно меньше. Счетчики рецептов копятся в RecipeCounterDelta
+# и сворачиваются в фоне после записи, см. counters.schedule_fold.
+@receiver(post_save, sender=Recipe)
+def count_new_recipe(sender, instance, created, **kwargs):
+    if created:
+        increment(User, instance.author_id, recipes_count=1)
+
+
+@receiver(post_delete, sender=Recipe)
+def count_deleted_recipe(sender, instance, **kwargs):
+    increment(User, instance.author_id, recipes_count=-1)
+
+
+@receiver(post_save, sender=Favorite)
+def count_new_favorite(sender, instance, created, **kwargs):
+    if created:
+        defer(instance.recipe_id, favorites_count=1)
+
+
+@receiver(post_delete, sender=Favorite)
+def count_deleted_favorite(sender, instance, **kwargs):
+    defer(instance.recipe_id, favorites_count=-1)
+
+
+@receiver(post_save, sender=ShopCart)
+def count_new_cart(sender, instance, created, **kwargs):
+    if created:
+        defer(instance.recipe_id, in_carts_count=1)
+
+
+@receiver(post_delete, sender=ShopCart)
+def count_deleted_cart(sender, instance, **kwargs):
+    defer(instance.recipe_id, in_carts_count=-1)
@@ -0,0 +1,556 @@
+import json
+import shutil
+import tempfile
+from io import BytesIO, StringIO
+from pathlib import Path
+from unittest import mock
+
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.management import CommandError, call_command
+from django.core.files.storage import default_storage
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from PIL import Image
+from rest_framework.test import APIClient
+
+from . import consts, counters, feed
+from .caching import bump_version, local_cache
+from .counters import fold, reconcile
+from .images import make_variants, variant_name, variant_url
+from .indexes import ingredient_index, similar_index
+from .management.commands import load_ingredients
+from .plans import explain_checks
+from .search import update_index
+from .models import (
+    Amount, Favorite, FeedEntry, Ingredient, Recipe, RecipeCounterDelta,
+    ShopCart, ShopCartTotal, Tag, User
+)
+
+
+class AdminShopCartTotalsTest(TestCase):
+    """Правки ингредиентов в админке доходят до итогов корзин."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create_superuser(
+            username='admin', email='admin@example.com',
+            first_name='Admin', last_name='User', password='password-1'
+        )
+        cls.tag = Tag.objects.create(
+            name='tag', slug='tag', color=Tag.GREEN
+        )
+        cls.ingredients = Ingredient.objects.bulk_create(
+            Ingredient(name=f'ingredient {number}', measurement_unit='г')
+            for number in range(3)
+        )
+        cls.ingredients = list(Ingredient.objects.order_by('id'))
+        # bulk_create без сигналов: картинок на диске нет.
+        Recipe.objects.bulk_create(
+            Recipe(
+                author=cls.admin, name=f'recipe {number}', text='text',
+                cooking_time=10, image='static/images/test.png'
+            )
+            for number in range(2)
+        )
+        cls.recipes = list(Recipe.objects.order_by('id'))
+        Amount.objects.bulk_create(
+            Amount(recipe=recipe, ingredient=ingredient, amount=100)
+            for recipe in cls.recipes for ingredient in cls.ingredients[:2]
+        )
+        for recipe in cls.recipes:
+            ShopCart.objects.create(user=cls.admin, recipe=recipe)
+
+    def setUp(self):
+        self.client.force_login(self.admin)
+
+    def assert_totals(self):
+        self.assertEqual(ShopCartTotal.objects.verify(), set())
+
+    def test_amount_change(self):
+        amount = Amount.objects.filter(recipe=self.recipes[0]).first()
+        response = self.client.post(
+            f'/admin/recipes/amount/{amount.pk}/change/', {
+                'recipe': self.recipes[1].pk,
+                'ingredient': self.ingredients[2].pk,
+                'amount': 250,
+            }
+        )
+        self.assertEqual(response.status_code, 302)
+        self.assert_totals()
+
+    def test_amount_delete(self):
+        amount = Amount.objects.first()
+        response = self.client.post(
+            f'/admin/recipes/amount/{amount.pk}/delete/', {'post': 'yes'}
+        )
+        self.assertEqual(response.status_code, 302)
+        self.assert_totals()
+        response = self.client.post('/admin/recipes/amount/', {
+            'action': 'delete_selected',
+            'post': 'yes',
+            '_selected_action': list(
+                Amount.objects.values_list('pk', flat=True)
+            ),
+        })
+        self.assertEqual(response.status_code, 302)
+        self.assertFalse(Amount.objects.exists())
+        self.assert_totals()
+
+    def test_recipe_inline(self):
+        recipe = self.recipes[0]
+        amounts = list(recipe.recipe_ingredients.order_by('id'))
+        data = {
+            'author': self.admin.pk,
+            'tags': self.tag.pk,
+            'name': recipe.name,
+            'text': recipe.text,
+            'cooking_time': recipe.cooking_time,
+            'recipe_ingredients-TOTAL_FORMS': 3,
+            'recipe_ingredients-INITIAL_FORMS': 2,
+            'recipe_ingredients-MIN_NUM_FORMS': 0,
+            'recipe_ingredients-MAX_NUM_FORMS': 1000,
+            'recipe_ingredients-0-id': amounts[0].pk,
+            'recipe_ingredients-0-recipe': recipe.pk,
+            'recipe_ingredients-0-ingredient': self.ingredients[0].pk,
+            'recipe_ingredients-0-amount': 300,
+            'recipe_ingredients-1-id': amounts[1].pk,
+            'recipe_ingredients-1-recipe': recipe.pk,
+            'recipe_ingredients-1-ingredient': self.ingredients[1].pk,
+            'recipe_ingredients-1-amount': 100,
+            'recipe_ingredients-1-DELETE': 'on',
+            'recipe_ingredients-2-recipe': recipe.pk,
+            'recipe_ingredients-2-ingredient': self.ingredients[2].pk,
+            'recipe_ingredients-2-amount': 50,
+        }
+        response = self.client.post(
+            f'/admin/recipes/recipe/{recipe.pk}/change/', data
+        )
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(recipe.recipe_ingredients.count(), 2)
+        self.assert_totals()
+
+    def test_apply(self):
+        first, second, third = self.ingredients
+        ShopCartTotal.objects.apply(
+            [self.admin.pk], {first.pk: 5, second.pk: -200, third.pk: 7}
+        )
+        self.assertEqual(
+            dict(ShopCartTotal.objects.values_list('ingredient', 'total')),
+            {first.pk: 205, third.pk: 7}
+        )
+
+
+class IngredientIndexTest(TestCase):
+    """Индекс ингредиентов видит изменения, сделанные другим процессом."""
+
+    def setUp(self):
+        cache.clear()
+        ingredient_index.invalidate()
+
+    def search(self, query):
+        return [ingredient.name for ingredient in ingredient_index.search(
+            query
+        )]
+
+    def test_version_change(self):
+        Ingredient.objects.create(name='соль', measurement_unit='г')
+        self.assertEqual(self.search('со'), ['соль'])
+        # bulk_create без сигналов, как вставка из другого процесса.
+        Ingredient.objects.bulk_create(
+            [Ingredient(name='сода', measurement_unit='г')]
+        )
+        self.assertEqual(self.search('со'), ['соль'])
+        bump_version(Ingredient)
+        self.assertEqual(self.search('со'), ['сода', 'соль'])
+
+    def test_substring(self):
+        Ingredient.objects.bulk_create([
+            Ingredient(name=name, measurement_unit='г')
+            for name in ('морская соль', 'соль', 'фасоль', 'сахар')
+        ])
+        self.assertEqual(
+            self.search('соль'), ['соль', 'морская соль', 'фасоль']
+        )
+
+    def test_timeout(self):
+        with mock.patch.object(consts, 'INGREDIENT_INDEX_TIMEOUT', 0):
+            self.assertEqual(self.search('со'), [])
+        Ingredient.objects.bulk_create(
+            [Ingredient(name='соль', measurement_unit='г')]
+        )
+        self.assertEqual(self.search('со'), ['соль'])
+
+
+class LoadIngredientsTest(TestCase):
+    """Загрузчик читает CSV и JSON и указывает место ошибки в файле."""
+
+    def load(self, name, content, **options):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        path = Path(directory, name)
+        path.write_text(content, encoding='utf-8')
+        call_command('load_ingredients', path, stdout=StringIO(), **options)
+        return sorted(
+            Ingredient.objects.values_list('name', 'measurement_unit')
+        )
+
+    def test_csv(self):
+        self.assertEqual(
+            self.load('ingredients.csv', 'соль,г\n\nсахар,г\nсоль,г\n'),
+            [('сахар', 'г'), ('соль', 'г')]
+        )
+
+    def test_json(self):
+        records = [
+            {'name': f'ингредиент {number}', 'measurement_unit': 'г'}
+            for number in range(50)
+        ]
+        with mock.patch.object(load_ingredients, 'JSON_CHUNK_SIZE', 16):
+            self.assertEqual(
+                len(self.load('ingredients.json', json.dumps(records))), 50
+            )
+
+    def test_csv_short_row(self):
+        with self.assertRaisesMessage(CommandError, 'Строка 3:'):
+            self.load('ingredients.csv', 'соль,г\nсахар,г\nперец\n')
+        self.assertFalse(Ingredient.objects.exists())
+
+    def test_json_errors(self):
+        cases = (
+            ('[{"name": "соль", "measurement_unit": "г"}, {"name": }]',
+             'Запись 2: некорректный JSON.'),
+            ('[{"name": "соль"}]', 'Запись 1: ожидается объект'),
+            ('[{"name": "соль", "measurement_unit": "г"}',
+             'JSON-массив не закрыт.'),
+            ('{"name": "соль"}', 'Ожидается JSON-массив.'),
+            ('', 'Ожидается JSON-массив.'),
+        )
+        for content, message in cases:
+            with self.subTest(content=content):
+                with self.assertRaisesMessage(CommandError, message):
+                    self.load('ingredients.json', content)
+                self.assertFalse(Ingredient.objects.exists())
+
+
+class SearchTest(TestCase):
+    """Полнотекстовый поиск находит рецепты по префиксам слов названия,
+    ингредиентов и описания и ставит совпадения в названии выше."""
+
+    @classmethod
+    def setUpTestData(cls):
+        author = User.objects.create_user(
+            username='author', email='author@example.com',
+            first_name='Author', last_name='User', password='password-1'
+        )
+        kvass = Ingredient.objects.create(
+            name='Квасная гуща', measurement_unit='г'
+        )
+        # bulk_create без сигналов: картинок на диске нет.
+        Recipe.objects.bulk_create(
+            Recipe(
+                author=author, name=name, text=text, cooking_time=10,
+                image='static/images/test.png'
+            )
+            for name, text in (
+                ('Суп', 'Варить час.'),
+                ('Квас домашний', 'Настоять хлеб.'),
+                ('Окрошка', 'Залить квасом овощи.'),
+                ('Ёжики', 'Фарш и рис.'),
+            )
+        )
+        cls.soup, cls.kvass, cls.okroshka, cls.hedgehogs = (
+            Recipe.objects.order_by('id')
+        )
+        Amount.objects.create(recipe=cls.soup, ingredient=kvass, amount=5)
+        update_index(Recipe.objects.values_list('id', flat=True))
+
+    def search(self, query):
+        return list(Recipe.objects.search(query))
+
+    def test_rank(self):
+        self.assertEqual(
+            self.search('квас'), [self.kvass, self.soup, self.okroshka]
+        )
+
+    def test_prefix_and_yo(self):
+        self.assertEqual(self.search('ежик'), [self.hedgehogs])
+        self.assertEqual(self.search('фарш ри'), [self.hedgehogs])
+        self.assertEqual(self.search('фарш квас'), [])
+
+    def test_empty_query(self):
+        self.assertEqual(self.search('!!!'), [])
+
+    def test_update(self):
+        self.hedgehogs.text = 'Квас не нужен.'
+        self.hedgehogs.save(update_fields=['text'])
+        self.assertIn(self.hedgehogs, self.search('квас'))
+        self.kvass.delete()
+        self.assertNotIn(self.kvass, self.search('квас'))
+
+
+class ImageVariantsTest(TestCase):
+    """Готовность вариантов не проверяется в хранилище на каждый адрес."""
+
+    def setUp(self):
+        local_cache.clear()
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        settings = override_settings(MEDIA_ROOT=media_root)
+        settings.enable()
+        self.addCleanup(settings.disable)
+        buffer = BytesIO()
+        Image.new('RGB', (800, 600)).save(buffer, format='PNG')
+        self.image = Recipe(image=default_storage.save(
+            'static/images/test.png', ContentFile(buffer.getvalue())
+        )).image
+
+    def test_storage_calls(self):
+        with mock.patch.object(
+            default_storage, 'exists', wraps=default_storage.exists
+        ) as exists:
+            for _ in range(3):
+                self.assertEqual(
+                    variant_url(self.image, 'thumbnail'), self.image.url
+                )
+            self.assertEqual(exists.call_count, 1)
+            make_variants(None, self.image.name)
+            exists.reset_mock()
+            for _ in range(3):
+                self.assertEqual(
+                    variant_url(self.image, 'thumbnail'),
+                    default_storage.url(
+                        variant_name(self.image.name, 'thumbnail')
+                    )
+                )
+            exists.assert_not_called()
+
+
+class QueryPlansTest(TestCase):
+    """Основные запросы API не читают таблицы целиком."""
+
+    def test_no_full_scans(self):
+        for name, plan, scans in explain_checks():
+            with self.subTest(name=name):
+                self.assertEqual(scans, set(), '\n'.join(plan))
+
+
+class CounterDeltasTest(TestCase):
+    """Переключатели не обновляют строку рецепта, счетчики догоняют
+    данные после свертки."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(
+            username='reader', email='reader@example.com',
+            first_name='Reader', last_name='User', password='password-1'
+        )
+        # bulk_create без сигналов: картинок на диске нет.
+        Recipe.objects.bulk_create(
+            Recipe(
+                author=cls.user, name=f'recipe {number}', text='text',
+                cooking_time=10, image='static/images/test.png'
+            )
+            for number in range(3)
+        )
+        cls.recipes = list(Recipe.objects.order_by('id'))
+        reconcile()
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def assert_counters(self, recipe, favorites, in_carts):
+        recipe.refresh_from_db()
+        self.assertEqual(
+            (recipe.favorites_count, recipe.in_carts_count),
+            (favorites, in_carts)
+        )
+
+    def test_fold(self):
+        recipe = self.recipes[0]
+        with CaptureQueriesContext(connection) as queries:
+            self.client.post(f'/api/recipes/{recipe.pk}/favorite/')
+            self.client.post(f'/api/recipes/{recipe.pk}/shopping_cart/')
+            self.client.post('/api/recipes/favorite/bulk/', {
+                'ids': [recipe.pk for recipe in self.recipes]
+            }, format='json')
+        self.assertFalse([
+            query['sql'] for query in queries
+            if query['sql'].startswith('UPDATE "recipes_recipe"')
+        ])
+        self.assertEqual(Favorite.objects.count(), 3)
+        self.assert_counters(recipe, 0, 0)
+        self.assertEqual(set(reconcile(dry_run=True).values()), {0})
+        self.assertEqual(fold(batch_size=2), 4)
+        self.assertFalse(RecipeCounterDelta.objects.exists())
+        self.assert_counters(recipe, 1, 1)
+        self.assert_counters(self.recipes[1], 1, 0)
+        self.client.delete(f'/api/recipes/{recipe.pk}/favorite/')
+        self.assertEqual(reconcile(), {
+            'user.recipes_count': 0,
+            'recipe.favorites_count': 0,
+            'recipe.in_carts_count': 0,
+        })
+        self.assert_counters(recipe, 0, 1)
+
+    @mock.patch.object(counters, 'last_fold', 0)
+    @mock.patch.object(counters.pool, 'schedule')
+    def test_fold_after_write(self, schedule):
+        recipe = self.recipes[0]
+        self.client.post(f'/api/recipes/{recipe.pk}/favorite/')
+        self.client.post(f'/api/recipes/{recipe.pk}/shopping_cart/')
+        schedule.assert_called_once_with(fold)
+        with mock.patch.object(consts, 'COUNTER_FOLD_INTERVAL', 0):
+            self.client.delete(f'/api/recipes/{recipe.pk}/favorite/')
+        self.assertEqual(schedule.call_count, 2)
+
+    def test_deleted_recipe(self):
+        recipe = self.recipes[0]
+        self.client.post(f'/api/recipes/{recipe.pk}/favorite/')
+        # Удаление избранного вместе с рецептом - второе изменение.
+        Recipe.objects.filter(pk=recipe.pk).delete()
+        self.assertEqual(fold(), 2)
+        self.assertFalse(RecipeCounterDelta.objects.exists())
+
+
+class SimilarIndexTest(TestCase):
+    """Индекс похожих рецептов перестраивается, не останавливая
+    запросы, и не теряет изменений, сделанных во время сборки."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(
+            username='author', email='author@example.com',
+            first_name='Author', last_name='User', password='password-1'
+        )
+        cls.ingredients = Ingredient.objects.bulk_create(
+            Ingredient(name=f'ingredient {number}', measurement_unit='г')
+            for number in range(3)
+        )
+        cls.ingredients = list(Ingredient.objects.order_by('id'))
+        # bulk_create без сигналов: картинок на диске нет.
+        Recipe.objects.bulk_create(
+            Recipe(
+                author=cls.user, name=f'recipe {number}', text='text',
+                cooking_time=10, image='static/images/test.png'
+            )
+            for number in range(3)
+        )
+        cls.recipes = list(Recipe.objects.order_by('id'))
+        Amount.objects.bulk_create(
+            Amount(recipe=recipe, ingredient=cls.ingredients[0], amount=100)
+            for recipe in cls.recipes[:2]
+        )
+
+    def setUp(self):
+        similar_index.invalidate()
+        self.addCleanup(similar_index.invalidate)
+
+    def similar(self, recipe):
+        return similar_index.similar(recipe.pk, 5)
+
+    def test_update_during_build(self):
+        first, second, third = self.recipes
+        build = similar_index.build
+
+        def build_and_update():
+            data = build()
+            # Рецепт изменили, пока индекс читался из базы.
+            Amount.objects.create(
+                recipe=third, ingredient=self.ingredients[0], amount=100
+            )
+            similar_index.update(third.pk)
+            return data
+
+        with mock.patch.object(similar_index, 'build', build_and_update):
+            self.assertEqual(self.similar(first), [third.pk, second.pk])
+        self.assertEqual(self.similar(first), [third.pk, second.pk])
+
+    def test_stale_while_building(self):
+        first, second, _ = self.recipes
+        self.assertEqual(self.similar(first), [second.pk])
+        similar_index._loaded = 0
+        with similar_index._build_lock:
+            with mock.patch.object(similar_index, 'build') as build:
+                self.assertEqual(self.similar(first), [second.pk])
+        build.assert_not_called()
+
+
+# Раскладка ленты выполняется сразу, а не в пуле после фиксации.
+@mock.patch.object(
+    feed.pool, 'schedule', lambda function, *args: function(*args)
+)
+class FeedTest(TestCase):
+    """Лента раскладывается при публикации и подписке, чистится при
+    отписке, рецепты плодовитых авторов подмешиваются при чтении."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user, cls.author, cls.prolific = (
+            User.objects.create_user(
+                username=name, email=f'{name}@example.com',
+                first_name=name, last_name='User', password='password-1'
+            )
+            for name in ('reader', 'author', 'prolific')
+        )
+        # bulk_create без сигналов: картинок на диске нет.
+        Recipe.objects.bulk_create(
+            Recipe(
+                author=author, name=f'recipe {number}', text='text',
+                cooking_time=10, image='static/images/test.png'
+            )
+            for number in range(3) for author in (cls.author, cls.prolific)
+        )
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def subscribe(self, author, method='post'):
+        response = getattr(self.client, method)(
+            f'/api/users/{author.pk}/subscribe/'
+        )
+        self.assertLess(response.status_code, 300, response.content)
+
+    def ids(self, author):
+        return list(Recipe.objects.filter(author=author).order_by(
+            '-id'
+        ).values_list('id', flat=True))
+
+    def test_backfill_and_unfollow(self):
+        self.subscribe(self.author)
+        self.assertEqual(feed.page(self.user), self.ids(self.author))
+        self.subscribe(self.author, 'delete')
+        self.assertFalse(FeedEntry.objects.exists())
+        self.assertEqual(feed.page(self.user), [])
+
+    @mock.patch('recipes.signals.schedule_variants')
+    def test_fan_out(self, schedule_variants):
+        self.subscribe(self.author)
+        recipe = Recipe.objects.create(
+            author=self.author, name='new', text='text', cooking_time=10,
+            image='static/images/test.png'
+        )
+        self.assertTrue(
+            FeedEntry.objects.filter(user=self.user, recipe=recipe).exists()
+        )
+        self.assertEqual(feed.page(self.user, limit=1), [recipe.pk])
+
+    def test_pull(self):
+        User.objects.filter(pk=self.prolific.pk).update(feed_pull=True)
+        self.subscribe(self.author)
+        self.subscribe(self.prolific)
+        self.assertFalse(
+            FeedEntry.objects.filter(recipe__author=self.prolific).exists()
+        )
+        expected = sorted(
+            self.ids(self.author) + self.ids(self.prolific), reverse=True
+        )
+        # Разложенные рецепты и рецепты всех подмешиваемых авторов.
+        with self.assertNumQueries(2):
+            self.assertEqual(feed.page(self.user, limit=10), expected)
+        self.assertEqual(
+            feed.page(self.user, before=expected[1], limit=2), expected[2:4]
+        )